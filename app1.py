@@ -10,8 +10,10 @@ import diskcache
 # For dash < 2.0
 # import dash_core_components as dcc
 # import dash_html_components as html
-from dash.dependencies import Input, Output
-import plotly.graph_objs as go
+import hashlib
+import multiprocessing
+import os
+import sys
 import time
 
 import numpy as np
@@ -23,17 +25,34 @@ from cadCAD.engine import ExecutionMode, ExecutionContext, Executor
 from cadCAD.configuration.utils import config_sim
 
 import utils
+import figures
+import fixed_point
+import metrics
+import quotes
 import sigmoid as sigmoid
 import sigmoid_dash_ui as sigmoid_ui
 
 import market
 from token_user import TokenUser
+from fast_forward import FastForward
+import curve_store
+import checkpoint
+import recording
+import audit
+import memory
+import kernel
+import schedule
+import online_stats
+import price_impact
+from checkpoint import Checkpointer
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
-cache = diskcache.Cache("./cache")
+# Directory of the diskcache shared by the processes, APP_CACHE if set
+cache_path = os.environ.get('APP_CACHE', os.path.join('.', 'cache'))
+cache = diskcache.Cache(cache_path)
 long_callback_manager = DiskcacheLongCallbackManager(cache)
 
 sigmoid.k_max = market.max_price / 2
@@ -41,19 +60,98 @@ sigmoid.min_slope = market.max_supply / 2
 sigmoid.max_slope = market.max_supply * 1e3
 sigmoid.slope_step = (sigmoid.max_slope - sigmoid.min_slope) * .1
 
+# Integer fixed-point accounting in units of 1/scale, e.g.
+# fixed_point.default_scale.  None keeps float balances.
+accounting_scale = None
+# Directory of memory-mapped curve tables, None to build them per process
+curve_store_path = curve_store.default_path
+
+# Curve tables shared read-only between worker processes
+curve_tables = curve_store.CurveStore(curve_store_path) if curve_store_path else None
+
 sigmoid_market = market.Market(
     sigmoid.Sigmoid(market.min_supply, 
                     market.initial_supply, 
-                    market.max_price/2))
+                    market.max_price/2),
+    scale=accounting_scale,
+    curve_store=curve_tables)
 sigmoid_ui.sigmoid_market = sigmoid_market
+# Curve figure payloads are shared by the processes through the diskcache
+sigmoid_ui.figure_cache = cache
 
-token_user = TokenUser(0, 100000.0)
+token_user = TokenUser(0, 100000.0, scale=accounting_scale)
+# Stochastic demand of the agent, e.g. order_flow.OrderFlow(seed=0), which
+# runs it with the 'Flow' policy.  None keeps token_user.policy
+agent_order_flow = None
 
 # Initialize Dash UI components 
 app = sigmoid_ui.init_app(sigmoid)
 server = app.server
 app.config['suppress_callback_exceptions']=True
 
+# Prometheus metrics at /metrics
+metrics.instrument(server)
+cache.stats(enable=True)
+
+# Long callbacks run in their own processes, so simulation metrics are
+# totals kept in a diskcache, shared by all the workers and read at scrape
+# time.  It keeps no statistics, so reading them is not a cache hit
+metrics_cache = diskcache.Cache(os.path.join(cache.directory, 'metrics'))
+metrics_prefix = 'metrics'
+simulations_running_key = 'metrics-simulations-running'
+simulation_steps_key = f'{metrics_prefix}-{metrics.simulation_steps.name}'
+# Histograms of the simulations, see record_simulation
+shared_histograms = [metrics.simulation_steps_per_second, metrics.simulation_peak_rss]
+
+
+def observe_shared(histogram, value):
+    """Add value to the totals of histogram in metrics_cache."""
+    metrics_cache.incr(f'{metrics_prefix}-{histogram.name}-{histogram.bucket(value)}')
+    metrics_cache.incr(f'{metrics_prefix}-{histogram.name}-sum', value)
+
+
+def record_simulation(steps, seconds, peak_rss=None):
+    with metrics_cache.transact():
+        metrics_cache.incr(simulation_steps_key, steps)
+        observe_shared(metrics.simulation_steps_per_second, steps / max(seconds, 1e-9))
+        if peak_rss is not None:
+            observe_shared(metrics.simulation_peak_rss, peak_rss)
+
+
+def collect_metrics():
+    # every worker reports the same totals, the histograms are set in place
+    steps = metrics_cache.get(simulation_steps_key)
+    if steps is not None:
+        metrics.simulation_steps.values = {(): steps}
+    for histogram in shared_histograms:
+        name = f'{metrics_prefix}-{histogram.name}'
+        counts = [metrics_cache.get(f'{name}-{i}', 0) for i in range(len(histogram.buckets) + 1)]
+        if any(counts):
+            histogram.values = {(): (counts, metrics_cache.get(f'{name}-sum', 0.0))}
+    hits, misses = cache.stats()
+    collected = [
+        ('simulations_running', 'gauge', 'Simulations being run.', cache.get(simulations_running_key, 0)),
+        ('long_callback_cache_hits_total', 'counter', 'Long callback cache hits.', hits),
+        ('long_callback_cache_misses_total', 'counter', 'Long callback cache misses.', misses),
+        ('long_callback_cache_hit_ratio', 'gauge', 'Long callback cache hit ratio.', hits / max(hits + misses, 1)),
+        ('warm_up_running', 'gauge', 'Cache warm-up in progress.', int(cache.get(warm_up_key) is not None)),
+    ]
+    if curve_tables is not None:
+        hits, misses = curve_tables.hits, curve_tables.misses
+        collected += [
+            ('curve_store_hits_total', 'counter', 'Curve tables loaded from the curve store.', hits),
+            ('curve_store_misses_total', 'counter', 'Curve tables built and stored.', misses),
+            ('curve_store_hit_ratio', 'gauge', 'Curve store hit ratio.', hits / max(hits + misses, 1)),
+        ]
+    return collected
+
+
+metrics.add_collector(collect_metrics)
+
+# Trade quotes at /quote over the market's curve tables
+quote_engine = quotes.QuoteEngine(sigmoid_market)
+quotes.init_quotes(server, quote_engine)
+
 # May want to configure this through UI
 # sim_duration = 1000  # 100
 simulation_parameters = {
@@ -66,6 +164,53 @@ simulation_parameters = {
     #     "max_price": sigmoid_market.max_price
     # }
 }
+# Skip cadCAD for the deterministic phases of single agent 'Buy' runs
+fast_forward = True
+# Checkpoint cadCAD runs every checkpoint_every steps so that an
+# interrupted run resumes where it stopped, None to disable.  Only single
+# run (N == 1) cadCAD runs are checkpointed, fast-forwarded runs are not
+checkpoint_every = 1000
+checkpoint_path = checkpoint.default_path
+# Steps per chunk of results passed to a recording.Recorder
+recording_segment = 1000
+# Recording policy of the dashboard simulations, e.g. recording.Every(10),
+# None to keep every step.  It must keep all the state variables at the
+# same timesteps (All, Every or Final), see recording.py
+recording_policy = None
+# First timestep of the segment being run, see run_segments
+timestep_offset = 0
+# Check the invariants of every step of the results (see audit.py)
+audit_results = True
+# Fraction of steps whose live market is checked during the run, None to
+# disable.  Only effective for N == 1, see audit.py
+audit_sample_rate = None
+auditor = audit.Auditor(sigmoid_market)
+# Time between snapshots of the streaming run statistics, None to keep
+# the final values only (see online_stats.py).  Runs with a recorder keep
+# the final values only
+statistics_every = 100
+# Statistics of the last run, checkpointed with it
+run_statistics = None
+# Changes of the curve parameters during the run, a schedule.Schedule such
+# as schedule.Schedule.linear('tax', 0.2, 0.05, 100, 1000, 100), or None
+curve_schedule = None
+# Seconds the results of a simulation are kept in the diskcache after
+# their last use, served again for the same curve table and settings.
+# None to always run the simulation
+result_expire = 24 * 3600
+results_prefix = 'results'
+# Precompute the curve tables, curve figures and default simulation results
+# of every scenario in a background process when the server starts, see
+# init_app.  WARM_UP=1 or 0 turns it on or off; unset, it is on for
+# python app1.py and off when app1 is imported, so a WSGI server
+# (gunicorn app1:server) needs WARM_UP=1
+warm_up = {'1': True, '0': False}.get(os.environ.get('WARM_UP'))
+# Supplies whose curves are warmed up; simulations are run at the first,
+# the dashboard's default
+warm_up_supplies = [market.initial_supply, market.min_supply, market.max_supply]
+warm_up_key = 'warm-up-running'
+# Seconds after which a warm-up that did not finish is no longer waited on
+warm_up_timeout = 3600
 
 #
 # Initialize agent and market
@@ -90,7 +235,8 @@ def bootstrap_simulation():
                          'tokens': token_user.tokens}
     }
     logger.info(f'bootstrap_simulation duration T {simulation_parameters["T"]}')
-    return initial_conditions, config_sim(simulation_parameters)
+    # config_sim adds to the dict it is given
+    return initial_conditions, config_sim(dict(simulation_parameters))
 
 def s_timestamp(params, substep, state_history, previous_state, policy_input):
     value = policy_input['timestamp']
@@ -114,6 +260,8 @@ def transact(params, substep, history, prev_state, input):
         fee = 0
 
     # logger.info(f'transact action {action} amount {amount} fee {fee} tokens {number_of_tokens}')
+    # the agent settles its trade in the same step, as kernel.step
+    token_user.transaction_update(action, number_of_tokens, amount, fee)
     agent_txn = {'action': action,
                  'amount': amount,
                  'fee': fee,
@@ -122,6 +270,7 @@ def transact(params, substep, history, prev_state, input):
     return ('agent_txn', agent_txn)
 
 def market_state(params, substep, history, prev_state, input):
+    auditor.sample(prev_state['timestep'] + 1 + timestep_offset, prev_state.get('run', 1))
     buy_price = sigmoid_market.buy_price()
     sell_price = sigmoid_market.sell_price()
     market_state = {'tokens_circulation': sigmoid_market.tokens_circulation,
@@ -160,35 +309,118 @@ def agent_choices(params, substep, history, state) -> dict:
         The pursuer's action as an array.
     """
     # logger.debug(f'get_transaction\nparams:\n{params}\nstep:\n{substep}\nhistory:\n{history}\nstate:\n{state}')
-    action, number_of_tokens = token_user.get_transaction(state['market_state']['buy_price'])
+    timestep = state['timestep'] + timestep_offset
+    if timestep == 0:
+        # Monte Carlo runs may execute in reused cadCAD worker processes,
+        # so every run starts from the initial market and agent
+        sigmoid_market.reset()
+        token_user.reset()
+        if curve_schedule:
+            curve_schedule.reset()
+    if curve_schedule:
+        # the trade of the next timestep uses its curve
+        curve_schedule.apply(timestep + 1)
+    action, number_of_tokens = token_user.get_transaction(state['market_state']['buy_price'],
+                                                          state.get('run', 1), timestep, sigmoid_market)
     return {'action': action, 'number_of_tokens': number_of_tokens}
             
 def update_agents(params, substep, history, prev_state, input):
     # logger.debug(f'\n>> update_agents\nparams:\n{params}\nstep:\n{substep}\nhistory:\n{history}\nstate:\n{prev_state}\ninput:\n{input}')
-    action = input.get('action', 'Undefined')
-    tokens = prev_state['agent_txn']['tokens']
-    amount = prev_state['agent_txn']['amount']
-    fee = prev_state['agent_txn']['fee']
-    # logger.info(f'update_capital amount {amount} fee {fee} prev_state {prev_state[y]}')
-    capital, tokens = token_user.transaction_update(action, tokens, amount, fee)
-    agent_state = {'capital': capital, 
-                   'tokens': tokens}
+    # settled with the trade of this step in transact, which runs first
+    agent_state = {'capital': token_user.capital,
+                   'tokens': token_user.tokens}
     # logger.debug(f'agent_state {agent_state}')
 
     return ('agent_state', agent_state) 
 
 # cadacad simulation
-def run_simulation():
+def run_simulation(fast_forward=None, recorder=None):
     '''
     Definition:
     Run simulation
+
+    With a recording.Recorder, results are passed to it in chunks of
+    recording_segment steps and its frame() is returned, so memory use
+    follows the recording policies rather than the simulation length.
     '''
+    if fast_forward is None:
+        fast_forward = globals()['fast_forward']
+    global run_statistics
+    # snapshots grow with the run, a recorded run keeps the final values
+    run_statistics = online_stats.OnlineStats(statistics_every if recorder is None else None,
+                                              accounting_scale)
+
     # initialize market and agent
+    if agent_order_flow is not None:
+        token_user.order_flow = agent_order_flow
+        token_user.policy = 'Flow'
     sigmoid_market.reset()
     token_user.reset()
-    
-    exp = Experiment()
+    auditor.rate = audit_sample_rate
+    auditor.reset()
+    # the reserve depends on the path once the curve changes
+    auditor.reserve_checked = not curve_schedule
+
+    # fast-forward needs the same curve for the whole run
+    # the policies only read the last transaction, a recorded run keeps
+    # no more of them
+    token_user.history_limit = 1 if recorder is not None else None
+
+    if fast_forward and token_user.policy == 'Buy' and not curve_schedule:
+        logger.info('Run Simulation (fast-forward)')
+        if checkpoint_every and len(simulation_parameters['T']) > checkpoint_every:
+            logger.info('Fast-forwarded runs are not checkpointed')
+        ff = FastForward(sigmoid_market, token_user)
+        if recorder is None:
+            ff.run(len(simulation_parameters['T']))
+            ff.apply()
+            return audit_frame(ff.to_frame(runs=simulation_parameters['N']))
+        # simulated in recording segments, each recorded and dropped
+        ff.run(len(simulation_parameters['T']), recording_segment,
+               lambda start, stop: recorder.record_frame(audit_frame(
+                   ff.to_frame(runs=simulation_parameters['N'], start=start, stop=stop))))
+        ff.apply()
+        return recorder.frame()
+
+    if curve_schedule:
+        curve_schedule.start(sigmoid_market)
+        try:
+            return run_cadcad(recorder)
+        finally:
+            # leave the market on the curve the run started with
+            curve_schedule.reset()
+    return run_cadcad(recorder)
+
+
+def run_cadcad(recorder=None):
     initial_conditions, sim_params = bootstrap_simulation()
+    steps = len(simulation_parameters['T'])
+    if simulation_parameters['N'] == 1:
+        if checkpoint_every and steps > checkpoint_every:
+            return run_segments(initial_conditions, steps, checkpoint_every, recorder, checkpointed=True)
+        if recorder is not None:
+            return run_segments(initial_conditions, steps, recording_segment, recorder)
+    elif checkpoint_every and steps > checkpoint_every:
+        logger.info(f'Runs with N = {simulation_parameters["N"]} are not checkpointed')
+    result = audit_frame(execute(initial_conditions, sim_params))
+    if recorder is None:
+        return result
+    recorder.record_frame(result)
+    return recorder.frame()
+
+
+def audit_frame(result):
+    """Check the invariants of a chunk of results and add it to the run
+    statistics, in run order."""
+    if audit_results:
+        auditor.audit_frame(result)
+    if run_statistics is not None:
+        run_statistics.update_frame(result)
+    return result
+
+
+def execute(initial_conditions, sim_params):
+    exp = Experiment()
 
     partial_state_update_blocks = [
         { 
@@ -223,6 +455,70 @@ def run_simulation():
     return result
 
 
+def run_segments(initial_conditions, steps, segment_steps, recorder=None, checkpointed=False):
+    """Run the simulation in segments of segment_steps steps.
+
+    Each segment starts from the last state of the previous one, so the
+    records are the same as a single run.  Segments are passed to the
+    recorder as they complete when there is one.
+
+    With checkpointed, the state is checkpointed after each segment and, if
+    a checkpoint of the same run exists, the run resumes from it.
+    """
+    checkpoints = None
+    segments = []
+    step = 0
+    if checkpointed:
+        checkpoints = Checkpointer(
+            checkpoint.run_id(sigmoid_market, [token_user], steps,
+                              initial_conditions, recorder, curve_schedule),
+            checkpoint_path)
+        snapshot = checkpoints.latest()
+        if snapshot is not None:
+            logger.info(f'Resuming simulation at step {snapshot["step"]}')
+            checkpoints.restore(snapshot, sigmoid_market, [token_user],
+                                statistics=run_statistics, auditor=auditor)
+            if recorder is None:
+                segments = checkpoints.segments(snapshot['segments'])
+            else:
+                vars(recorder).update(vars(snapshot['recorder']))
+            step = snapshot['step']
+            initial_conditions = snapshot['state']
+
+    state_columns = list(initial_conditions.keys())
+    index = len(segments)
+    global timestep_offset
+    while step < steps:
+        n = min(segment_steps, steps - step)
+        timestep_offset = step
+        try:
+            segment = execute(initial_conditions, config_sim({'T': range(n), 'N': 1}))
+        finally:
+            timestep_offset = 0
+        # drop the initial state, it is the last row of the previous segment
+        if step > 0:
+            segment = segment[segment['timestep'] > 0].reset_index(drop=True)
+        segment['timestep'] += step
+        audit_frame(segment)
+        step += n
+        initial_conditions = segment.iloc[-1][state_columns].to_dict()
+        if recorder is None:
+            segments.append(segment)
+        else:
+            recorder.record_frame(segment)
+        if checkpoints is not None:
+            checkpoints.save(step, index, segment if recorder is None else None,
+                             initial_conditions, sigmoid_market, [token_user], recorder,
+                             statistics=run_statistics, auditor=auditor)
+        index += 1
+
+    if checkpoints is not None:
+        checkpoints.clear()
+    if recorder is None:
+        return pd.concat(segments, ignore_index=True)
+    return recorder.frame()
+
+
 # display supply slider value
 @app.callback(
     Output('sim-slider-output-container', 'children'),
@@ -276,17 +572,12 @@ def sim_table(data):
 
 @app.long_callback(
     [Output('market-circulation-graph-container', 'style'),
-     Output('market-circulation-graph', 'figure'),
      Output('market-buysell-graph-container', 'style'),
-     Output('market-buysell-graph', 'figure'),
      Output('market-price-graph-container', 'style'),
-     Output('market-price-graph', 'figure'),
      Output('market-funds-graph-container', 'style'),
-     Output('market-funds-graph', 'figure'),
      Output('market-capital-graph-container', 'style'),
-     Output('market-capital-graph', 'figure'),
      Output('pit-agent-graph-container', 'style'),
-     Output('pit-agent-graph', 'figure'),
+     Output('sim-data', 'data'),
      Output('sim-table-div', 'children'),
      Output('mkt-table-div', 'children'),
      Output("sim-notes", "value")],
@@ -298,257 +589,191 @@ def sim_table(data):
     ],)
 def on_simulation(n_clicks):
     logger.info('Run Simulation')
+    return cached_simulation()
+
+
+# Sources the simulation results depend on, so that results cached by
+# an earlier release are not served
+results_version = hashlib.sha1(b''.join(
+    open(m.__file__, 'rb').read()
+    for m in [sys.modules[__name__], market, kernel, schedule, sigmoid, figures, audit, memory, fixed_point,
+              online_stats, sys.modules[TokenUser.__module__], sys.modules[FastForward.__module__]])).hexdigest()[:12]
+
+
+def result_key():
+    """Key of the results of a simulation of the market's curve table with
+    the current settings, None when results are not cached."""
+    if not result_expire or sigmoid_market.token_dynamics is None:
+        return None
+    return f'{results_prefix}-' + checkpoint.run_id(
+        sigmoid_market, [token_user], results_version, len(simulation_parameters['T']),
+        simulation_parameters['N'], fast_forward, accounting_scale, audit_results, audit_sample_rate,
+        curve_schedule, recording_policy)
+
+
+def cached_simulation():
+    """The outputs of on_simulation, from the result cache if the same
+    simulation has been run."""
+    key = result_key()
+    viz = cache.get(key) if key is not None else None
+    if viz is not None:
+        logger.info(f'Simulation results from the cache {key}')
+        cache.touch(key, expire=result_expire)
+        return viz[:-1] + [f'Results of an earlier run of the same simulation\n{viz[-1]}']
+    viz = simulate()
+    if key is not None:
+        cache.set(key, viz, expire=result_expire, tag=results_prefix)
+    return viz
 
-    start_time = time.time()
-    sim_df = run_simulation()
-    logger.info("--- Sim ran in %s seconds ---" % (time.time() - start_time))
-
-    start_time = time.time()
-
-    logger.debug(f'on_simulation1 market state {sim_df["market_state"].apply(pd.Series)}')
-    market_state = pd.DataFrame(sim_df['market_state'].to_list())
-    agent_state = pd.DataFrame(sim_df['agent_state'].to_list())
-    logger.debug(f'agent state {agent_state}')
-    agent_state['capital_text'] = agent_state['capital'].apply(utils.format_number)
-    agent_state['tokens_text'] = agent_state['tokens'].apply(utils.format_number)
 
-    sim_df = pd.concat([sim_df, agent_state], axis=1)
- 
-    token_dynamics_tbl = dash_table.DataTable(
-        id='crossfilter-table',
-        sort_action='native',
-        filter_action='native',
-        columns=[{"name": i, "id": i} for i in sigmoid_market.token_dynamics.columns],
-        data=sigmoid_market.token_dynamics.to_dict('records'),
-        style_header={
-            'padding': '15px',
-            'textAlign': 'left',
-            'backgroundColor': 'black',
-            'color': 'white',
-            'fontWeight': 'bold'
-        },
-        style_cell={'padding': '5px','fontSize': 12, 'textAlign': 'right'},
-        style_table={'height': '300px', 'overflowY': 'auto'}
-    )
+def dashboard_recorder():
+    """Recorder of the dashboard simulations, None to keep every step."""
+    if recording_policy is None:
+        return None
+    return recording.Recorder(default=recording_policy)
+
+
+def simulate():
+    with memory.MemoryTracker() as tracker:
+        start_time = time.time()
+        cache.incr(simulations_running_key)
+        try:
+            with tracker.stage('simulation'):
+                sim_df = run_simulation(recorder=dashboard_recorder())
+        finally:
+            cache.decr(simulations_running_key)
+        sim_seconds = time.time() - start_time
+        logger.info("--- Sim ran in %s seconds ---" % sim_seconds)
+        tracker.add_size('curve_table', memory.frame_bytes(sigmoid_market.token_dynamics))
+        tracker.add_size('history', memory.frame_bytes(sim_df))
+        tracker.add_size('transaction_history', memory.list_bytes(token_user.transaction_history))
+
+        start_time = time.time()
+
+        with tracker.stage('unpacking'):
+            logger.debug(f'on_simulation1 market state {sim_df["market_state"].apply(pd.Series)}')
+            market_state = pd.DataFrame(sim_df['market_state'].to_list())
+            agent_state = pd.DataFrame(sim_df['agent_state'].to_list())
+            if sigmoid_market.scale:
+                # Report fixed-point balances in currency
+                market_state = fixed_point.frame_from_units(market_state, sigmoid_market.scale)
+                agent_state = fixed_point.frame_from_units(agent_state, sigmoid_market.scale)
+                agent_txn = fixed_point.frame_from_units(pd.DataFrame(sim_df['agent_txn'].to_list()), sigmoid_market.scale)
+                sim_df['market_state'] = market_state.to_dict('records')
+                sim_df['agent_txn'] = agent_txn.to_dict('records')
+            logger.debug(f'agent state {agent_state}')
+            agent_state['capital_text'] = agent_state['capital'].apply(utils.format_number)
+            agent_state['tokens_text'] = agent_state['tokens'].apply(utils.format_number)
+
+            sim_df = pd.concat([sim_df, agent_state], axis=1)
+
+        with tracker.stage('figures'):
+            token_dynamics_tbl = dash_table.DataTable(
+                id='crossfilter-table',
+                sort_action='native',
+                filter_action='native',
+                columns=[{"name": i, "id": i} for i in sigmoid_market.token_dynamics.columns],
+                data=sigmoid_market.token_dynamics.to_dict('records'),
+                style_header={
+                    'padding': '15px',
+                    'textAlign': 'left',
+                    'backgroundColor': 'black',
+                    'color': 'white',
+                    'fontWeight': 'bold'
+                },
+                style_cell={'padding': '5px','fontSize': 12, 'textAlign': 'right'},
+                style_table={'height': '300px', 'overflowY': 'auto'}
+            )
+
+            sim_data = figures.figure_data(
+                pd.concat([sim_df['timestep'], market_state, agent_state[['capital', 'tokens']]], axis=1),
+                'timestep',
+                ['tokens_circulation', 'tokens_bought', 'tokens_sold',
+                 'buy_price', 'sell_price', 'fund_balance', 'collateral_balance',
+                 'capital', 'tokens'])
+            sim_tbl = sim_table(sim_df)
+        tracker.add_size('sim_data_payload', memory.payload_bytes(sim_data))
+        tracker.add_size('sim_table_payload', memory.payload_bytes(sim_tbl))
+        tracker.add_size('curve_table_payload', memory.payload_bytes(token_dynamics_tbl))
+
+    record_simulation(len(simulation_parameters['T']) * simulation_parameters['N'], sim_seconds,
+                      tracker.peak_rss)
+    logger.info(tracker.summary())
+    # kept with the results in the long callback cache
+    sim_data['memory'] = tracker.report()
+    sim_data['statistics'] = run_statistics.report()
 
-    market_circulation_trace = go.Scatter(
-        x=sim_df['timestep'],
-        y=market_state['tokens_circulation'],
-        mode='lines',
-        line = {'color': '#2ca02c'},
-        name='Circulation',
-        text=market_state['tokens_circulation'],
-        hoverinfo='text')
-
-    market_funds_trace = go.Scatter(
-        x=sim_df['timestep'],
-        y=market_state['fund_balance'],
-        mode='lines',
-        line = {'color': '#2ca02c'},
-        name='Fund Balance')
-
-    market_vault_trace = go.Scatter(
-        x=sim_df['timestep'],
-        y=market_state['collateral_balance'],
-        mode='lines',
-        line = {'color': '#2ca02c'},
-        name='Vault Balance')
-
-    market_buy_price_trace = go.Scatter(
-        x=sim_df['timestep'],
-        y=market_state['buy_price'],
-        mode='lines',
-        line = {'color': '#2ca02c'},
-        name='Buy Price')
-
-    market_sell_price_trace = go.Scatter(
-        x=sim_df['timestep'],
-        y=market_state['sell_price'],
-        mode='lines',
-        line = {'color': '#d62728'},
-        name='Sell Price')
-
-    market_buy_trace = go.Scatter(
-        x=sim_df['timestep'],
-        y=market_state['tokens_bought'],
-        mode='lines',
-        line = {'color': '#2ca02c'},
-        name='Tokens Bought')
-
-    market_sell_trace = go.Scatter(
-        x=sim_df['timestep'],
-        y=market_state['tokens_sold'],
-        mode='lines',
-        line = {'color': '#d62728'},
-        name='Tokens Sold',
-        text=market_state['tokens_sold'],
-        hoverinfo='text')
-
-    agent_capital_trace = go.Scatter(
-        x=sim_df['timestep'],
-        y=agent_state['capital'],
-        mode='lines',
-        line = {'color': '#2ca02c'},
-        name='Capital')
-
-    agent_token_trace = go.Scatter(
-        x=sim_df['timestep'],
-        y=agent_state['tokens'],
-        yaxis='y2',
-        mode='lines',
-        line = {'color': '#d62728'},
-        name='Tokens')
-            
     viz = [
         # Market graphs
         {'display': 'inline-block'},
-        {'data': [market_circulation_trace],
-        'layout': go.Layout(
-            title='Market Circulation',
-            xaxis={'title': 'Time'},
-            yaxis={
-                'title': 'Tokens',
-                'rangemode': 'nonnegative',
-                'hoverformat': '.2f',
-                'titlefont': {'color': '#2ca02c'},
-                'tickfont': {'color': '#2ca02c'}},
-            # yaxis2={
-            #     'title': 'Tokens',
-            #     'rangemode': 'nonnegative',
-            #     'overlaying': 'y',
-            #     'side': 'right',
-            #     'showline': True,
-            #     'titlefont': {'color': '#d62728'},
-            #     'tickfont': {'color': '#d62728'}
-            #     },
-            legend={'x': 0.25, 'yanchor': 'top'}
-            )},
         {'display': 'inline-block'},
-        {'data': [market_buy_trace, market_sell_trace],
-        'layout': go.Layout(
-            title='Buy/Sell Tokens',
-            xaxis={'title': 'Time'},
-            yaxis={
-                'title': 'Tokens',
-                'rangemode': 'nonnegative',
-                'hoverformat': '.2f',
-                'titlefont': {'color': '#2ca02c'},
-                'tickfont': {'color': '#2ca02c'}},
-            yaxis2={
-                'title': 'Tokens',
-                'rangemode': 'nonnegative',
-                'hoverformat': '.2f',
-                'overlaying': 'y',
-                'side': 'right',
-                'showline': True,
-                'titlefont': {'color': '#d62728'},
-                'tickfont': {'color': '#d62728'}
-                },
-            legend={'x': 0.25, 'yanchor': 'top'}
-            )},
         {'display': 'inline-block'},
-        {'data': [market_buy_price_trace, market_sell_price_trace],
-        'layout': go.Layout(
-            title='Buy/Sell Price',
-            xaxis={'title': 'Time'},
-            yaxis={
-                'title': 'Price',
-                'rangemode': 'nonnegative',
-                'titlefont': {'color': '#2ca02c'},
-                'tickfont': {'color': '#2ca02c'}},
-            yaxis2={
-                'title': 'Price',
-                'rangemode': 'nonnegative',
-                'overlaying': 'y',
-                'side': 'right',
-                'showline': True,
-                'titlefont': {'color': '#d62728'},
-                'tickfont': {'color': '#d62728'}
-                },
-            legend={'x': 0.25, 'yanchor': 'top'}
-            )},
         {'display': 'inline-block'},
-        {'data': [market_funds_trace],
-        'layout': go.Layout(
-            title='Market Funds Balance',
-            xaxis={'title': 'Time'},
-            yaxis={
-                'title': 'Amount',
-                'rangemode': 'nonnegative',
-                'hoverformat': '.2f',
-                'titlefont': {'color': '#2ca02c'},
-                'tickfont': {'color': '#2ca02c'}},
-            legend={'x': 0.25, 'yanchor': 'top'}
-            )},
         {'display': 'inline-block'},
-        {'data': [market_vault_trace],
-        'layout': go.Layout(
-            title='Market Collateral Balance',
-            xaxis={'title': 'Time'},
-            yaxis={
-                'title': 'Amount',
-                'rangemode': 'nonnegative',
-                'hoverformat': '.2f',
-                'titlefont': {'color': '#2ca02c'},
-                'tickfont': {'color': '#2ca02c'}},
-            legend={'x': 0.25, 'yanchor': 'top'}
-            )},
         # Agent graphs
         {'display': 'inline-block'},
-        {'data': [agent_capital_trace, agent_token_trace],
-        'layout': go.Layout(
-            title='Agent Point-in-Time',
-            xaxis={'title': 'Time'},
-            yaxis={
-                'title': 'Capital',
-                'rangemode': 'nonnegative',
-                'hoverformat': '.2f',
-                'titlefont': {'color': '#2ca02c'},
-                'tickfont': {'color': '#2ca02c'}},
-            yaxis2={
-                'title': 'Tokens',
-                'rangemode': 'nonnegative',
-                'hoverformat': '.2f',
-                'overlaying': 'y',
-                'side': 'right',
-                'showline': True,
-                'titlefont': {'color': '#d62728'},
-                'tickfont': {'color': '#d62728'}
-                },
-            legend={'x': 0.25, 'yanchor': 'top'}
-            )},
-        # {'display': 'inline-block'},
-        # # TODO: Replace cumulative capital with token value
-        # # {'data': [cum_agent_capital_trace, cum_agent_token_trace],
-        # {'data': [cum_agent_token_trace],
-        # 'layout': go.Layout(
-        #     title='Agent Cumulative Graph',
-        #     xaxis={'title': 'Time'},
-        #     # yaxis={
-        #     #     'title': 'Capital',
-        #     #     'rangemode': 'nonnegative',
-        #     #     'titlefont': {'color': '#2ca02c'},
-        #     #     'tickfont': {'color': '#2ca02c'}},
-        #     yaxis={
-        #         'title': 'Tokens',
-        #         'rangemode': 'nonnegative',
-        #         # 'overlaying': 'y',
-        #         # 'side': 'right',
-        #         # 'showline': True,
-        #         'titlefont': {'color': '#d62728'},
-        #         'tickfont': {'color': '#d62728'}
-        #         },
-        #     legend={'x': 0.25, 'yanchor': 'top'}
-        #     )},
-        sim_table(sim_df),
+        sim_data,
+        sim_tbl,
         token_dynamics_tbl,
-        f'{sim_df.columns}\nSimulation results:\n{sigmoid_market.token_dynamics.head(10)}',
+        f'{run_statistics.summary()}\n{tracker.summary()}\n{auditor.summary()}\n{sim_df.columns}\nSimulation results:\n{sigmoid_market.token_dynamics.head(10)}',
     ]
     logger.info("--- Viz ran in %s seconds ---" % (time.time() - start_time))
     return viz
 
+
+def warm_up_caches():
+    """Fill the curve store, the curve figure and impact cache and the
+    result cache with the dashboard defaults of every scenario.
+
+    Runs in its own process, so the market, agent and simulation settings
+    it changes are copies.  One process warms up the cache at a time;
+    results already cached are not recomputed.
+    """
+    if not cache.add(warm_up_key, os.getpid(), expire=warm_up_timeout):
+        logger.info('Cache warm-up already running')
+        return
+    start_time = time.time()
+    try:
+        for supply in warm_up_supplies:
+            for scenario in sigmoid.scenarios:
+                curve_data = sigmoid_ui.curve_graphs(*sigmoid_ui.default_curve_inputs(scenario, supply))[-1]
+                sigmoid_ui.impact_data(curve_data, price_impact.metrics[0])
+        # the sim-slider default
+        simulation_parameters['T'] = range(int(market.initial_supply))
+        for scenario in sigmoid.scenarios:
+            sigmoid_ui.curve_graphs(*sigmoid_ui.default_curve_inputs(scenario, warm_up_supplies[0]))
+            cached_simulation()
+    except Exception:
+        logger.exception('Cache warm-up failed')
+    finally:
+        cache.delete(warm_up_key)
+    logger.info("--- Cache warm-up ran in %s seconds ---" % (time.time() - start_time))
+
+
+def start_warm_up():
+    """Warm up the caches in a background process, the server does not
+    wait for it."""
+    process = multiprocessing.Process(target=warm_up_caches, name='warm-up', daemon=True)
+    process.start()
+    return process
+
+
+def init_app(default_warm_up:bool=False):
+    """Start the background work of a server process: the cache warm-up
+    when warm_up, or default_warm_up when it is unset."""
+    enabled = default_warm_up if warm_up is None else warm_up
+    # Worker processes started by this one, like the warm-up itself, do not
+    # warm up again
+    if enabled and multiprocessing.parent_process() is None:
+        return start_warm_up()
+
+
+# WSGI servers only import app1, start with their first request
+server.before_first_request(init_app)
+
 #
 # main
 #
 if __name__ == '__main__':
+    init_app(default_warm_up=True)
     app.run_server(debug=True)
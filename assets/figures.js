@@ -0,0 +1,63 @@
+// Clientside rendering of the graphs from the compact payloads built by
+// figures.py.  Layouts and trace styles are static and live in the
+// 'graph-specs' store; only the typed arrays travel on each update.
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    figures: {
+        decode: function(a) {
+            if (!a || a.bdata === undefined) {
+                return a;
+            }
+            var bin = atob(a.bdata);
+            var buf = new ArrayBuffer(bin.length);
+            var bytes = new Uint8Array(buf);
+            for (var i = 0; i < bin.length; i++) {
+                bytes[i] = bin.charCodeAt(i);
+            }
+            var types = {
+                'f4': Float32Array, 'f8': Float64Array,
+                'i1': Int8Array, 'i2': Int16Array, 'i4': Int32Array,
+                'u1': Uint8Array, 'u2': Uint16Array, 'u4': Uint32Array
+            };
+            var values = new types[a.dtype](buf);
+            if (a.shape && a.shape.length === 2) {
+                // rows of a 2d array, as plotly wants for heatmap z
+                var rows = [];
+                for (var r = 0; r < a.shape[0]; r++) {
+                    rows.push(values.subarray(r * a.shape[1], (r + 1) * a.shape[1]));
+                }
+                return rows;
+            }
+            return values;
+        },
+
+        render: function(data, graph_id, specs) {
+            var spec = specs && specs[graph_id];
+            if (!data || !spec) {
+                return {};
+            }
+            var decode = window.dash_clientside.figures.decode;
+            var x = decode(data.x);
+            var traces = [];
+            spec.traces.forEach(function(t) {
+                var trace = Object.assign({type: 'scatter'}, t);
+                trace.x = x;
+                if (t.z !== undefined) {
+                    // heatmap of a 2d column against x and data.y
+                    if (data.columns[t.z] === undefined) {
+                        return;
+                    }
+                    trace.y = decode(data.y);
+                    trace.z = decode(data.columns[t.z]);
+                } else {
+                    if (data.columns[t.y] === undefined) {
+                        return;
+                    }
+                    trace.y = decode(data.columns[t.y]);
+                }
+                traces.push(trace);
+            });
+            // plotly mutates the layout it is given, so hand it a copy
+            return {data: traces, layout: JSON.parse(JSON.stringify(spec.layout))};
+        }
+    }
+});
@@ -0,0 +1,30 @@
+// Debouncing of the curve updates.  Every change of the curve inputs is
+// held in the 'curve-pending' store; the 'curve-debounce' interval sends it
+// to the server as 'curve-request' once the inputs have been still for the
+// debounce delay.  Requests carry the page's client id and a sequence
+// number so the server can drop stale ones (see coalesce.py).
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    requests: {
+        client: Math.random().toString(36).slice(2) + Date.now().toString(36),
+        seq: 0,
+
+        hold: function() {
+            var requests = window.dash_clientside.requests;
+            requests.seq += 1;
+            return {
+                client: requests.client,
+                seq: requests.seq,
+                time: Date.now(),
+                values: Array.prototype.slice.call(arguments)
+            };
+        },
+
+        flush: function(n_intervals, pending, sent, wait) {
+            if (!pending || (sent && sent.seq === pending.seq) ||
+                    Date.now() - pending.time < wait) {
+                return window.dash_clientside.no_update;
+            }
+            return pending;
+        }
+    }
+});
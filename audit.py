@@ -0,0 +1,239 @@
+"""Conservation and solvency invariants of simulation runs.
+
+Invariants of the Market accounting:
+
+    solvency             collateral_balance is not negative
+    fund                 fund_balance is not negative
+    circulation          0 <= tokens_circulation <= the end of the curve table
+    collateral_ledger    collateral changes by amount - fee on a buy and by
+                         -amount on a sell, by nothing otherwise
+    fund_ledger          fund changes by the fee of a buy, by nothing otherwise
+    circulation_ledger   circulation changes by the tokens traded
+    tokens               the agents' tokens change by the circulation change,
+                         they settle their trades in the same step
+    reserve              collateral_balance is the reserve the curve table
+                         gives for the circulation: the sum of buy_price -
+                         tax_amount over the tokens in circulation
+
+An Auditor checks them in two ways, both with a bounded cost:
+
+    sample()        checks the state of the live Market on a random subset
+                    of steps, a skip countdown on the other steps
+    audit_frame()   checks recorded results in one vectorised pass, fed in
+                    chunks like a recording.Recorder
+
+Live checks run in the process executing the step.  cadCAD runs Monte
+Carlo runs in worker processes, whose violations are only logged there,
+so use audit_frame() for N > 1.
+"""
+
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+
+import logging
+
+from market import Market
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+invariants = ['solvency', 'fund', 'circulation', 'collateral_ledger', 'fund_ledger',
+              'circulation_ledger', 'tokens', 'reserve']
+
+# Violations kept for the report, all are counted
+max_violations = 1000
+
+# Tolerance of balance comparisons: atol + rtol * |expected|
+atol = 1e-6
+rtol = 1e-9
+
+
+class Auditor:
+    """Checks the invariants of a Market and the agent trading with it.
+
+    Parameters
+    ----------
+    market: Market
+        The market simulated.
+    rate: float
+        Fraction of steps checked by sample(), None to disable.
+    seed: int
+        Seed of the sampled steps.
+    """
+
+    # False when the curve changes during the run (see schedule.py), the
+    # collateral then depends on the path and not the circulation alone
+    reserve_checked = True
+
+    def __init__(self, market:Market, rate:float=None, seed:int=0) -> None:
+        self.market = market
+        self.rate = rate
+        self.seed = seed
+        self._reserve = (None, None)
+        self.reset()
+
+
+    def reset(self) -> None:
+        """Forget the violations and the state carried between chunks."""
+        self.counts = dict.fromkeys(invariants, 0)
+        self.violations = []
+        self.checked = 0
+        # last (collateral, fund, circulation, agent tokens) of each run
+        self.carry = {}
+        self.rng = np.random.default_rng(self.seed)
+        self._countdown = self._skip()
+
+
+    def _skip(self) -> int:
+        return int(self.rng.geometric(self.rate)) if self.rate else 0
+
+
+    def reserve(self) -> np.ndarray:
+        """Reserve at each circulation: reserve[c] is the collateral of c
+        tokens bought from an empty market."""
+        table = self.market.token_units if self.market.scale else self.market.token_dynamics
+        if table is None:
+            raise RuntimeError("Bonding curve is not initialized.  Cannot audit.")
+        if self._reserve[0] is not table:
+            zero = np.zeros(1, dtype=np.asarray(table['buy_price']).dtype)
+            buy = np.concatenate([zero, np.cumsum(np.asarray(table['buy_price']))])
+            tax = np.concatenate([zero, np.cumsum(np.asarray(table['tax_amount']))])
+            self._reserve = (table, buy - tax)
+        return self._reserve[1]
+
+
+    def _report(self, invariant:str, run, timestep, value, expected) -> None:
+        n = len(timestep)
+        if not n:
+            return
+        self.counts[invariant] += n
+        keep = min(n, max_violations - len(self.violations))
+        if keep > 0:
+            run = np.broadcast_to(run, n)
+            self.violations += [{'invariant': invariant, 'run': int(r), 'timestep': int(t),
+                                 'value': v, 'expected': e}
+                                for r, t, v, e in zip(run[:keep], timestep[:keep],
+                                                      np.asarray(value)[:keep].tolist(),
+                                                      np.asarray(expected)[:keep].tolist())]
+
+
+    def _check(self, invariant:str, ok:np.ndarray, run, timestep, value, expected) -> None:
+        bad = np.flatnonzero(~ok)
+        if len(bad):
+            pick = lambda a: np.asarray(a)[bad] if np.ndim(a) else np.full(len(bad), a)
+            self._report(invariant, pick(run), pick(timestep), pick(value), pick(expected))
+
+
+    def _check_state(self, run, timestep, collateral, fund, circulation) -> None:
+        """Invariants of the state alone."""
+        reserve = self.reserve()
+        last = len(reserve) - 1
+        self._check('solvency', collateral >= -atol, run, timestep, collateral, 0)
+        self._check('fund', fund >= -atol, run, timestep, fund, 0)
+        inside = (circulation >= 0) & (circulation <= last)
+        self._check('circulation', inside, run, timestep, circulation, np.clip(circulation, 0, last))
+        if self.reserve_checked:
+            expected = reserve[np.clip(circulation, 0, last).astype(np.int64)]
+            self._check('reserve', _close(collateral, expected), run, timestep, collateral, expected)
+
+
+    def sample(self, timestep:int, run:int=1) -> None:
+        """Check the live market at a sampled subset of steps."""
+        if not self.rate:
+            return
+        self._countdown -= 1
+        if self._countdown > 0:
+            return
+        self._countdown = self._skip()
+        self.check(timestep, run)
+
+
+    def check(self, timestep:int, run:int=1) -> None:
+        """Check the live market now, the invariants of the state alone."""
+        m = self.market
+        before = sum(self.counts.values())
+        self._check_state(run, timestep, np.array([m.collateral_balance]), np.array([m.fund_balance]),
+                          np.array([m.tokens_circulation]))
+        self.checked += 1
+        if sum(self.counts.values()) > before:
+            logger.warning(f'Audit run {run} timestep {timestep}: {self.violations[-1:]}')
+
+
+    def audit_frame(self, df:pd.DataFrame) -> Dict[str, int]:
+        """Check a chunk of results in the cadCAD layout, in timestep order.
+
+        Only the last substep of each timestep is checked.  Steps are
+        compared with the last row of the same run in earlier chunks.
+        Returns the violations found in the chunk by invariant.
+        """
+        before = dict(self.counts)
+        if 'substep' in df.columns:
+            df = df.drop_duplicates(['run', 'timestep'], keep='last')
+        n = len(df)
+        if not n:
+            return {}
+        run = df['run'].to_numpy() if 'run' in df.columns else np.ones(n, dtype=np.int64)
+        timestep = df['timestep'].to_numpy()
+        state = pd.DataFrame(df['market_state'].to_list())
+        txn = pd.DataFrame(df['agent_txn'].to_list())
+        collateral = state['collateral_balance'].to_numpy(dtype=np.float64)
+        fund = state['fund_balance'].to_numpy(dtype=np.float64)
+        circulation = state['tokens_circulation'].to_numpy(dtype=np.float64)
+        tokens = pd.DataFrame(df['agent_state'].to_list())['tokens'].to_numpy(dtype=np.float64)
+        self._check_state(run, timestep, collateral, fund, circulation)
+
+        # previous step of each row, from the last chunk for the first row
+        # of a run, NaN when unknown
+        current = np.stack([collateral, fund, circulation, tokens])
+        first = np.ones(n, dtype=bool)
+        first[1:] = run[1:] != run[:-1]
+        last = np.append(first[1:], True)
+        previous = np.roll(current, 1, axis=1)
+        delta = current - previous
+        for i in np.flatnonzero(first):
+            delta[:, i] = current[:, i] - self.carry.get(run[i], np.full(4, np.nan))
+        for i in np.flatnonzero(last):
+            self.carry[run[i]] = current[:, i]
+        circulation_change = np.where(timestep == 0, 0.0, delta[2])
+
+        buy, sell = txn['action'].to_numpy() == 'Buy', txn['action'].to_numpy() == 'Sell'
+        amount = txn['amount'].to_numpy(dtype=np.float64)
+        fee = txn['fee'].to_numpy(dtype=np.float64)
+        traded = txn['tokens'].to_numpy(dtype=np.float64)
+        checks = [
+            ('collateral_ledger', delta[0], np.where(buy, amount - fee, np.where(sell, -amount, 0.0))),
+            ('fund_ledger', delta[1], np.where(buy, fee, 0.0)),
+            ('circulation_ledger', delta[2], np.where(buy, traded, np.where(sell, -traded, 0.0))),
+            ('tokens', np.where(timestep == 0, 0.0, delta[3]), circulation_change),
+        ]
+        for invariant, value, expected in checks:
+            known = ~(np.isnan(value) | np.isnan(expected))
+            self._check(invariant, _close(value, expected) | ~known, run, timestep, value, expected)
+
+        self.checked += n
+        found = {k: v - before[k] for k, v in self.counts.items() if v > before[k]}
+        if found:
+            logger.warning(f'Audit found violations {found} in {n} steps')
+        return found
+
+
+    def report(self) -> pd.DataFrame:
+        """Violations kept, with the step they occurred at."""
+        return pd.DataFrame(self.violations, columns=['invariant', 'run', 'timestep', 'value', 'expected'])
+
+
+    def summary(self) -> str:
+        found = {k: v for k, v in self.counts.items() if v}
+        if not found:
+            return f'Audit: {self.checked} steps checked, no violations'
+        first = {}
+        for v in self.violations:
+            first.setdefault(v['invariant'], v['timestep'])
+        return (f'Audit: {self.checked} steps checked, violations '
+                + ', '.join(f'{k} {n} (first at timestep {first.get(k, "?")})' for k, n in found.items()))
+
+
+def _close(value:np.ndarray, expected:np.ndarray) -> np.ndarray:
+    return np.abs(value - expected) <= atol + rtol * np.abs(expected)
@@ -0,0 +1,158 @@
+"""Checkpoint and resume long simulations.
+
+A run is executed in segments.  After each segment its records are
+written to their own file and a snapshot of the full simulation state is
+taken: Market balances and circulation, every agent's attributes
+(capital, tokens, history and any random generators), the global random
+number generator states, the last simulation state and the step counter,
+with the streaming statistics and the auditor of the run when given, so
+a resumed run reports on all its steps.
+Files are compressed pickles written to a temporary file and renamed,
+so a crash never leaves a partial checkpoint behind.
+
+Checkpoints live in <path>/<run_id>/, where the run id hashes everything
+that determines the run, so only an identical run resumes from them.
+"""
+
+import gzip
+import hashlib
+import os
+import pickle
+import random
+import shutil
+import tempfile
+import zlib
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+default_path = os.path.join('.', 'cache', 'checkpoints')
+
+# Market attributes that are derived from the curve and not checkpointed
+market_excluded = ('bonding_curve', '_token_dynamics', '_token_units', 'pending_curve', 'curve_store',
+                   'curve_parameters', 'kernel_curve', 'kernel_source')
+# Auditor attributes that are not checkpointed: the market and its reserve
+auditor_excluded = ('market', '_reserve')
+
+
+def run_id(market, agents:List, *parts) -> str:
+    """Hash of the curve table, the initial agents and any other run inputs."""
+    h = hashlib.sha1()
+    for c in ('buy_price', 'sell_price', 'tax_amount'):
+        h.update(np.ascontiguousarray(market.token_dynamics[c].to_numpy()).tobytes())
+    for agent in agents:
+        h.update(repr((type(agent).__name__, agent.policy, agent.initial_tokens,
+                       agent.initial_capital, agent.scale,
+                       getattr(agent, 'order_flow', None))).encode())
+    h.update(repr(parts).encode())
+    return h.hexdigest()
+
+
+def _atomic_write(file:str, obj) -> None:
+    directory = os.path.dirname(file)
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(gzip.compress(pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL), compresslevel=3))
+        os.replace(tmp, file)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def _read(file:str):
+    with open(file, 'rb') as f:
+        return pickle.loads(gzip.decompress(f.read()))
+
+
+class Checkpointer:
+    """Checkpoint files of one run.
+
+    Parameters
+    ----------
+    run_id: str
+        Identifies the run, see run_id().
+    path: str
+        Directory holding the checkpoints of all runs.
+    keep: int
+        Number of snapshots kept; older ones are removed.
+    """
+
+    def __init__(self, run_id:str, path:str=default_path, keep:int=2) -> None:
+        self.dir = os.path.join(path, run_id)
+        self.keep = keep
+        os.makedirs(self.dir, exist_ok=True)
+
+
+    def _files(self, prefix:str) -> List[str]:
+        return sorted(f for f in os.listdir(self.dir) if f.startswith(prefix) and f.endswith('.pkl.gz'))
+
+
+    def save(self, step:int, index:int, segment:Optional[pd.DataFrame], state:Dict,
+             market, agents:List, recorder=None, statistics=None, auditor=None) -> None:
+        """Write the records of segment index and snapshot the state after it.
+
+        When the records go to a recording.Recorder, segment is None and the
+        recorder is saved in the snapshot instead.  An online_stats.OnlineStats
+        and an audit.Auditor of the run are saved with it.
+        """
+        if segment is not None:
+            _atomic_write(os.path.join(self.dir, f'segment-{index:06d}.pkl.gz'), segment)
+        snapshot = {
+            'step': step,
+            'segments': index + 1,
+            'state': state,
+            'recorder': recorder,
+            'statistics': statistics,
+            'auditor': None if auditor is None else
+                {k: v for k, v in vars(auditor).items() if k not in auditor_excluded},
+            'market': {k: v for k, v in vars(market).items() if k not in market_excluded},
+            'agents': [dict(vars(agent)) for agent in agents],
+            'random': random.getstate(),
+            'np_random': np.random.get_state(),
+        }
+        _atomic_write(os.path.join(self.dir, f'snapshot-{step:012d}.pkl.gz'), snapshot)
+        for f in self._files('snapshot-')[:-self.keep]:
+            os.unlink(os.path.join(self.dir, f))
+        logger.info(f'checkpoint step {step} in {self.dir}')
+
+
+    def latest(self) -> Optional[Dict]:
+        """The most recent snapshot, or None."""
+        for f in reversed(self._files('snapshot-')):
+            try:
+                return _read(os.path.join(self.dir, f))
+            except (OSError, EOFError, zlib.error, pickle.UnpicklingError) as e:
+                logger.info(f'Skipping unreadable checkpoint {f}: {e}')
+        return None
+
+
+    def restore(self, snapshot:Dict, market, agents:List, statistics=None, auditor=None) -> None:
+        """Put the market, agents and random generators back in the snapshot
+        state, and the statistics and auditor when they were saved."""
+        for k, v in snapshot['market'].items():
+            setattr(market, k, v)
+        for agent, attributes in zip(agents, snapshot['agents']):
+            for k, v in attributes.items():
+                setattr(agent, k, v)
+        if statistics is not None and snapshot.get('statistics') is not None:
+            vars(statistics).update(vars(snapshot['statistics']))
+        if auditor is not None and snapshot.get('auditor') is not None:
+            vars(auditor).update(snapshot['auditor'])
+        random.setstate(snapshot['random'])
+        np.random.set_state(snapshot['np_random'])
+
+
+    def segments(self, count:int) -> List[pd.DataFrame]:
+        """Records of the first count segments."""
+        return [_read(os.path.join(self.dir, f'segment-{i:06d}.pkl.gz')) for i in range(count)]
+
+
+    def clear(self) -> None:
+        shutil.rmtree(self.dir, ignore_errors=True)
@@ -0,0 +1,89 @@
+"""Serving only the latest request of each client.
+
+Dragging a slider sends a request for every intermediate value.  The
+browser debounces them (see assets/requests.js) and numbers each request
+with a per page client id and a sequence number.  Here, requests of a
+client run one at a time, and a request is dropped as stale when a newer
+one of the same client has arrived, whether it was waiting or had
+already finished its work.  A burst of requests thus costs at most the
+one recompute in flight and the latest.
+
+State is per process: with several gunicorn workers, requests of a client
+reaching different workers are not coalesced across them.
+"""
+
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import logging
+
+import metrics
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Clients remembered, the least recent are forgotten
+max_clients = 1024
+
+stale_requests = metrics.Counter('dash_stale_requests_total', 'Requests dropped for a newer one of the same client.')
+
+
+class Stale(Exception):
+    pass
+
+
+class Coalescer:
+    """Latest request sequence number and lock of each client.
+
+    Parameters
+    ----------
+    name: str
+        Label of the dropped requests in the metrics.
+    """
+
+    def __init__(self, name:str) -> None:
+        self.name = name
+        self.lock = threading.Lock()
+        # client -> [latest seq, lock of its running request]
+        self.clients = OrderedDict()
+
+
+    def _client(self, client:str, seq:int) -> list:
+        with self.lock:
+            entry = self.clients.get(client)
+            if entry is None:
+                entry = self.clients[client] = [seq, threading.Lock()]
+                while len(self.clients) > max_clients:
+                    self.clients.popitem(last=False)
+            else:
+                entry[0] = max(entry[0], seq)
+                self.clients.move_to_end(client)
+            return entry
+
+
+    def stale(self, client:str, seq:int) -> bool:
+        """Whether a newer request of the client has arrived."""
+        entry = self.clients.get(client)
+        return entry is not None and entry[0] > seq
+
+
+    @contextmanager
+    def latest(self, client:str, seq:int):
+        """Run the block for the latest request of the client only.
+
+        Raises Stale, before or after the block, when a newer request of
+        the client has arrived.  Requests without a client always run.
+        """
+        if client is None:
+            yield
+            return
+        entry = self._client(client, seq)
+        with entry[1]:
+            if self.stale(client, seq):
+                stale_requests.inc(callback=self.name)
+                raise Stale()
+            yield
+        if self.stale(client, seq):
+            stale_requests.inc(callback=self.name)
+            raise Stale()
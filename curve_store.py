@@ -0,0 +1,217 @@
+"""Curve tables shared between processes through memory-mapped files.
+
+Each table is computed once, written to <path>/<hash>.npy keyed by a
+hash of the curve parameters and supply range, and mapped read-only by
+every process that needs it.  Gunicorn workers and sweep processes then
+share the pages through the OS page cache instead of each holding a copy.
+
+Only the numeric columns are stored; the hover text columns are left out.
+
+The store is kept under max_bytes: after each write the least recently
+used tables, by file modification time which reads refresh, are removed.
+Processes keep their maps of removed tables, and a table is mapped before
+it is renamed into the store, so its writer gets it even when another
+process evicts it at once.  On a read-only store reads do not refresh
+the modification time.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+
+import logging
+
+import sigmoid
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Bump when the stored table layout changes
+version = 2
+
+# Stored columns, in order
+columns = sigmoid.curve_columns
+
+# Tables with more rows are generated in chunks by that many threads
+chunk_threshold = 1 << 20
+workers = 4
+
+default_path = os.environ.get('CURVE_STORE', os.path.join('.', 'cache', 'curves'))
+
+# Most bytes of tables kept in a store, None for no limit
+max_bytes = int(os.environ.get('CURVE_STORE_MAX_BYTES', 512 * 1024**2))
+
+
+def table_key(supply:np.ndarray, curve_parameters:Dict) -> str:
+    """Hash of the curve parameters and the (evenly spaced) supply range."""
+    d = {k: (v if isinstance(v, str) or v is None else float(v))
+         for k, v in curve_parameters.items()}
+    d['_range'] = [float(supply[0]), float(supply[-1]), len(supply)]
+    d['_version'] = version
+    return hashlib.sha1(json.dumps(d, sort_keys=True).encode()).hexdigest()
+
+
+def _frame(values:np.ndarray) -> pd.DataFrame:
+    # A 2D array becomes a single block, so the frame is a view of the map
+    return pd.DataFrame(values, columns=columns, copy=False)
+
+
+class CurveStore:
+    """Directory of memory-mapped curve tables.
+
+    Parameters
+    ----------
+    path: str
+        Directory holding the tables, created if missing.
+    max_bytes: int
+        Most bytes of tables kept, the module max_bytes by default.
+    """
+
+    def __init__(self, path:str=default_path, max_bytes:int=None) -> None:
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.max_bytes = globals()['max_bytes'] if max_bytes is None else max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+
+    def key(self, supply:np.ndarray, curve_parameters:Dict) -> str:
+        return table_key(supply, curve_parameters)
+
+
+    def _file(self, key:str) -> str:
+        return os.path.join(self.path, f'{key}.npy')
+
+
+    def get(self, key:str) -> Optional[pd.DataFrame]:
+        """Read-only table for key, or None if it is not stored."""
+        try:
+            values = np.load(self._file(key), mmap_mode='r')
+        except FileNotFoundError:
+            return None
+        try:
+            # recently used tables are evicted last
+            os.utime(self._file(key))
+        except OSError:
+            # a read-only store, or the table was just evicted
+            pass
+        return _frame(values)
+
+
+    def put(self, key:str, df:pd.DataFrame) -> pd.DataFrame:
+        """Store the numeric columns of df and return the mapped table."""
+        values = np.ascontiguousarray(df[columns].to_numpy(dtype=np.float64))
+        # Write to a temporary file and rename, so readers never see a
+        # partial table and concurrent writers of the same key are harmless
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, values)
+            values = np.load(tmp, mmap_mode='r')
+            os.replace(tmp, self._file(key))
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        self.evict(keep=key)
+        return _frame(values)
+
+
+    def put_chunks(self, key:str, chunks:Iterator[pd.DataFrame], rows:int) -> pd.DataFrame:
+        """Store a table streamed in chunks, e.g. from
+        Sigmoid.token_dynamics_chunks, and return the mapped table.
+
+        The table is written straight to a memory-mapped file, so it
+        never has to fit in memory.
+        """
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        os.close(fd)
+        try:
+            values = np.lib.format.open_memmap(tmp, mode='w+', dtype=np.float64, shape=(rows, len(columns)))
+            i = 0
+            for df in chunks:
+                values[i:i + len(df)] = df[columns].to_numpy(dtype=np.float64)
+                i += len(df)
+            if i != rows:
+                raise ValueError(f'Expected {rows} rows, got {i}')
+            values.flush()
+            del values
+            values = np.load(tmp, mmap_mode='r')
+            os.replace(tmp, self._file(key))
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        self.evict(keep=key)
+        return _frame(values)
+
+
+    def token_dynamics(self, bonding_curve, supply:np.ndarray, curve_parameters:Dict=None) -> pd.DataFrame:
+        """The curve table, computed with bonding_curve only if not stored."""
+        if curve_parameters is None:
+            curve_parameters = bonding_curve.curve_parameters
+        if curve_parameters is None or curve_parameters.get('scenario') is None:
+            return bonding_curve.token_dynamics(supply, curve_parameters)
+
+        key = self.key(supply, curve_parameters)
+        df = self.get(key)
+        if df is not None:
+            self.hits += 1
+            return df
+        self.misses += 1
+        logger.debug(f'curve_store miss {key}')
+        if (len(supply) > chunk_threshold and hasattr(bonding_curve, 'token_dynamics_chunks')
+                and supply[0] == 0 and supply[-1] == len(supply) - 1):
+            # Large tables are streamed to the file in parallel chunks
+            return self.put_chunks(key,
+                                   bonding_curve.token_dynamics_chunks(supply[-1], curve_parameters,
+                                                                       workers=workers),
+                                   len(supply))
+        return self.put(key, bonding_curve.token_dynamics(supply, curve_parameters, text=False))
+
+
+    def keys(self) -> List[str]:
+        return [f[:-4] for f in os.listdir(self.path) if f.endswith('.npy')]
+
+
+    def evict(self, keep:str=None) -> int:
+        """Remove the least recently used tables until the store is under
+        max_bytes, never the table keep.  Returns the number removed."""
+        if self.max_bytes is None:
+            return 0
+        tables = []
+        for entry in os.scandir(self.path):
+            if entry.name.endswith('.npy'):
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                tables.append((st.st_mtime, st.st_size, entry.name[:-4]))
+        total = sum(size for _, size, _ in tables)
+        removed = 0
+        for _, size, key in sorted(tables):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            try:
+                os.unlink(self._file(key))
+            except FileNotFoundError:
+                # removed by another process
+                pass
+            total -= size
+            removed += 1
+        if removed:
+            self.evictions += removed
+            logger.info(f'curve_store evicted {removed} tables, {total} bytes kept')
+        return removed
+
+
+    def clear(self) -> None:
+        """Remove all stored tables.  Processes keep their existing maps."""
+        for key in self.keys():
+            os.unlink(self._file(key))
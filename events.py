@@ -0,0 +1,298 @@
+"""Discrete-event simulation of agents trading with a Market.
+
+cadCAD advances the market one timestep at a time whether anyone trades
+or not.  Here agent actions, curve parameter changes and observations are
+events on a heap ordered by time, and the Market is only touched when
+one fires, so a run costs time in proportion to its events rather than
+to its horizon:
+
+    traders = [Trader(user, bursty_arrivals(rate=0.001, burst=20, spacing=0.5, seed=1))]
+    engine = Engine(market, traders, schedule=Schedule(...), observe_every=10_000)
+    engine.run(until=10_000_000)
+    engine.trades_frame(), engine.observations_frame()
+
+Times are floats in the units of the arrival processes; schedule
+timesteps are times.  Events of the same time fire in the order
+
+    change        curve parameter changes (see schedule.py), so trades at
+                  time t use the curve of the changes at or before t, as
+                  in the cadCAD simulation
+    action        each trader's action, get_transaction() of its TokenUser
+                  at the current buy price, executed on the market and
+                  settled with the agent
+    observe       a snapshot of the market, every observe_every
+
+with ties broken in the order they were scheduled.  Each trader keeps a
+single pending action, the next one is drawn from its arrivals when it
+fires, so the heap holds one entry per trader plus the changes and the
+next observation.
+"""
+
+import heapq
+import itertools
+import time
+from typing import Dict, Iterable, Iterator, List
+
+import numpy as np
+import pandas as pd
+
+import logging
+
+from market import Market
+from token_user import TokenUser
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Order of events of the same time
+CHANGE = 0
+ACTION = 1
+OBSERVE = 2
+
+# Arrival times drawn at a time
+arrival_block = 4096
+
+trade_columns = ['time', 'agent', 'action', 'tokens', 'amount', 'fee',
+                 'tokens_circulation', 'collateral_balance', 'fund_balance',
+                 'capital', 'agent_tokens']
+observation_columns = ['time', 'events', 'tokens_circulation', 'tokens_bought', 'tokens_sold',
+                       'collateral_balance', 'fund_balance', 'buy_price', 'sell_price']
+
+
+def poisson_arrivals(rate:float, seed=None, start:float=0.0) -> Iterator[float]:
+    """Times of a Poisson process of rate arrivals per time unit after start."""
+    if rate <= 0:
+        return
+    rng = np.random.default_rng(seed)
+    t = start
+    while True:
+        times = t + np.cumsum(rng.exponential(1 / rate, arrival_block))
+        yield from times.tolist()
+        t = times[-1]
+
+
+def bursty_arrivals(rate:float, burst:float, spacing:float, seed=None, start:float=0.0) -> Iterator[float]:
+    """Times of bursts of actions, the bursts starting as a Poisson process
+    of rate per time unit.  A burst has burst actions on average
+    (geometric) spaced spacing apart on average (exponential)."""
+    if rate <= 0:
+        return
+    rng = np.random.default_rng(seed)
+    t = start
+    while True:
+        # each action is the last of its burst with probability 1/burst,
+        # the gap after it is then the wait for the next burst
+        last = rng.random(arrival_block) < 1 / max(burst, 1)
+        gaps = np.where(last, rng.exponential(1 / rate, arrival_block),
+                        rng.exponential(spacing, arrival_block))
+        # the first burst starts after a wait too
+        times = t + np.cumsum(gaps)
+        yield from times.tolist()
+        t = times[-1]
+
+
+class Trader:
+    """An agent acting at the times of its arrivals.
+
+    Parameters
+    ----------
+    user: TokenUser
+        The agent, trading from its current state with its policy.  The
+        order of its n-th action is the n-th order of a 'Flow' policy.
+    arrivals: iterable
+        Nondecreasing action times, e.g. poisson_arrivals() or the times
+        of a log.  The trader stops when they run out.
+    """
+
+    def __init__(self, user:TokenUser, arrivals:Iterable[float]) -> None:
+        self.user = user
+        self.arrivals = iter(arrivals)
+        self.actions = 0
+
+
+    def next_time(self):
+        """Time of the next action, None when there are no more."""
+        return next(self.arrivals, None)
+
+
+    def act(self, market:Market, run:int=1):
+        """Take the next action on market, returns (action, tokens, amount, fee)."""
+        action, num_tokens = self.user.get_transaction(market.buy_price(), run, self.actions, market)
+        self.actions += 1
+        if action == 'Buy':
+            num_tokens, amount, fee = market.buy_tokens(num_tokens)
+        elif action == 'Sell':
+            num_tokens, amount, fee = market.sell_tokens(num_tokens)
+        else:
+            action, num_tokens, amount, fee = '', 0, 0, 0
+        self.user.transaction_update(action, num_tokens, amount, fee)
+        return action, num_tokens, amount, fee
+
+
+class Engine:
+    """Runs the events of traders, a curve schedule and observations on a
+    market.
+
+    Parameters
+    ----------
+    market: Market
+        Market with its token dynamics initialised, run from its current
+        state and left in the state after the last event.  A scheduled
+        curve is put back at the end of run(), as in app1.run_simulation.
+    traders: list
+        Trader of each agent, its index is the agent of its trades.
+    schedule: schedule.Schedule
+        Curve parameter changes, at the times of their timesteps.
+    observe_every: float
+        Time between market observations, the first at time 0.  None for
+        no observations.
+    run: int
+        Monte Carlo run, selects the order flow stream of 'Flow' agents.
+    statistics: online_stats.OnlineStats
+        Updated with the market and the agent after each action.
+    """
+
+    def __init__(self, market:Market, traders:List[Trader], schedule=None,
+                 observe_every:float=None, run:int=1, statistics=None) -> None:
+        if market.token_dynamics is None:
+            raise RuntimeError("Bonding curve is not initialized.  Cannot execute transaction.")
+        self.market = market
+        self.traders = list(traders)
+        self.schedule = schedule
+        self.observe_every = observe_every
+        self.run_index = run
+        self.statistics = statistics
+        self.trades = []
+        self.observations = []
+        self.events = 0
+        self.seconds = 0.0
+
+
+    def run(self, until:float) -> 'Engine':
+        """Fire the events of times up to until."""
+        m = self.market
+        heap = []
+        order = itertools.count()
+        push = heapq.heappush
+        pop = heapq.heappop
+        if self.schedule:
+            self.schedule.start(m)
+            for t in sorted({t for t, _ in self.schedule.changes}):
+                push(heap, (t, CHANGE, next(order), t))
+        for i, trader in enumerate(self.traders):
+            t = trader.next_time()
+            if t is not None:
+                push(heap, (t, ACTION, next(order), i))
+        if self.observe_every:
+            push(heap, (0.0, OBSERVE, next(order), None))
+
+        trades = self.trades
+        start = time.perf_counter()
+        try:
+            while heap and heap[0][0] <= until:
+                now, kind, _, payload = pop(heap)
+                self.events += 1
+                if kind == ACTION:
+                    trader = self.traders[payload]
+                    action, num_tokens, amount, fee = trader.act(m, self.run_index)
+                    user = trader.user
+                    trades.append((now, payload, action, num_tokens, amount, fee,
+                                   m.tokens_circulation, m.collateral_balance, m.fund_balance,
+                                   user.capital, user.tokens))
+                    if self.statistics is not None:
+                        self.statistics.update(
+                            now, self.market_state(), {payload: {'capital': user.capital, 'tokens': user.tokens}},
+                            {payload: {'action': action, 'tokens': num_tokens, 'amount': amount, 'fee': fee}},
+                            self.run_index)
+                    t = trader.next_time()
+                    if t is not None:
+                        push(heap, (max(t, now), ACTION, next(order), payload))
+                elif kind == CHANGE:
+                    self.schedule.apply(payload)
+                else:
+                    self.observe(now)
+                    push(heap, (now + self.observe_every, OBSERVE, next(order), None))
+        finally:
+            if self.schedule:
+                self.schedule.reset()
+        self.seconds += time.perf_counter() - start
+        logger.info(f'{self.events} events in {self.seconds:.2f}s, {len(trades)} trades')
+        return self
+
+
+    def market_state(self) -> Dict:
+        """The market as the cadCAD market_state."""
+        m = self.market
+        return {'tokens_circulation': m.tokens_circulation,
+                'tokens_bought': m.tokens_bought,
+                'tokens_sold': m.tokens_sold,
+                'fund_balance': m.fund_balance,
+                'collateral_balance': m.collateral_balance,
+                'buy_price': m.buy_price(),
+                'sell_price': m.sell_price()}
+
+
+    def observe(self, now:float) -> None:
+        m = self.market
+        self.observations.append((now, self.events, m.tokens_circulation, m.tokens_bought, m.tokens_sold,
+                                  m.collateral_balance, m.fund_balance, m.buy_price(), m.sell_price()))
+
+
+    def trades_frame(self) -> pd.DataFrame:
+        """A row per action, with the market and agent state after it."""
+        return pd.DataFrame(self.trades, columns=trade_columns)
+
+
+    def observations_frame(self) -> pd.DataFrame:
+        return pd.DataFrame(self.observations, columns=observation_columns)
+
+
+if __name__ == '__main__':
+    import argparse
+    import sigmoid
+    import market as market_
+
+    parser = argparse.ArgumentParser(description='Run agents trading with the Market as discrete events.')
+    parser.add_argument('--until', type=float, default=1e6, help='time of the last events')
+    parser.add_argument('--agents', type=int, default=3)
+    parser.add_argument('--rate', type=float, default=1e-4, help='bursts per time unit of each agent')
+    parser.add_argument('--burst', type=float, default=10, help='mean actions per burst')
+    parser.add_argument('--spacing', type=float, default=1.0, help='mean time between actions of a burst')
+    parser.add_argument('--capital', type=float, default=100000.0)
+    parser.add_argument('--policy', default='Buy', choices=['Buy', 'Alternate', 'Flow'])
+    parser.add_argument('--observe-every', type=float, default=None)
+    parser.add_argument('--scenario', default='s0')
+    parser.add_argument('--supply', type=int, default=int(market_.initial_supply))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--statistics-every', type=float, default=None,
+                        help='time between snapshots of the streaming statistics')
+    parser.add_argument('--out', help='CSV file of the trades')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    # Dashboard defaults, see app1.py
+    sigmoid.max_slope = market_.max_supply * 1e3
+    m = Market(sigmoid.Sigmoid(market_.min_supply, args.supply, market_.max_price/2))
+    m.update_token_dynamics(args.supply, dict(m.bonding_curve.curve_parameters, supply=args.supply,
+                                              scenario=args.scenario))
+    seeds = np.random.SeedSequence(args.seed).spawn(args.agents)
+    traders = []
+    for i, seed in enumerate(seeds):
+        flow = None
+        if args.policy == 'Flow':
+            import order_flow
+            flow = order_flow.OrderFlow(seed=args.seed + i)
+        user = TokenUser(0, args.capital, order_flow=flow)
+        user.policy = args.policy
+        traders.append(Trader(user, bursty_arrivals(args.rate, args.burst, args.spacing, seed)))
+    import online_stats
+    statistics = online_stats.OnlineStats(args.statistics_every)
+    engine = Engine(m, traders, observe_every=args.observe_every, statistics=statistics).run(args.until)
+    trades = engine.trades_frame()
+    if args.out:
+        trades.to_csv(args.out, index=False)
+    print(f'{engine.events} events, {len(trades)} trades in {engine.seconds:.2f}s')
+    if engine.observations:
+        print(engine.observations_frame().tail().to_string(index=False))
+    print(trades.tail().to_string(index=False))
+    print(statistics.summary())
@@ -0,0 +1,372 @@
+"""Fast-forward the deterministic phases of a single agent simulation.
+
+With the stock TokenUser 'Buy' policy the whole run is determined by the
+curve table: the agent buys one token per step until its capital runs
+out and then settles into a buy/sell oscillation.  Instead of executing
+every step through cadCAD, FastForward
+
+1. jumps through the buy phase with prefix sums over the curve table,
+   stopping at the step where capital no longer covers the price, and
+2. detects steady-state cycles in the recorded steps and extrapolates
+   them until one of the agent's decisions would change.
+
+Everything else is stepped one transaction at a time with the same
+arithmetic as Market and TokenUser, so the per-step records are identical
+to the cadCAD run (see app1.run_simulation).
+
+Runs can be simulated in chunks of steps: the columns then hold one chunk
+and the steps the cycle search looks back on, and each chunk's records are
+passed on before it is dropped, so memory does not grow with the run.
+"""
+
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+import logging
+
+from market import Market
+from token_user import TokenUser
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+NONE = 0
+BUY = 1
+SELL = 2
+ACTIONS = {NONE: '', BUY: 'Buy', SELL: 'Sell'}
+
+# Number of steps evaluated in the first vectorised chunk of a phase.
+# Accepted chunks double in size.
+min_chunk = 64
+# Longest steady-state cycle searched for, in steps
+max_period = 8
+
+
+class FastForward:
+    """Deterministic single agent simulation over a market's curve table.
+
+    Column arrays are indexed by timestep less offset, index 0 is the
+    initial state of an unchunked run.
+    """
+
+    def __init__(self, market:Market, token_user:TokenUser) -> None:
+        if market.token_dynamics is None:
+            raise RuntimeError("Bonding curve is not initialized.  Cannot execute transaction.")
+        if token_user.policy != 'Buy':
+            raise ValueError(f'Cannot fast-forward policy {token_user.policy}')
+        self.market = market
+        self.token_user = token_user
+        if market.scale:
+            # integer units, see fixed_point.py
+            self.bp = market.token_units['buy_price']
+            self.sp = market.token_units['sell_price']
+            self.tax = market.token_units['tax_amount']
+        else:
+            self.bp = market.token_dynamics['buy_price'].to_numpy(dtype=float)
+            self.sp = market.token_dynamics['sell_price'].to_numpy(dtype=float)
+            self.tax = market.token_dynamics['tax_amount'].to_numpy(dtype=float)
+        self.last = len(self.bp) - 1
+        self.steps = 0
+        # timestep of index 0 of the columns, and end of the current chunk
+        self.offset = 0
+        self.end = 0
+
+
+    def _allocate(self, steps:int) -> None:
+        n = steps + 1
+        money = self.bp.dtype
+        self.act = np.zeros(n, dtype=np.int8)
+        self.num = np.zeros(n, dtype=np.int64)
+        self.amt = np.zeros(n, dtype=money)
+        self.fee = np.zeros(n, dtype=money)
+        self.circ = np.zeros(n, dtype=np.int64)
+        self.bought = np.zeros(n, dtype=np.int64)
+        self.sold = np.zeros(n, dtype=np.int64)
+        self.fund = np.zeros(n, dtype=money)
+        self.col = np.zeros(n, dtype=money)
+        self.price = np.zeros(n, dtype=money)
+        self.sell = np.zeros(n, dtype=money)
+        self.cap = np.zeros(n, dtype=money)
+        self.tok = np.zeros(n, dtype=np.asarray(self.token_user.tokens).dtype)
+
+        m = self.market
+        self.circ[0] = m.tokens_circulation
+        self.bought[0] = m.tokens_bought
+        self.sold[0] = m.tokens_sold
+        self.fund[0] = m.fund_balance
+        self.col[0] = m.collateral_balance
+        self.price[0] = self.bp[m.tokens_circulation]
+        self.sell[0] = self.sp[m.tokens_circulation]
+        self.cap[0] = self.token_user.capital
+        self.tok[0] = self.token_user.tokens
+        self.initial_price = self.price[0]
+
+
+    def _columns(self) -> List[np.ndarray]:
+        return [self.act, self.num, self.amt, self.fee, self.circ, self.bought, self.sold,
+                self.fund, self.col, self.price, self.sell, self.cap, self.tok]
+
+
+    def run(self, steps:int, chunk_steps:int=None, on_chunk=None) -> 'FastForward':
+        """Simulate steps timesteps, fast-forwarding wherever possible.
+
+        With chunk_steps, the columns hold chunk_steps steps and the
+        2 * max_period before them.  on_chunk(start, stop) is called when
+        timesteps start to stop - 1 are simulated, to take their records
+        with to_frame(start=start, stop=stop), before they are dropped.
+        """
+        self.steps = steps
+        self.offset = 0
+        chunk = steps if chunk_steps is None else max(1, chunk_steps)
+        # rows kept from one chunk for the cycle search of the next
+        keep = 2 * max_period + 1
+        self._allocate(steps if chunk >= steps else chunk + keep - 1)
+        t = 0
+        stepped = 0
+        start = 0
+        while True:
+            self.end = min(t + chunk, steps - self.offset)
+            while t < self.end:
+                t = self._step(t)
+                stepped += 1
+                if t < self.end and self.act[t] == BUY and self.price[t] <= self.cap[t]:
+                    t = self._buy_phase(t)
+                if t < self.end:
+                    t = self._cycle(t)
+            if on_chunk is not None:
+                on_chunk(start, self.offset + t + 1)
+                start = self.offset + t + 1
+            if self.offset + t >= steps:
+                break
+            n = min(keep, t + 1)
+            for column in self._columns():
+                column[:n] = column[t - n + 1:t + 1]
+            self.offset += t - n + 1
+            t = n - 1
+        logger.info(f'fast_forward {steps} steps, {stepped} stepped individually')
+        return self
+
+
+    def _step(self, t:int) -> int:
+        """Execute one timestep, mirroring Market and TokenUser."""
+        c = self.circ[t]
+        end = min(c + 1, self.last)
+        num = end - c
+        bought = self.bought[t]
+        sold = self.sold[t]
+        fund = self.fund[t]
+        if self.price[t] <= self.cap[t]:
+            action = BUY
+            amount = self.bp[c:end].sum()
+            fee = self.tax[c:end].sum()
+            col = self.col[t] + (amount - fee)
+            fund = fund + fee
+            bought = num
+            circ = min(c + num, self.market.supply)
+            inc = -amount - fee
+            tokens = self.tok[t] + num
+        else:
+            action = SELL
+            amount = self.sp[c:end].sum()
+            fee = self.tax[c:end].sum()
+            col = self.col[t] - amount
+            sold = num
+            circ = c - num
+            inc = amount - fee
+            tokens = self.tok[t] - num
+
+        t += 1
+        self.act[t] = action
+        self.num[t] = num
+        self.amt[t] = amount
+        self.fee[t] = fee
+        self.circ[t] = circ
+        self.bought[t] = bought
+        self.sold[t] = sold
+        self.fund[t] = fund
+        self.col[t] = col
+        self.price[t] = self.bp[circ]
+        self.sell[t] = self.sp[circ]
+        self.cap[t] = max(0, self.cap[t - 1] + inc)
+        self.tok[t] = tokens
+        return t
+
+
+    def _buy_phase(self, t:int) -> int:
+        """Buy one token per step while capital covers the price.
+
+        The transaction amounts are slices of the curve table, so capital,
+        collateral and fund balances are prefix sums over it.
+        """
+        chunk = min_chunk
+        while t < self.end:
+            c = self.circ[t]
+            m = min(chunk, self.last - c, self.end - t)
+            if c < 0 or m <= 0:
+                break
+            idx = c + np.arange(m)
+            amt = self.bp[idx]
+            fee = self.tax[idx]
+            cap = np.cumsum(np.concatenate(([self.cap[t]], -amt - fee)))[1:]
+            price = self.bp[idx + 1]
+
+            ok = cap >= 0
+            ok[1:] &= price[:-1] <= cap[:-1]
+            accepted = m if ok.all() else int(np.argmin(ok))
+            if accepted == 0:
+                break
+
+            s = slice(t + 1, t + 1 + accepted)
+            self.act[s] = BUY
+            self.num[s] = 1
+            self.amt[s] = amt[:accepted]
+            self.fee[s] = fee[:accepted]
+            self.circ[s] = idx[:accepted] + 1
+            self.bought[s] = 1
+            self.sold[s] = self.sold[t]
+            self.fund[s] = np.cumsum(np.concatenate(([self.fund[t]], fee[:accepted])))[1:]
+            self.col[s] = np.cumsum(np.concatenate(([self.col[t]], amt[:accepted] - fee[:accepted])))[1:]
+            self.price[s] = price[:accepted]
+            self.sell[s] = self.sp[idx[:accepted] + 1]
+            self.cap[s] = cap[:accepted]
+            self.tok[s] = self.tok[t] + np.arange(1, accepted + 1)
+            t += accepted
+            if accepted < m or not self.price[t] <= self.cap[t]:
+                break
+            chunk *= 2
+        return t
+
+
+    def _find_period(self, t:int) -> int:
+        """Shortest period P for which the last two P-step windows repeat."""
+        columns = (self.act, self.num, self.amt, self.fee, self.circ, self.bought, self.sold)
+        for period in range(1, max_period + 1):
+            if t < 2 * period:
+                break
+            a = slice(t - 2 * period + 1, t - period + 1)
+            b = slice(t - period + 1, t + 1)
+            if all(np.array_equal(col[a], col[b]) for col in columns):
+                return period
+        return 0
+
+
+    def _cycle(self, t:int) -> int:
+        """Extrapolate a steady-state cycle while the decisions still hold.
+
+        In a cycle the transactions repeat exactly, so each balance grows
+        by the same increments every period.  Balances are accumulated
+        step by step to match the scalar arithmetic.  When capital is
+        clamped at zero every period it repeats as well, and the cycle
+        holds until the end of the run.
+        """
+        period = self._find_period(t)
+        if period == 0:
+            return t
+
+        w = np.arange(t - period + 1, t + 1)
+        stationary = np.array_equal(self.cap[w - period], self.cap[w])
+        buy = self.act[w] == BUY
+        cap_inc = np.where(buy, -self.amt[w] - self.fee[w], self.amt[w] - self.fee[w])
+        fund_inc = np.where(buy, self.fee[w], 0)
+        col_inc = np.where(buy, self.amt[w] - self.fee[w], -self.amt[w])
+        tok_inc = np.where(buy, self.num[w], -self.num[w])
+
+        chunk = max(min_chunk, period)
+        while t < self.end:
+            m = min(chunk, self.end - t)
+            src = w[np.arange(m) % period]
+            k = np.arange(m) % period
+            if stationary:
+                cap = np.concatenate(([self.cap[t]], self.cap[src]))
+                accepted = m
+            else:
+                cap = np.cumsum(np.concatenate(([self.cap[t]], cap_inc[k])))
+                price = np.concatenate(([self.price[t]], self.price[src]))
+
+                # the agent buys when the previous price is covered by capital
+                ok = (cap[1:] >= 0) & ((price[:-1] <= cap[:-1]) == buy[k])
+                accepted = m if ok.all() else int(np.argmin(ok))
+            if accepted == 0:
+                break
+
+            src = src[:accepted]
+            k = k[:accepted]
+            s = slice(t + 1, t + 1 + accepted)
+            for column in (self.act, self.num, self.amt, self.fee, self.circ,
+                           self.bought, self.sold, self.price, self.sell):
+                column[s] = column[src]
+            self.cap[s] = cap[1:accepted + 1]
+            self.fund[s] = np.cumsum(np.concatenate(([self.fund[t]], fund_inc[k])))[1:]
+            self.col[s] = np.cumsum(np.concatenate(([self.col[t]], col_inc[k])))[1:]
+            self.tok[s] = self.tok[t] + np.cumsum(tok_inc[k])
+            t += accepted
+            if accepted < m:
+                break
+            chunk *= 2
+        return t
+
+
+    def apply(self) -> None:
+        """Leave the market and agent in the final simulated state."""
+        t = self.steps - self.offset
+        m = self.market
+        m.tokens_circulation = int(self.circ[t])
+        m.tokens_bought = int(self.bought[t])
+        m.tokens_sold = int(self.sold[t])
+        m.fund_balance = self.fund[t].item()
+        m.collateral_balance = self.col[t].item()
+        self.token_user.capital = self.cap[t].item()
+        self.token_user.tokens = self.tok[t]
+        history = self.transaction_history()
+        if self.token_user.history_limit:
+            history = history[-self.token_user.history_limit:]
+        self.token_user.transaction_history = history
+
+
+    def transaction_history(self) -> List[Dict]:
+        """The TokenUser.transaction_update calls of the run, of the last
+        chunk only for a chunked run."""
+        return [{'action': ACTIONS[self.act[t]],
+                 'tokens': self.num[t],
+                 'amount': self.amt[t],
+                 'fee': self.fee[t]} for t in range(1, self.steps - self.offset + 1)]
+
+
+    def to_frame(self, initial_price:float=None, runs:int=1,
+                 start:int=0, stop:int=None) -> pd.DataFrame:
+        """Per-step records in the same layout as the cadCAD results.
+
+        start and stop select a range of timesteps, by default all of them
+        still held.
+        """
+        if initial_price is None:
+            initial_price = self.initial_price
+        if stop is None:
+            stop = self.steps + 1
+        records = []
+        for run in range(1, runs + 1):
+            for step in range(max(start, self.offset), min(stop, self.steps + 1)):
+                t = step - self.offset
+                records.append({
+                    'token_price': initial_price,
+                    'agent_txn': {'action': ACTIONS[self.act[t]],
+                                  'amount': self.amt[t],
+                                  'fee': self.fee[t],
+                                  'tokens': self.num[t]},
+                    'market_state': {'tokens_circulation': self.circ[t],
+                                     'tokens_bought': self.bought[t],
+                                     'tokens_sold': self.sold[t],
+                                     'fund_balance': self.fund[t],
+                                     'collateral_balance': self.col[t],
+                                     'buy_price': self.price[t],
+                                     'sell_price': self.sell[t]},
+                    'agent_state': {'capital': self.cap[t],
+                                    'tokens': self.tok[t]},
+                    'simulation': 0,
+                    'subset': 0,
+                    'run': run,
+                    'substep': 1 if step > 0 else 0,
+                    'timestep': step})
+        return pd.DataFrame(records)
@@ -0,0 +1,225 @@
+"""Static figure specs and compact array payloads for the dashboard graphs.
+
+The layouts and trace styles below are shipped to the browser once, with
+the page layout.  Callbacks then only send the numeric arrays, encoded as
+base64 typed arrays, and a clientside callback (assets/figures.js) patches
+them into the traces.
+"""
+
+import base64
+from typing import Dict, List
+
+import numpy as np
+
+# Default wire encoding.  float32 keeps ~7 significant digits which is
+# more than a plot can show and halves the payload of float64.
+default_dtype = 'f4'
+default_decimals = None
+
+GREEN = '#2ca02c'
+RED = '#d62728'
+
+
+def _axis(title, color=None, **kwargs):
+    axis = {'title': {'text': title}, 'rangemode': 'nonnegative'}
+    if color is not None:
+        axis['title']['font'] = {'color': color}
+        axis['tickfont'] = {'color': color}
+    axis.update(kwargs)
+    return axis
+
+
+def _right_axis(title, color, **kwargs):
+    return _axis(title, color, overlaying='y', side='right', showline=True, **kwargs)
+
+
+# Curve graphs, plotted against supply
+CURVE_GRAPHS = {
+    'price-graph': {
+        'layout': {
+            'title': {'text': 'Price Graph'},
+            'xaxis': {'title': {'text': 'Supply'}},
+            'yaxis': _axis('Price', hoverformat='.2f'),
+            'legend': {'xanchor': 'left', 'yanchor': 'top'}},
+        'traces': [
+            {'y': 'buy_price', 'name': 'Buy', 'mode': 'lines'},
+            {'y': 'sell_price', 'name': 'Sell', 'mode': 'lines'}]},
+    'col-graph': {
+        'layout': {
+            'title': {'text': 'Collateral Graph'},
+            'xaxis': {'title': {'text': 'Supply'}},
+            'yaxis': _axis('Collateral'),
+            'legend': {'xanchor': 'left', 'yanchor': 'top'}},
+        'traces': [
+            {'y': 'buy_col', 'name': 'Buy', 'mode': 'lines',
+             'hovertemplate': '%{y:.3s}<extra></extra>'},
+            {'y': 'sell_col', 'name': 'Sell', 'mode': 'lines',
+             'hovertemplate': '%{y:.3s}<extra></extra>'}]},
+    'tax-graph': {
+        'layout': {
+            'title': {'text': 'Tax Graph'},
+            'xaxis': {'title': {'text': 'Supply'}},
+            'yaxis': _axis('Rate', GREEN, range=[0.0, 1.0], hoverformat='.2f'),
+            'yaxis2': _right_axis('Amount', RED, hoverformat='.2f'),
+            'legend': {'x': 0.25, 'yanchor': 'top'}},
+        'traces': [
+            {'y': 'tax_rate', 'name': 'Tax Rate', 'mode': 'lines',
+             'line': {'color': GREEN}},
+            {'y': 'tax_amount', 'name': 'Tax Amount', 'mode': 'lines',
+             'line': {'color': RED}, 'yaxis': 'y2'}]},
+    'fund-graph': {
+        'layout': {
+            'title': {'text': 'Fund Graph'},
+            'xaxis': {'title': {'text': 'Supply'}},
+            'yaxis': _axis('Rate', GREEN, range=[0.0, 1.0]),
+            'yaxis2': _right_axis('Amount', RED),
+            'legend': {'x': 0.25, 'yanchor': 'top'}},
+        'traces': [
+            {'y': 'fund_rate', 'name': 'Fund Rate', 'mode': 'lines',
+             'line': {'color': GREEN},
+             'hovertemplate': '%{y:.2f}<extra></extra>'},
+            {'y': 'fund_amount', 'name': 'Fund Amount', 'mode': 'lines',
+             'line': {'color': RED}, 'yaxis': 'y2',
+             'hovertemplate': '%{y:.3s}<extra></extra>'}]},
+}
+
+# Simulation graphs, plotted against timestep
+SIM_GRAPHS = {
+    'market-circulation-graph': {
+        'layout': {
+            'title': {'text': 'Market Circulation'},
+            'xaxis': {'title': {'text': 'Time'}},
+            'yaxis': _axis('Tokens', GREEN, hoverformat='.2f'),
+            'legend': {'x': 0.25, 'yanchor': 'top'}},
+        'traces': [
+            {'y': 'tokens_circulation', 'name': 'Circulation', 'mode': 'lines',
+             'line': {'color': GREEN}, 'hovertemplate': '%{y}<extra></extra>'}]},
+    'market-buysell-graph': {
+        'layout': {
+            'title': {'text': 'Buy/Sell Tokens'},
+            'xaxis': {'title': {'text': 'Time'}},
+            'yaxis': _axis('Tokens', GREEN, hoverformat='.2f'),
+            'yaxis2': _right_axis('Tokens', RED, hoverformat='.2f'),
+            'legend': {'x': 0.25, 'yanchor': 'top'}},
+        'traces': [
+            {'y': 'tokens_bought', 'name': 'Tokens Bought', 'mode': 'lines',
+             'line': {'color': GREEN}},
+            {'y': 'tokens_sold', 'name': 'Tokens Sold', 'mode': 'lines',
+             'line': {'color': RED}, 'hovertemplate': '%{y}<extra></extra>'}]},
+    'market-price-graph': {
+        'layout': {
+            'title': {'text': 'Buy/Sell Price'},
+            'xaxis': {'title': {'text': 'Time'}},
+            'yaxis': _axis('Price', GREEN),
+            'yaxis2': _right_axis('Price', RED),
+            'legend': {'x': 0.25, 'yanchor': 'top'}},
+        'traces': [
+            {'y': 'buy_price', 'name': 'Buy Price', 'mode': 'lines',
+             'line': {'color': GREEN}},
+            {'y': 'sell_price', 'name': 'Sell Price', 'mode': 'lines',
+             'line': {'color': RED}}]},
+    'market-funds-graph': {
+        'layout': {
+            'title': {'text': 'Market Funds Balance'},
+            'xaxis': {'title': {'text': 'Time'}},
+            'yaxis': _axis('Amount', GREEN, hoverformat='.2f'),
+            'legend': {'x': 0.25, 'yanchor': 'top'}},
+        'traces': [
+            {'y': 'fund_balance', 'name': 'Fund Balance', 'mode': 'lines',
+             'line': {'color': GREEN}}]},
+    'market-capital-graph': {
+        'layout': {
+            'title': {'text': 'Market Collateral Balance'},
+            'xaxis': {'title': {'text': 'Time'}},
+            'yaxis': _axis('Amount', GREEN, hoverformat='.2f'),
+            'legend': {'x': 0.25, 'yanchor': 'top'}},
+        'traces': [
+            {'y': 'collateral_balance', 'name': 'Vault Balance', 'mode': 'lines',
+             'line': {'color': GREEN}}]},
+    'pit-agent-graph': {
+        'layout': {
+            'title': {'text': 'Agent Point-in-Time'},
+            'xaxis': {'title': {'text': 'Time'}},
+            'yaxis': _axis('Capital', GREEN, hoverformat='.2f'),
+            'yaxis2': _right_axis('Tokens', RED, hoverformat='.2f'),
+            'legend': {'x': 0.25, 'yanchor': 'top'}},
+        'traces': [
+            {'y': 'capital', 'name': 'Capital', 'mode': 'lines',
+             'line': {'color': GREEN}},
+            {'y': 'tokens', 'name': 'Tokens', 'mode': 'lines',
+             'line': {'color': RED}, 'yaxis': 'y2'}]},
+}
+
+# Price impact heatmaps against trade size and supply, one trace per
+# metric of price_impact.py; only the metric sent is drawn
+_impact_trace = {'type': 'heatmap', 'colorscale': 'Viridis', 'zsmooth': False,
+                 'hovertemplate': 'size %{x}<br>supply %{y}<br>%{z:.2%}<extra></extra>',
+                 'colorbar': {'tickformat': '.0%'}}
+
+IMPACT_GRAPHS = {
+    'impact-graph': {
+        'layout': {
+            'title': {'text': 'Price Impact and Slippage'},
+            'xaxis': {'title': {'text': 'Trade Size'}, 'type': 'log'},
+            'yaxis': {'title': {'text': 'Supply'}}},
+        'traces': [dict(_impact_trace, z=m, name=m)
+                   for m in ['buy_impact', 'buy_slippage', 'sell_impact', 'sell_slippage']]},
+}
+
+
+def encode_array(values, dtype:str=None, decimals:int=None) -> Dict:
+    """Encode a numeric array as a base64 typed array.
+
+    Parameters
+    ----------
+    values: array-like
+        The numbers to encode.
+    dtype: str
+        Wire type, one of f4, f8, i1, i2, i4, u1, u2, u4.
+    decimals: int
+        Round to this many decimals before encoding.
+
+    Returns
+    -------
+    payload: dict
+        {'dtype': dtype, 'bdata': base64 string, 'shape': [n]}, the same
+        layout plotly.js uses for typed arrays.
+    """
+    if dtype is None:
+        dtype = default_dtype
+    if decimals is None:
+        decimals = default_decimals
+    a = np.asarray(values, dtype=np.float64)
+    if decimals is not None:
+        a = np.around(a, decimals=decimals)
+    a = np.ascontiguousarray(a, dtype=np.dtype(dtype).newbyteorder('<'))
+    return {'dtype': dtype,
+            'bdata': base64.b64encode(a.tobytes()).decode('ascii'),
+            'shape': list(a.shape)}
+
+
+def decode_array(payload:Dict) -> np.ndarray:
+    """Inverse of encode_array."""
+    a = np.frombuffer(base64.b64decode(payload['bdata']),
+                      dtype=np.dtype(payload['dtype']).newbyteorder('<'))
+    return a.reshape(payload['shape'])
+
+
+def figure_data(df, x:str, columns:List[str], dtype:str=None, decimals:int=None) -> Dict:
+    """Build the data-only payload for a set of graphs.
+
+    Only the x array and the listed y columns are sent.  Graphs whose
+    trace columns are missing from the payload skip those traces.
+    """
+    # x is integer valued (supply or timestep) so it is sent exactly
+    x_dtype = 'i4' if np.abs(df[x]).max() < 2**31 else 'f8'
+    return {'x': encode_array(df[x], x_dtype),
+            'columns': {c: encode_array(df[c], dtype, decimals) for c in columns}}
+
+
+def surface_data(x, y, columns:Dict, dtype:str=None, decimals:int=None) -> Dict:
+    """Build the data-only payload of heatmaps: columns are (len(y), len(x))
+    arrays."""
+    return {'x': encode_array(x, 'i4'),
+            'y': encode_array(y, 'i4'),
+            'columns': {c: encode_array(v, dtype, decimals) for c, v in columns.items()}}
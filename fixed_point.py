@@ -0,0 +1,62 @@
+"""Integer fixed-point accounting.
+
+In fixed-point mode, monetary amounts are integer multiples of 1/scale
+currency units, like wei for ether.  Prices, amounts, balances and capital
+are then exact, so long runs are reproducible and comparable with
+on-chain balances.  Curve table columns are converted in one vectorised
+pass to int64.  Balances are Python ints, so they cannot overflow.
+"""
+
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+
+# Micro units by default.  Larger scales (up to 1e18 for wei) need prices
+# below 2**63 / scale to fit the int64 table columns.
+default_scale = 10**6
+
+# Monetary columns of the simulation results
+money_columns = ['fund_balance', 'collateral_balance', 'buy_price', 'sell_price',
+                 'capital', 'amount', 'fee']
+
+
+def to_units(values, scale:int):
+    """Convert currency values to integer units, rounding to nearest."""
+    a = np.rint(np.asarray(values, dtype=np.float64) * scale)
+    if np.any(np.abs(a) >= 2.0**63):
+        raise OverflowError(f'Values exceed int64 at scale {scale}')
+    a = a.astype(np.int64)
+    if a.ndim == 0:
+        return int(a)
+    return a
+
+
+def from_units(values, scale:int):
+    """Convert integer units back to currency values."""
+    a = np.asarray(values, dtype=np.float64) / scale
+    if a.ndim == 0:
+        return float(a)
+    return a
+
+
+def table_units(token_dynamics:pd.DataFrame, scale:int) -> Dict[str, np.ndarray]:
+    """Integer unit columns of a curve table used for transactions.
+
+    The tax is the difference of the converted prices, so the collateral
+    and fund balances add up exactly to the amounts paid.
+    """
+    buy_price = to_units(token_dynamics['buy_price'], scale)
+    sell_price = to_units(token_dynamics['sell_price'], scale)
+    return {'buy_price': buy_price,
+            'sell_price': sell_price,
+            'tax_amount': buy_price - sell_price}
+
+
+def frame_from_units(df:pd.DataFrame, scale:int) -> pd.DataFrame:
+    """Copy of df with the monetary columns converted to currency."""
+    df = df.copy()
+    for c in money_columns:
+        if c in df.columns:
+            df[c] = from_units(df[c], scale)
+    return df
@@ -0,0 +1,188 @@
+"""Pure transition kernel of a market and the agents trading with it.
+
+States are immutable tuples and the curve is a set of plain arrays, so
+a transition returns new states instead of changing any:
+
+    market, agents, txns = step(market, agents, actions, curve)
+
+Market and TokenUser keep their state in attributes and call the kernel
+for every transaction, so simulations that step it directly, in batches,
+forked from a saved state or in parallel processes, follow the same
+arithmetic:
+
+    buy of n tokens at circulation c   pays buy_price[c:c+n], tax_amount
+                                       of it to the fund, the rest to
+                                       the collateral; stops at the end
+                                       of the table
+    sell of n tokens at circulation c  is paid sell_price[c:c+n] from the
+                                       collateral, as Market.sell_tokens
+                                       (see audit.py)
+
+The amounts are integer units when the curve is (see fixed_point.py).
+"""
+
+from typing import NamedTuple, Sequence, Tuple
+
+import numpy as np
+
+import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class MarketState(NamedTuple):
+    tokens_circulation: int = 0
+    tokens_bought: int = 0
+    tokens_sold: int = 0
+    collateral_balance: float = 0.0
+    fund_balance: float = 0.0
+
+
+class AgentState(NamedTuple):
+    capital: float
+    tokens: float
+
+
+class Txn(NamedTuple):
+    """A settled trade.  tokens is the number filled."""
+    action: str = ''
+    tokens: int = 0
+    amount: float = 0
+    fee: float = 0
+
+
+class Curve(NamedTuple):
+    """Arrays of a curve table, one entry per supply.
+
+    Parameters
+    ----------
+    buy_price: np.ndarray
+    sell_price: np.ndarray
+    tax_amount: np.ndarray
+    supply: int
+        Most tokens in circulation.
+    units: bool
+        The arrays are integer units of a fixed-point market.
+    """
+    buy_price: np.ndarray
+    sell_price: np.ndarray
+    tax_amount: np.ndarray
+    supply: int
+    units: bool = False
+
+
+def curve(token_dynamics, supply:int, token_units=None) -> Curve:
+    """Curve of a Market's table, of its integer units when given."""
+    table = token_units if token_units is not None else token_dynamics
+    return Curve(np.asarray(table['buy_price']),
+                 np.asarray(table['sell_price']),
+                 np.asarray(table['tax_amount']),
+                 supply,
+                 token_units is not None)
+
+
+def _sum(curve:Curve, prices:np.ndarray, start:int, end:int):
+    total = prices[start:end].sum()
+    return int(total) if curve.units else total
+
+
+def buy(market:MarketState, curve:Curve, num_tokens:int) -> Tuple[MarketState, Txn]:
+    """Market state after a buy of num_tokens, and the trade."""
+    start = market.tokens_circulation
+    end = min(start + num_tokens, len(curve.buy_price) - 1)
+    num_tokens = end - start
+    amount = _sum(curve, curve.buy_price, start, end)
+    tax_amount = _sum(curve, curve.tax_amount, start, end)
+    market = market._replace(
+        tokens_circulation=min(start + num_tokens, curve.supply),
+        tokens_bought=num_tokens,
+        collateral_balance=market.collateral_balance + (amount - tax_amount),
+        fund_balance=market.fund_balance + tax_amount)
+    return market, Txn('Buy', num_tokens, amount, tax_amount)
+
+
+def affordable(market:MarketState, curve:Curve, capital, num_tokens:int) -> int:
+    """Most tokens, up to num_tokens, that a buy at the market's
+    circulation fills for at most capital, with its fee."""
+    start = market.tokens_circulation
+    end = min(start + num_tokens, len(curve.buy_price) - 1)
+    if end <= start:
+        return 0
+    costs = np.cumsum(curve.buy_price[start:end] + curve.tax_amount[start:end])
+    n = int(np.searchsorted(costs, capital, side='right'))
+    # the buy sums the prices in another order, rounding may differ
+    while n > 0 and _sum(curve, curve.buy_price, start, start + n) + \
+            _sum(curve, curve.tax_amount, start, start + n) > capital:
+        n -= 1
+    return n
+
+
+def sell(market:MarketState, curve:Curve, num_tokens:int) -> Tuple[MarketState, Txn]:
+    """Market state after a sell of num_tokens, and the trade.  The fee
+    is reported but stays with the seller."""
+    start = market.tokens_circulation
+    end = min(start + num_tokens, len(curve.sell_price) - 1)
+    num_tokens = end - start
+    amount = _sum(curve, curve.sell_price, start, end)
+    tax_amount = _sum(curve, curve.tax_amount, start, end)
+    market = market._replace(
+        tokens_circulation=start - num_tokens,
+        tokens_sold=num_tokens,
+        collateral_balance=market.collateral_balance - amount)
+    return market, Txn('Sell', num_tokens, amount, tax_amount)
+
+
+def trade(market:MarketState, curve:Curve, action:str, num_tokens:int) -> Tuple[MarketState, Txn]:
+    """Market state after an action of an agent, 'Buy', 'Sell' or none."""
+    if action == 'Buy':
+        return buy(market, curve, num_tokens)
+    if action == 'Sell':
+        return sell(market, curve, num_tokens)
+    return market, Txn()
+
+
+def settle(agent:AgentState, txn:Txn) -> AgentState:
+    """Agent state after its trade txn.  Capital does not go negative."""
+    capital, tokens = agent
+    if txn.action == 'Buy':
+        capital += -txn.amount - txn.fee
+        tokens += txn.tokens
+    elif txn.action == 'Sell':
+        capital += txn.amount - txn.fee
+        tokens -= txn.tokens
+    return AgentState(max(0, capital), tokens)
+
+
+def buy_price(market:MarketState, curve:Curve):
+    price = curve.buy_price[market.tokens_circulation]
+    return int(price) if curve.units else price
+
+
+def sell_price(market:MarketState, curve:Curve):
+    price = curve.sell_price[market.tokens_circulation]
+    return int(price) if curve.units else price
+
+
+def step(market:MarketState, agents:Sequence[AgentState], actions:Sequence[Tuple[str, int]],
+         curve:Curve) -> Tuple[MarketState, Tuple[AgentState, ...], Tuple[Txn, ...]]:
+    """One timestep: the actions of the agents, (action, tokens) each,
+    executed on the market in order, and every agent settled with its
+    trade.
+
+    Returns
+    -------
+    market: MarketState
+        After the last trade.
+    agents: tuple
+        AgentState of each agent.
+    txns: tuple
+        Txn of each agent.
+    """
+    settled = []
+    txns = []
+    for agent, (action, num_tokens) in zip(agents, actions):
+        market, txn = trade(market, curve, action, num_tokens)
+        settled.append(settle(agent, txn))
+        txns.append(txn)
+    return market, tuple(settled), tuple(txns)
@@ -0,0 +1,397 @@
+"""Load test of the dashboard callbacks.
+
+Simulated analysts use the real callback endpoints, either in this
+process through the Flask test client of app1.server or over HTTP
+against a running deployment.  Each user repeatedly
+
+    drags a curve slider     the server callbacks of the slider, for
+                             each of drag_steps values, then
+                             update_graphs once the inputs are still
+                             (as the debounce of assets/requests.js)
+                             and update_impact with its curve data
+    launches a simulation    with probability simulation_share; the
+                             on_simulation long callback is polled every
+                             poll_ms until its results arrive
+
+with an exponentially distributed think time of mean think_ms between
+actions.  Callbacks and their inputs are read from /_dash-dependencies
+and the initial values from /_dash-layout, so the requests are those a
+browser sends.
+
+The report has the throughput and the p50/p95/p99 latency of every
+callback, and of whole simulations from the click to the results.
+
+    python loadtest.py --users 8 --duration 60 --warm
+    python loadtest.py --url http://localhost:8050 --users 32
+
+In process, the requests share the GIL with the server, so the figures
+are those of a single worker.  The cache warm-up of app1 is off and its
+caches are in a temporary directory, removed at exit, so the test starts
+cold without touching those of a running server; with --warm it is run
+again on the caches the first pass filled, and both are reported.  Over
+HTTP the caches of the server are as found.
+
+--sim-steps changes the simulation length of the server for every user
+of it, not only for the test, and the report says so.
+"""
+
+import atexit
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+import logging
+
+from sigmoid_dash_ui import curve_inputs
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Concurrent users
+users = 4
+# Seconds users keep acting; actions in progress are finished
+duration = 30.0
+# Mean think time between actions
+think_ms = 1000
+# Slider values sent per drag, drag_ms apart
+drag_steps = 5
+drag_ms = 50
+# Fraction of actions launching a simulation
+simulation_share = 0.1
+# Long callback polling interval, the dcc.Interval default of Dash
+poll_ms = 1000
+# Seconds a simulation is waited for
+simulation_timeout = 600.0
+
+# Sliders dragged, their server callbacks follow from the dependencies
+sliders = ['supply-slider', 'a1-slider', 'b1-slider', 'c1-slider', 'k1-slider',
+           't1-slider', 'a2-slider', 'b2-slider', 'c2-slider', 'h2-slider']
+
+dispatch_path = '/_dash-update-component'
+
+
+class TestClient:
+    """Requests to a Flask server in this process."""
+
+    def __init__(self, server) -> None:
+        self.client = server.test_client()
+
+
+    def get(self, path:str):
+        return self.client.get(path).get_json()
+
+
+    def post(self, path:str, body:Dict) -> Tuple[int, Dict]:
+        r = self.client.post(path, json=body)
+        return r.status_code, r.get_json(silent=True)
+
+
+class HttpClient:
+    """Requests to a server at url."""
+
+    def __init__(self, url:str) -> None:
+        self.url = url.rstrip('/')
+
+
+    def get(self, path:str):
+        with urllib.request.urlopen(self.url + path) as r:
+            return json.loads(r.read())
+
+
+    def post(self, path:str, body:Dict) -> Tuple[int, Dict]:
+        request = urllib.request.Request(self.url + path, data=json.dumps(body).encode(),
+                                         headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(request) as r:
+                data = r.read()
+                return r.status, json.loads(data) if data else None
+        except urllib.error.HTTPError as e:
+            return e.code, None
+
+
+def layout_props(layout) -> Dict[str, object]:
+    """'id.property' values of the components with an id."""
+    props = {}
+    stack = [layout]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, list):
+            stack.extend(node)
+        elif isinstance(node, dict) and 'props' in node:
+            p = node['props']
+            if isinstance(p.get('id'), str):
+                for k, v in p.items():
+                    if k != 'children':
+                        props[f'{p["id"]}.{k}'] = v
+            stack.append(p.get('children'))
+    return props
+
+
+def _prop_id(dep:Dict) -> str:
+    return f'{dep["id"]}.{dep["property"]}'
+
+
+class Callback:
+    """A server callback of /_dash-dependencies.
+
+    Parameters
+    ----------
+    spec: dict
+        Its entry of the dependencies.
+    name: str
+        Reported name, the first output by default.
+    """
+
+    def __init__(self, spec:Dict, name:str=None) -> None:
+        self.spec = spec
+        self.inputs = [_prop_id(d) for d in spec['inputs']]
+        self.state = [_prop_id(d) for d in spec['state']]
+        self.name = name or spec['output'].strip('.').split('...')[0]
+
+
+    def body(self, props:Dict, changed:List[str]) -> Dict:
+        """Request body with the values of props."""
+        dep = lambda d: dict(d, value=props.get(_prop_id(d)))
+        return {'output': self.spec['output'],
+                'inputs': [dep(d) for d in self.spec['inputs']],
+                'state': [dep(d) for d in self.spec['state']],
+                'changedPropIds': changed}
+
+
+class LoadTest:
+    """Users acting on the dashboard concurrently.
+
+    Parameters
+    ----------
+    client: callable
+        Returns a new client, one per user: TestClient or HttpClient.
+    names: dict
+        Reported name of the callback of each output, e.g. the function
+        names of app.callback_map.
+    seed: int
+        Seed of the users' choices.
+    """
+
+    def __init__(self, client, names:Dict[str, str]=None, users:int=users, duration:float=duration,
+                 think_ms:float=think_ms, drag_steps:int=drag_steps, drag_ms:float=drag_ms,
+                 simulation_share:float=simulation_share, poll_ms:float=poll_ms,
+                 simulation_timeout:float=simulation_timeout, seed:int=0) -> None:
+        self.client = client
+        self.users = users
+        self.duration = duration
+        self.think_ms = think_ms
+        self.drag_steps = drag_steps
+        self.drag_ms = drag_ms
+        self.simulation_share = simulation_share
+        self.poll_ms = poll_ms
+        self.simulation_timeout = simulation_timeout
+        self.seed = seed
+
+        c = client()
+        names = names or {}
+        specs = [d for d in c.get('/_dash-dependencies') if not d.get('clientside_function')]
+        self.callbacks = [Callback(d, names.get(d['output'])) for d in specs]
+        self.layout = layout_props(c.get('/_dash-layout'))
+        self.graphs = self._by_input('curve-request.data')[0]
+        self.impact = self._by_input('curve-data.data')[0]
+        self.simulation = self._by_input('sim-button.n_clicks')[0]
+        self.sim_steps = self._by_input('sim-slider.value')[0]
+        self.interval = next(i for i in self.simulation.inputs if i.startswith('_long_callback_interval'))
+        self.store = self.simulation.state[0]
+        self.records = []
+        self.runs = 0
+        # Server state changed by the test, reported with the results
+        self.notes = []
+
+
+    def _by_input(self, prop_id:str) -> List[Callback]:
+        return [c for c in self.callbacks if prop_id in c.inputs]
+
+
+    def _call(self, client, callback:Callback, props:Dict, changed:List[str]) -> Dict:
+        start = time.perf_counter()
+        status, data = client.post(dispatch_path, callback.body(props, changed))
+        # 204 is a PreventUpdate
+        ok = status in (200, 204)
+        self.records.append((callback.name, start, time.perf_counter() - start, ok))
+        response = (data or {}).get('response', {}) if ok else {}
+        for component, values in response.items():
+            for k, v in values.items():
+                props[f'{component}.{k}'] = v
+        return response
+
+
+    def set_sim_steps(self, steps:int) -> None:
+        """Set the simulation length of the server, for all users."""
+        props = dict(self.layout, **{'sim-slider.value': steps})
+        self._call(self.client(), self.sim_steps, props, ['sim-slider.value'])
+        self.notes.append(f'Simulation length set to {steps} steps on the server, '
+                          f'for every user of it until changed')
+
+
+    def drag(self, client, props:Dict, rng:np.random.Generator, user:Dict) -> None:
+        slider = sliders[rng.integers(len(sliders))]
+        lo, hi = props.get(f'{slider}.min', 0), props.get(f'{slider}.max', 1)
+        step = props.get(f'{slider}.step') or (hi - lo) / 100
+        start = props.get(f'{slider}.value', lo)
+        target = rng.uniform(lo, hi)
+        prop = f'{slider}.value'
+        for value in np.linspace(start, target, self.drag_steps + 1)[1:]:
+            props[prop] = float(np.clip(lo + round((value - lo) / step) * step, lo, hi))
+            for callback in self._by_input(prop):
+                self._call(client, callback, props, [prop])
+            time.sleep(self.drag_ms / 1000)
+        self.update_curves(client, props, user)
+
+
+    def update_curves(self, client, props:Dict, user:Dict) -> None:
+        user['seq'] += 1
+        props['curve-request.data'] = {'client': user['client'], 'seq': user['seq'],
+                                       'time': time.time() * 1000,
+                                       'values': [props.get(f'{i}.value') for i in curve_inputs]}
+        response = self._call(client, self.graphs, props, ['curve-request.data'])
+        if 'curve-data' in response:
+            self._call(client, self.impact, props, ['curve-data.data'])
+
+
+    def simulate(self, client, props:Dict, user:Dict) -> None:
+        # Dash keys long callback jobs by their arguments, so every user
+        # clicks its own n_clicks values rather than sharing jobs
+        user['clicks'] += 1
+        props['sim-button.n_clicks'] = user['index'] * 1_000_000 + user['clicks']
+        props[self.store] = props.get(self.store) or {}
+        start = time.perf_counter()
+        changed = ['sim-button.n_clicks']
+        while time.perf_counter() - start < self.simulation_timeout:
+            response = self._call(client, self.simulation, props, changed)
+            if 'sim-notes' in response:
+                self.records.append(('simulation (end to end)', start, time.perf_counter() - start, True))
+                return
+            time.sleep(self.poll_ms / 1000)
+            props[self.interval] = (props.get(self.interval) or 0) + 1
+            changed = [self.interval]
+        self.records.append(('simulation (end to end)', start, time.perf_counter() - start, False))
+
+
+    def user(self, index:int, end:float) -> None:
+        client = self.client()
+        rng = np.random.default_rng([self.seed, index])
+        props = dict(self.layout)
+        # clicks of earlier runs are not repeated, their jobs may be cached
+        user = {'index': index, 'client': f'loadtest-{index}', 'seq': 0, 'clicks': self.runs * 100_000}
+        # the first curve of the page
+        self.update_curves(client, props, user)
+        while time.time() < end:
+            time.sleep(rng.exponential(self.think_ms / 1000))
+            if time.time() >= end:
+                break
+            if rng.random() < self.simulation_share:
+                self.simulate(client, props, user)
+            else:
+                self.drag(client, props, rng, user)
+
+
+    def run(self) -> pd.DataFrame:
+        """Run the users for duration seconds and return report()."""
+        self.records = []
+        self.started = time.time()
+        end = self.started + self.duration
+        threads = [threading.Thread(target=self.user, args=(i, end), name=f'user-{i}', daemon=True)
+                   for i in range(self.users)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.elapsed = time.time() - self.started
+        self.runs += 1
+        return self.report()
+
+
+    def report(self) -> pd.DataFrame:
+        """Requests, errors, throughput and latency of every callback."""
+        df = pd.DataFrame(self.records, columns=['callback', 'start', 'seconds', 'ok'])
+        rows = []
+        for name, g in df.groupby('callback', sort=False):
+            ms = g.loc[g['ok'], 'seconds'].to_numpy() * 1000
+            p50, p95, p99 = np.percentile(ms, [50, 95, 99]) if len(ms) else (np.nan,) * 3
+            rows.append({'callback': name,
+                         'requests': len(g),
+                         'errors': int((~g['ok']).sum()),
+                         'per_second': len(g) / self.elapsed,
+                         'mean_ms': ms.mean() if len(ms) else np.nan,
+                         'p50_ms': p50, 'p95_ms': p95, 'p99_ms': p99})
+        return pd.DataFrame(rows)
+
+
+    def summary(self) -> str:
+        report = self.report()
+        requests = report.loc[report['callback'] != 'simulation (end to end)', 'requests'].sum()
+        return '\n'.join(
+            self.notes
+            + [f'{self.users} users, {self.elapsed:.1f}s, {requests} requests, '
+               f'{requests / self.elapsed:.1f} requests/s',
+               report.to_string(index=False, float_format=lambda x: f'{x:.1f}')])
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Load test of the dashboard callbacks.')
+    parser.add_argument('--url', help='server to test, app1.server in this process when missing')
+    parser.add_argument('--users', type=int, default=users)
+    parser.add_argument('--duration', type=float, default=duration)
+    parser.add_argument('--think-ms', type=float, default=think_ms)
+    parser.add_argument('--drag-steps', type=int, default=drag_steps)
+    parser.add_argument('--simulation-share', type=float, default=simulation_share)
+    parser.add_argument('--poll-ms', type=float, default=poll_ms)
+    parser.add_argument('--sim-steps', type=int,
+                        help='simulation length set on the server first, for all its users')
+    parser.add_argument('--warm', action='store_true',
+                        help='run again on the caches filled by the first run and report both')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help='CSV file of the report')
+    args = parser.parse_args()
+
+    if args.url:
+        client, names = lambda: HttpClient(args.url), None
+        first = 'first run, server caches as found'
+    else:
+        # a warm-up process would fill the caches during the test
+        os.environ['WARM_UP'] = '0'
+        # caches of its own, those of ./cache may be a running server's
+        directory = tempfile.mkdtemp(prefix='loadtest-')
+        atexit.register(shutil.rmtree, directory, ignore_errors=True)
+        os.environ['APP_CACHE'] = os.path.join(directory, 'cache')
+        os.environ['CURVE_STORE'] = os.path.join(directory, 'curves')
+        # read when sigmoid_dash_ui was imported
+        import curve_store
+        curve_store.default_path = os.environ['CURVE_STORE']
+        import app1
+        app1.checkpoint_path = os.path.join(directory, 'checkpoints')
+        first = 'cold caches'
+        client = lambda: TestClient(app1.server)
+        names = {output: c['callback'].__name__ for output, c in app1.app.callback_map.items()
+                 if 'callback' in c}
+        # the long callback registers a wrapper named callback
+        names = {k: 'on_simulation' if v == 'callback' else v for k, v in names.items()}
+    test = LoadTest(client, names, users=args.users, duration=args.duration, think_ms=args.think_ms,
+                    drag_steps=args.drag_steps, simulation_share=args.simulation_share,
+                    poll_ms=args.poll_ms, seed=args.seed)
+    if args.sim_steps:
+        test.set_sim_steps(args.sim_steps)
+    reports = []
+    for phase in [first, 'warm caches'][:2 if args.warm else 1]:
+        test.run()
+        print(f'{phase}:\n{test.summary()}\n')
+        reports.append(test.report().assign(phase=phase))
+    if args.out:
+        pd.concat(reports, ignore_index=True).to_csv(args.out, index=False)
@@ -6,6 +6,10 @@ import pandas as pd
 import logging
 
 from bonding_curve import BondingCurve
+import fixed_point
+import kernel
+import memory
+import metrics
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -34,28 +38,118 @@ class Market:
     supply = supply_value
 
     bonding_curve = None
-    token_dynamics = None
-
-    def __init__(self, bonding_curve:BondingCurve) -> None:
+    _token_dynamics = None
+    # (supply, curve_parameters) of a table not built yet, see
+    # defer_token_dynamics
+    pending_curve = None
+    # Parameters of token_dynamics, the bonding curve's when not given
+    curve_parameters = None
+
+    # Fixed-point accounting: when set, prices, amounts and balances are
+    # integers in units of 1/scale (see fixed_point.py)
+    scale = None
+    _token_units = None
+
+    # Shared memory-mapped table store (see curve_store.py)
+    curve_store = None
+
+    # Arrays of the curve table for the transition kernel (see kernel.py)
+    kernel_curve = None
+    kernel_source = ()
+
+    def __init__(self, bonding_curve:BondingCurve, scale:int=None, curve_store=None) -> None:
         self.bonding_curve = bonding_curve
+        self.scale = scale
+        self.curve_store = curve_store
         self.token_dynamics = self.update_token_dynamics(self.supply)
+        self.reset()
         # logger.info(f'token_dynamics init {self.token_dynamics}')
 
 
     def reset(self):
-        self.collateral_balance = 0.0
-        self.fund_balance = 0.0
+        self.collateral_balance = 0 if self.scale else 0.0
+        self.fund_balance = 0 if self.scale else 0.0
         self.tokens_circulation = 0
         self.tokens_bought = 0
         self.tokens_sold = 0       
 
 
+    @property
+    def state(self) -> kernel.MarketState:
+        """The balances and circulation, as the kernel's state."""
+        return kernel.MarketState(self.tokens_circulation, self.tokens_bought, self.tokens_sold,
+                                  self.collateral_balance, self.fund_balance)
+
+
+    @state.setter
+    def state(self, state:kernel.MarketState) -> None:
+        (self.tokens_circulation, self.tokens_bought, self.tokens_sold,
+         self.collateral_balance, self.fund_balance) = state
+
+
+    def curve(self) -> kernel.Curve:
+        """The kernel's arrays of the curve table, rebuilt when the table
+        or the supply changes."""
+        source = (self.token_dynamics, self.supply, self.token_units if self.scale else None)
+        if self.kernel_curve is None or any(a is not b for a, b in zip(source, self.kernel_source)):
+            self.kernel_curve = kernel.curve(*source)
+            self.kernel_source = source
+        return self.kernel_curve
+
+
+    def _trade(self, transition, num_tokens) -> kernel.Txn:
+        self.state, txn = transition(self.state, self.curve(), num_tokens)
+        return txn
+
+
+    @property
+    def token_dynamics(self) -> pd.DataFrame:
+        """The curve table, built on first use after defer_token_dynamics."""
+        if self.pending_curve is not None:
+            self.update_token_dynamics(*self.pending_curve)
+        return self._token_dynamics
+
+
+    @token_dynamics.setter
+    def token_dynamics(self, token_dynamics:pd.DataFrame) -> None:
+        self._token_dynamics = token_dynamics
+        self.pending_curve = None
+
+
+    @property
+    def token_units(self) -> pd.DataFrame:
+        if self.pending_curve is not None:
+            self.update_token_dynamics(*self.pending_curve)
+        return self._token_units
+
+
+    @token_units.setter
+    def token_units(self, token_units:pd.DataFrame) -> None:
+        self._token_units = token_units
+
+
+    def defer_token_dynamics(self, supply:int, curve_parameters:Dict=None) -> None:
+        """Set the curve without building its table, which is built when
+        token_dynamics is next used."""
+        self.supply = supply
+        self.curve_parameters = curve_parameters if curve_parameters is not None else self.bonding_curve.curve_parameters
+        self.pending_curve = (supply, curve_parameters)
+
+
     def update_token_dynamics(self, supply:int, curve_parameters:Dict=None) -> pd.DataFrame:
         # if len(curve_parameters > 0):
         #     self.bonding_curve.update_parameters(curve_parameters)
+        self.pending_curve = None
         self.supply = supply
+        self.curve_parameters = curve_parameters if curve_parameters is not None else self.bonding_curve.curve_parameters
         s = np.arange(0., supply + 1)  #  , supply/n_points)
-        self.token_dynamics = self.bonding_curve.token_dynamics(s, curve_parameters)
+        with metrics.curve_table_seconds.time(store=self.curve_store is not None), memory.stage('curve_build'):
+            if self.curve_store is not None:
+                self.token_dynamics = self.curve_store.token_dynamics(self.bonding_curve, s, curve_parameters)
+            else:
+                self.token_dynamics = self.bonding_curve.token_dynamics(s, curve_parameters)
+        if self.scale and self.token_dynamics is not None:
+            self.token_units = fixed_point.table_units(self.token_dynamics, self.scale)
         # logger.info(f'token_dynamics update {self.token_dynamics}')
         return self.token_dynamics
 
@@ -75,33 +169,14 @@ class Market:
             The amount of reserve currency swapped in exchange for tokens.
         tax_amount: float
             The transaction fee.
+
+        Amounts are integer units in fixed-point mode.
         """
         if self.token_dynamics is None:
             logger.info(f'buy_tokens token_dynamics {self.token_dynamics}')
             raise RuntimeError("Bonding curve is not initialized.  Cannot execute transaction.")
-        # logger.info(f'buy_tokens token_dynamics cols {self.token_dynamics.columns}')
-        start = self.tokens_circulation
-        end = min(start + num_tokens, len(self.token_dynamics) - 1)
-        num_tokens = end - start
-        # logger.info(f'buy_tokens start {start} end {end} token_dynamics len {len(self.token_dynamics)}')
-
-        p = self.token_dynamics[['buy_price', 'tax_amount', 'fund_amount']][start:end]
-        # logger.debug(f'buy_tokens token_dynamics[{start}:{end}]\n{p}')
-        p = p.agg({'buy_price': 'sum',
-                   'tax_amount': 'sum',
-                   'fund_amount': 'sum'
-        })
-    
-        # logger.info(f'buy_tokens p agg {p}')
-        amount = p['buy_price']  # the sum of prices in the slice
-        tax_amount = p['tax_amount']
-        net_asset_value = amount - tax_amount
-        self.collateral_balance += net_asset_value
-        self.fund_balance += tax_amount  
-        self.tokens_bought = num_tokens
-        self.tokens_circulation += num_tokens
-        self.tokens_circulation = min(self.tokens_circulation, self.supply)
-        return num_tokens, amount, tax_amount
+        txn = self._trade(kernel.buy, num_tokens)
+        return txn.tokens, txn.amount, txn.fee
 
 
     # To be implemented
@@ -140,24 +215,13 @@ class Market:
             The amount of reserve currency
         fee: float
             The transaction fee.
+
+        Amounts are integer units in fixed-point mode.
         """
         if self.token_dynamics is None:
             raise RuntimeError("Bonding curve is not initialized.  Cannot execute transaction.")
-        start = self.tokens_circulation
-        end = min(start + num_tokens, len(self.token_dynamics) - 1)
-        num_tokens = end - start
-        p = self.token_dynamics[['sell_price', 'tax_amount', 'fund_amount']][start:end]
-        p = p.agg({'sell_price': 'sum',
-                   'tax_amount': 'sum',
-                   'fund_amount': 'sum'
-        })
-        amount = p['sell_price']
-        tax_amount = p['tax_amount']
-        self.collateral_balance -= amount
-        # self.fund_balance -= tax_amount
-        self.tokens_sold = num_tokens
-        self.tokens_circulation -= num_tokens
-        return num_tokens, amount, tax_amount
+        txn = self._trade(kernel.sell, num_tokens)
+        return txn.tokens, txn.amount, txn.fee
 
 
     # To be implemented
@@ -185,8 +249,7 @@ class Market:
         if self.token_dynamics is None:
             raise RuntimeError("Bonding curve is not initialized.  Cannot get pricing.")
         try:
-            price = self.token_dynamics[['buy_price']].iloc[self.tokens_circulation].sum()
-            return price
+            return kernel.buy_price(self.state, self.curve())
         except IndexError as e:
             logger.info('Error in buy_price {}:{}'.format(self.tokens_circulation, len(self.token_dynamics[['buy_price']])))  
 
@@ -194,4 +257,4 @@ class Market:
     def sell_price(self):
         if self.token_dynamics is None:
             raise RuntimeError("Bonding curve is not initialized.  Cannot get pricing.")
-        return self.token_dynamics[['sell_price']].iloc[self.tokens_circulation].sum()
+        return kernel.sell_price(self.state, self.curve())
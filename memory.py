@@ -0,0 +1,264 @@
+"""Memory accounting of simulation runs.
+
+A MemoryTracker attributes memory to the stages of a run: the Python
+allocations of each stage with tracemalloc (numpy arrays included), the
+resident set size after it, and the peak RSS of the whole run.  Sizes of
+the objects a run keeps, such as the cadCAD history or the figure
+payloads, are added with add_size().
+
+    with MemoryTracker() as tracker:
+        with tracker.stage('simulation'):
+            ...
+    tracker.report()
+
+Stages run outside a tracker, like curve builds in the curve callback,
+go through the module level stage() and keep their last record, which
+the next tracker reports.
+
+tracemalloc and the peak RSS are process wide, so one tracker at a time
+accounts them: a tracker entered while another one is active, e.g. by a
+simulation started from a second Dash request, only records the timings
+and RSS of its stages, and its peak RSS is that of the process.  A traced
+run still counts the allocations of other threads.
+
+tracemalloc slows down allocation heavy code: a cadCAD run of 1000 steps
+takes about four times as long traced, so it is off unless trace is set
+(MEMORY_TRACE=1).  The RSS and its peak are always followed.
+"""
+
+import json
+import os
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Dict, List
+
+import logging
+
+import metrics
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Trace Python allocations of the stages
+trace = os.environ.get('MEMORY_TRACE', '0') == '1'
+
+# Held by the tracker accounting the process, one at a time
+_lock = threading.Lock()
+# Tracker holding the lock
+_active = None
+# Last record of each stage run outside a tracker
+last_stages = {}
+# Stages in progress of each thread, innermost last
+_local = threading.local()
+
+
+def _stages() -> List:
+    if not hasattr(_local, 'stages'):
+        _local.stages = []
+    return _local.stages
+
+
+def peak_rss() -> int:
+    """Peak resident set size of this process, since reset_peak_rss()
+    where supported."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # KB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def reset_peak_rss() -> bool:
+    """Restart the peak RSS from the current RSS, Linux only."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def format_bytes(n:float) -> str:
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if abs(n) < 1024 or unit == 'GB':
+            return f'{n:.1f} {unit}' if unit != 'B' else f'{int(n)} B'
+        n /= 1024
+
+
+def payload_bytes(obj) -> int:
+    """Size of obj serialised as a Dash response."""
+    from plotly.utils import PlotlyJSONEncoder
+    return len(json.dumps(obj, cls=PlotlyJSONEncoder))
+
+
+def list_bytes(items:List, sample:int=100) -> int:
+    """Approximate size of a list of flat dicts, from a sample of them."""
+    if not items:
+        return sys.getsizeof(items)
+    step = max(1, len(items) // sample)
+    sampled = items[::step]
+    each = sum(sys.getsizeof(d) + sum(sys.getsizeof(v) for v in getattr(d, 'values', lambda: [])())
+               for d in sampled) / len(sampled)
+    return int(sys.getsizeof(items) + each * len(items))
+
+
+def frame_bytes(df) -> int:
+    """Size of a DataFrame, with the contents of dict columns like the
+    cadCAD state variables."""
+    total = 0
+    for column, nbytes in df.memory_usage(deep=True, index=False).items():
+        if df[column].dtype == object and len(df) and isinstance(df[column].iat[0], dict):
+            nbytes = list_bytes(df[column].tolist())
+        total += nbytes
+    return int(total + df.index.memory_usage())
+
+
+class _Stage:
+
+    def __init__(self, name:str, tracing:bool) -> None:
+        self.name = name
+        self.tracing = tracing
+
+
+    def __enter__(self) -> '_Stage':
+        stages = _stages()
+        if self.tracing:
+            current, peak = tracemalloc.get_traced_memory()
+            # the peak is reset for this stage, keep the enclosing one's
+            if stages:
+                stages[-1].peak = max(stages[-1].peak, peak)
+            self.start_traced = self.peak = current
+            tracemalloc.reset_peak()
+        stages.append(self)
+        self.start_rss = metrics.rss_bytes()
+        self.start = time.perf_counter()
+        return self
+
+
+    def __exit__(self, *exc) -> None:
+        stages = _stages()
+        stages.remove(self)
+        self.record = {'stage': self.name,
+                       'seconds': time.perf_counter() - self.start,
+                       'rss': metrics.rss_bytes()}
+        self.record['rss_change'] = self.record['rss'] - self.start_rss
+        if self.tracing:
+            current, peak = tracemalloc.get_traced_memory()
+            self.peak = max(self.peak, peak)
+            if stages:
+                stages[-1].peak = max(stages[-1].peak, self.peak)
+            # allocated and still alive at the end, and the most held at once
+            self.record['allocated'] = current - self.start_traced
+            self.record['peak'] = self.peak - self.start_traced
+
+
+class MemoryTracker:
+    """Memory accounting of one run.
+
+    Parameters
+    ----------
+    trace: bool
+        Trace allocations with tracemalloc, the module trace by default.
+        Only the tracker accounting the process traces.
+    """
+
+    def __init__(self, trace:bool=None) -> None:
+        self.trace = globals()['trace'] if trace is None else trace
+        self.stages = []
+        self.sizes = {}
+        self.peak_rss = None
+        self.owner = False
+        self.thread = None
+
+
+    def __enter__(self) -> 'MemoryTracker':
+        global _active
+        self.owner = _lock.acquire(blocking=False)
+        if not self.owner:
+            logger.info('Memory of another run is being accounted, only timings and RSS are recorded')
+        self.thread = threading.get_ident()
+        self.tracing = self.owner and self.trace
+        self.started_tracing = self.tracing and not tracemalloc.is_tracing()
+        if self.started_tracing:
+            tracemalloc.start()
+        self.reset_peak = self.owner and reset_peak_rss()
+        self.start_rss = metrics.rss_bytes()
+        self.earlier = dict(last_stages)
+        if self.owner:
+            _active = self
+        return self
+
+
+    def __exit__(self, *exc) -> None:
+        global _active
+        self.peak_rss = peak_rss()
+        if self.owner:
+            if self.started_tracing:
+                tracemalloc.stop()
+            _active = None
+            self.owner = False
+            _lock.release()
+
+
+    @contextmanager
+    def stage(self, name:str):
+        """Account the memory of the block to stage name."""
+        with _Stage(name, self.tracing and tracemalloc.is_tracing()) as s:
+            yield s
+        self.stages.append(s.record)
+
+
+    def add_size(self, name:str, nbytes:int) -> None:
+        """Size of an object kept by the run."""
+        self.sizes[name] = int(nbytes)
+
+
+    def report(self) -> Dict:
+        """Stages, sizes and RSS of the run, stages run before it first."""
+        stages = [dict(r, before_run=True) for r in self.earlier.values()] + self.stages
+        return {'stages': stages,
+                'sizes': dict(self.sizes),
+                'start_rss': self.start_rss,
+                'peak_rss': self.peak_rss,
+                # since the start of the process when the peak could not be reset
+                'peak_rss_of_run': self.reset_peak}
+
+
+    def summary(self) -> str:
+        lines = [f'Memory: peak RSS {format_bytes(self.peak_rss or peak_rss())}'
+                 + ('' if self.reset_peak else ' (process)')
+                 + f', {format_bytes(self.start_rss)} at start']
+        for r in self.report()['stages']:
+            line = f'  {r["stage"]}: {r["seconds"]:.2f}s, RSS {format_bytes(r["rss"])} ({format_bytes(r["rss_change"])})'
+            if 'peak' in r:
+                line += f', allocated {format_bytes(r["allocated"])}, peak {format_bytes(r["peak"])}'
+            if r.get('before_run'):
+                line += ', last run before'
+            lines.append(line)
+        for name, n in self.sizes.items():
+            lines.append(f'  {name}: {format_bytes(n)}')
+        return '\n'.join(lines)
+
+
+@contextmanager
+def stage(name:str):
+    """Account the block to stage name of the run in progress on this
+    thread, or keep it as the last record of the stage."""
+    active = _active
+    if active is not None and active.thread == threading.get_ident():
+        with active.stage(name) as s:
+            yield s
+        return
+    # untraced, the tracing belongs to the tracker of another thread
+    with _Stage(name, False) as s:
+        yield s
+    last_stages[name] = s.record
@@ -0,0 +1,239 @@
+"""Prometheus-style metrics.
+
+Counters, gauges and histograms kept in process and rendered in the
+Prometheus text exposition format by instrument(), which adds a /metrics
+route to the Flask server and times every Dash callback request.
+Collectors registered with add_collector() are called at scrape time for
+values owned elsewhere, such as cache statistics.
+
+Each gunicorn worker has its own metrics; scrape the workers separately
+or label them with the pid, which every sample carries.  Totals shared by
+the workers are kept outside the process and set by a collector.
+"""
+
+import bisect
+import os
+import resource
+import threading
+import time
+from typing import Callable, Dict, List, Tuple
+
+import logging
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Latency buckets in seconds
+default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+content_type = 'text/plain; version=0.0.4; charset=utf-8'
+
+_lock = threading.Lock()
+_metrics = {}
+_collectors = []
+
+
+def _labels(labels:Dict) -> str:
+    labels = dict(labels, pid=os.getpid())
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for v in labels.values())
+    return '{' + ','.join(f'{k}="{v}"' for k, v in zip(labels, escaped)) + '}'
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name:str, help:str) -> None:
+        self.name = name
+        self.help = help
+        self.values = {}
+        with _lock:
+            if name in _metrics:
+                raise ValueError(f'Metric {name} is already registered')
+            _metrics[name] = self
+
+
+    def samples(self) -> List[Tuple[str, Dict, float]]:
+        return [(self.name, dict(key), value) for key, value in self.values.items()]
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount:float=1, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value:float, **labels) -> None:
+        with _lock:
+            self.values[tuple(sorted(labels.items()))] = value
+
+
+    def inc(self, amount:float=1, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+    def dec(self, amount:float=1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name:str, help:str, buckets:Tuple[float, ...]=default_buckets) -> None:
+        super().__init__(name, help)
+        self.buckets = tuple(sorted(buckets))
+
+
+    def bucket(self, value:float) -> int:
+        """Index of the bucket counting value, len(buckets) for +Inf."""
+        return bisect.bisect_left(self.buckets, value)
+
+
+    def observe(self, value:float, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        i = self.bucket(value)
+        with _lock:
+            counts, total = self.values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[i] += 1
+            self.values[key] = (counts, total + value)
+
+
+    def time(self, **labels) -> '_Timer':
+        """Context manager observing the duration of its block."""
+        return _Timer(self, labels)
+
+
+    def samples(self) -> List[Tuple[str, Dict, float]]:
+        samples = []
+        for key, (counts, total) in self.values.items():
+            labels = dict(key)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                samples.append((f'{self.name}_bucket', dict(labels, le=le), cumulative))
+            samples.append((f'{self.name}_sum', labels, total))
+            samples.append((f'{self.name}_count', labels, cumulative))
+        return samples
+
+
+class _Timer:
+
+    def __init__(self, histogram:Histogram, labels:Dict) -> None:
+        self.histogram = histogram
+        self.labels = labels
+
+
+    def __enter__(self) -> '_Timer':
+        self.start = time.perf_counter()
+        return self
+
+
+    def __exit__(self, *exc) -> None:
+        self.elapsed = time.perf_counter() - self.start
+        self.histogram.observe(self.elapsed, **self.labels)
+
+
+def add_collector(collector:Callable[[], List[Tuple[str, str, str, float]]]) -> None:
+    """Register a function returning (name, type, help, value) tuples at scrape time."""
+    _collectors.append(collector)
+
+
+def rss_bytes() -> int:
+    """Resident set size of this process."""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        # peak rather than current RSS, in KB on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _process_metrics() -> List[Tuple[str, str, str, float]]:
+    return [('process_resident_memory_bytes', 'gauge', 'Resident set size in bytes.', rss_bytes()),
+            ('process_threads', 'gauge', 'Threads of the process.', threading.active_count())]
+
+
+add_collector(_process_metrics)
+
+
+def exposition() -> str:
+    """All metrics in the Prometheus text format."""
+    lines = []
+    # Collectors first, they may update the registered metrics
+    collected = []
+    for collector in _collectors:
+        try:
+            for name, type_, help, value in collector():
+                collected.append((name, type_, help, [(name, {}, value)]))
+        except Exception as e:
+            logger.info(f'metrics collector {collector.__name__} failed: {e}')
+    with _lock:
+        metrics = [(m.name, m.type, m.help, m.samples()) for m in _metrics.values()]
+    metrics += collected
+    for name, type_, help, samples in metrics:
+        lines.append(f'# HELP {name} {help}')
+        lines.append(f'# TYPE {name} {type_}')
+        for sample, labels, value in samples:
+            lines.append(f'{sample}{_labels(labels)} {float(value)!r}')
+    return '\n'.join(lines) + '\n'
+
+
+callback_seconds = Histogram('dash_callback_seconds', 'Dash callback request latency by callback output.')
+callback_errors = Counter('dash_callback_errors_total', 'Dash callback requests with an error status.')
+callbacks_in_progress = Gauge('dash_callbacks_in_progress', 'Dash callback requests being processed.')
+simulation_steps = Counter('simulation_steps_total', 'Simulated timesteps.')
+simulation_steps_per_second = Histogram('simulation_steps_per_second', 'Simulation throughput.',
+                                        buckets=(100, 1e3, 1e4, 1e5, 1e6, 1e7))
+curve_table_seconds = Histogram('curve_table_build_seconds', 'Curve table build or load time.')
+simulation_peak_rss = Histogram('simulation_peak_rss_bytes', 'Peak resident set size of simulation runs.',
+                                buckets=tuple(2.0**i for i in range(26, 35)))
+
+
+def instrument(server, path:str='/metrics') -> None:
+    """Serve the metrics at path and time the Dash callbacks of a Flask server."""
+    from flask import Response, g, request
+
+    @server.before_request
+    def _start_timer():
+        if request.path.endswith('/_dash-update-component'):
+            g.metrics_start = time.perf_counter()
+            callbacks_in_progress.inc()
+
+
+    @server.after_request
+    def _observe(response):
+        start = g.get('metrics_start')
+        if start is not None:
+            body = request.get_json(silent=True) or {}
+            callback = body.get('output', 'unknown')
+            callback_seconds.observe(time.perf_counter() - start, callback=callback)
+            if response.status_code >= 400:
+                callback_errors.inc(callback=callback)
+        return response
+
+
+    # Runs even when the callback raised, unlike after_request
+    @server.teardown_request
+    def _finish(exc):
+        if g.pop('metrics_start', None) is not None:
+            callbacks_in_progress.dec()
+
+
+    @server.route(path)
+    def _metrics():
+        return Response(exposition(), content_type=content_type)
@@ -0,0 +1,272 @@
+"""Simulation of several markets with cross-curve arbitrage.
+
+Each market is a Market with its own bonding curve, e.g. the same token
+under different scenarios or competing tokens.  The curve tables are
+stacked into (markets x supply) arrays with prefix sums, so every step
+prices all markets with one vectorised lookup and trades of any size
+cost two lookups.
+
+Each step, each market's own traders (an order_flow.OrderFlow per market)
+trade first.  Then arbitrage agents buy a token on the curve where it is
+cheapest and sell it on the curve that pays most, while the spread
+exceeds their cost.  They only trade between markets of the same token,
+the token bought is the one sold, so they hold no inventory; competing
+tokens only interact through their own traders.  Trades follow the Market arithmetic: a buy of n
+tokens at circulation c pays buy_price[c:c+n], tax_amount of it to the
+fund, and a sell is paid sell_price[c:c+n] from the collateral.  Capital
+flight between markets shows in the collateral balances.
+"""
+
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+import logging
+
+import sigmoid
+import market
+from market import Market
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class ArbitrageAgent:
+    """Trades the spread between markets.
+
+    Parameters
+    ----------
+    capital: float
+        Capital available to buy tokens.
+    cost: float
+        Cost of a round trip (buy one token, sell one token), e.g. gas
+        and transfer fees.
+    max_trades: int
+        Round trips per step at most.
+    """
+
+    def __init__(self, capital:float, cost:float=0.0, max_trades:int=10) -> None:
+        self.initial_capital = capital
+        self.capital = capital
+        self.cost = cost
+        self.max_trades = max_trades
+        self.profit = 0.0
+        self.trades = 0
+
+
+    def reset(self) -> None:
+        self.capital = self.initial_capital
+        self.profit = 0.0
+        self.trades = 0
+
+
+class MultiMarket:
+    """Markets simulated together.
+
+    Parameters
+    ----------
+    markets: dict
+        Market of each name, with its token dynamics initialised.
+    flows: dict
+        order_flow.OrderFlow of the traders of each market, none if missing.
+    arbitrageurs: list
+        ArbitrageAgents trading between the markets of the same token.
+    tokens: dict
+        Token traded in each market, by default all markets trade the
+        same token under different curves.
+    """
+
+    def __init__(self, markets:Dict[str, Market], flows:Dict=None,
+                 arbitrageurs:List[ArbitrageAgent]=None, tokens:Dict[str, str]=None) -> None:
+        self.names = list(markets.keys())
+        self.markets = markets
+        self.flows = flows or {}
+        self.arbitrageurs = arbitrageurs or []
+        self.tokens = [None if tokens is None else tokens[name] for name in self.names]
+        tables = [markets[name].token_dynamics for name in self.names]
+        if any(t is None for t in tables):
+            raise RuntimeError("Bonding curve is not initialized.  Cannot execute transaction.")
+        m = len(tables)
+        # last index of each table, trades stop there like Market
+        self.last = np.array([len(t) - 1 for t in tables])
+        width = self.last.max() + 1
+        self.rows = np.arange(m)
+        self.buy_price = np.full((m, width), np.inf)
+        self.sell_price = np.zeros((m, width))
+        tax = np.zeros((m, width))
+        for i, t in enumerate(tables):
+            self.buy_price[i, :len(t)] = t['buy_price'].to_numpy(dtype=float)
+            self.sell_price[i, :len(t)] = t['sell_price'].to_numpy(dtype=float)
+            tax[i, :len(t)] = t['tax_amount'].to_numpy(dtype=float)
+        # prefix sums with a leading zero column: sum of [c:c+n] = P[c+n] - P[c]
+        zeros = np.zeros((m, 1))
+        self.buy_sum = np.hstack([zeros, np.cumsum(np.where(np.isfinite(self.buy_price), self.buy_price, 0), axis=1)])
+        self.sell_sum = np.hstack([zeros, np.cumsum(self.sell_price, axis=1)])
+        self.tax_sum = np.hstack([zeros, np.cumsum(tax, axis=1)])
+        self.reset()
+
+
+    def reset(self) -> None:
+        self.circulation = np.array([self.markets[n].tokens_circulation for n in self.names], dtype=np.int64)
+        self.collateral = np.array([self.markets[n].collateral_balance for n in self.names], dtype=float)
+        self.fund = np.array([self.markets[n].fund_balance for n in self.names], dtype=float)
+        for agent in self.arbitrageurs:
+            agent.reset()
+        for flow in self.flows.values():
+            flow.reset()
+
+
+    def prices(self):
+        """Buy and sell prices of all markets at their circulation."""
+        circ = np.minimum(self.circulation, self.last)
+        return self.buy_price[self.rows, circ], self.sell_price[self.rows, circ]
+
+
+    def _buy(self, rows, n):
+        start = self.circulation[rows]
+        end = np.minimum(start + n, self.last[rows])
+        amount = self.buy_sum[rows, end] - self.buy_sum[rows, start]
+        tax = self.tax_sum[rows, end] - self.tax_sum[rows, start]
+        self.collateral[rows] += amount - tax
+        self.fund[rows] += tax
+        self.circulation[rows] = end
+        return end - start, amount
+
+
+    def _sell(self, rows, n):
+        start = self.circulation[rows]
+        end = np.minimum(start + n, self.last[rows])
+        amount = self.sell_sum[rows, end] - self.sell_sum[rows, start]
+        self.collateral[rows] -= amount
+        self.circulation[rows] = start - (end - start)
+        return end - start, amount
+
+
+    def _flows(self, t:int, orders:np.ndarray) -> None:
+        """Net orders of the markets' own traders, sells limited to the
+        circulation."""
+        net = orders[:, t]
+        buys = np.flatnonzero(net > 0)
+        if len(buys):
+            self._buy(buys, net[buys])
+        sells = np.flatnonzero(net < 0)
+        if len(sells):
+            self._sell(sells, np.minimum(-net[sells], self.circulation[sells]))
+
+
+    def _arbitrage(self, agent:ArbitrageAgent, trades:np.ndarray) -> None:
+        # a round trip buys and sells the same token, in two of its markets
+        token = np.array(self.tokens, dtype=object)
+        excluded = (token[:, None] != token[None, :]) | np.eye(len(self.names), dtype=bool)
+        for _ in range(agent.max_trades):
+            buy, sell = self.prices()
+            # spread[i, j]: buy one token in market i, sell one in market j
+            spread = sell[None, :] - buy[:, None] - agent.cost
+            spread[excluded] = -np.inf
+            # markets at the end of their curve cannot fill either side
+            full = self.circulation >= self.last
+            spread[:, (self.circulation < 1) | full] = -np.inf
+            spread[(buy > agent.capital) | full, :] = -np.inf
+            k = int(np.argmax(spread))
+            i, j = divmod(k, len(self.names))
+            if not spread[i, j] > 0:
+                break
+            _, paid = self._buy(np.array([i]), 1)
+            _, received = self._sell(np.array([j]), 1)
+            profit = received[0] - paid[0] - agent.cost
+            agent.capital += profit
+            agent.profit += profit
+            agent.trades += 1
+            trades[i, j] += 1
+
+
+    def run(self, steps:int) -> 'MultiMarket':
+        """Simulate steps steps from the current state and record them."""
+        m = len(self.names)
+        orders = np.zeros((m, steps), dtype=np.int64)
+        for i, name in enumerate(self.names):
+            if name in self.flows:
+                orders[i] = self.flows[name].block(1, 0, steps)[0]
+        self.trades = np.zeros((m, m), dtype=np.int64)
+        history = {c: np.empty((steps + 1, m)) for c in
+                   ['tokens_circulation', 'collateral_balance', 'fund_balance', 'buy_price', 'sell_price']}
+        profit = np.empty((steps + 1, max(len(self.arbitrageurs), 1)))
+
+        def record(t):
+            buy, sell = self.prices()
+            history['tokens_circulation'][t] = self.circulation
+            history['collateral_balance'][t] = self.collateral
+            history['fund_balance'][t] = self.fund
+            history['buy_price'][t] = buy
+            history['sell_price'][t] = sell
+            profit[t] = [a.profit for a in self.arbitrageurs] or [0.0]
+
+        record(0)
+        for t in range(steps):
+            self._flows(t, orders)
+            for agent in self.arbitrageurs:
+                self._arbitrage(agent, self.trades)
+            record(t + 1)
+        self.history = history
+        self.arbitrage_profit = profit
+        self.steps = steps
+        logger.info(f'MultiMarket ran {steps} steps, arbitrage trades {int(self.trades.sum())}')
+        return self
+
+
+    def apply(self) -> None:
+        """Leave the Markets in the final simulated state."""
+        for i, name in enumerate(self.names):
+            m = self.markets[name]
+            m.tokens_circulation = int(self.circulation[i])
+            m.collateral_balance = float(self.collateral[i])
+            m.fund_balance = float(self.fund[i])
+
+
+    def to_frame(self) -> pd.DataFrame:
+        """Per-step state of every market, one row per timestep and market."""
+        steps = self.steps + 1
+        df = pd.DataFrame({c: v.ravel() for c, v in self.history.items()})
+        df.insert(0, 'market', np.tile(self.names, steps))
+        df.insert(0, 'timestep', np.repeat(np.arange(steps), len(self.names)))
+        return df
+
+
+    def capital_flight(self) -> pd.DataFrame:
+        """Collateral and fund change of each market over the run, and the
+        arbitrage round trips between each pair (bought in row, sold in
+        column)."""
+        h = self.history
+        summary = pd.DataFrame({
+            'collateral_change': h['collateral_balance'][-1] - h['collateral_balance'][0],
+            'fund_change': h['fund_balance'][-1] - h['fund_balance'][0],
+            'circulation_change': h['tokens_circulation'][-1] - h['tokens_circulation'][0],
+        }, index=self.names)
+        trades = pd.DataFrame(self.trades, index=self.names, columns=self.names)
+        return pd.concat([summary, trades.add_prefix('arb_to_')], axis=1)
+
+
+def scenario_markets(scenarios:List[str], curve_parameters:Dict=None,
+                     supply:int=market.initial_supply) -> Dict[str, Market]:
+    """One Market per scenario, all with the same other curve parameters."""
+    markets = {}
+    for scenario in scenarios:
+        m = Market(sigmoid.Sigmoid(market.min_supply, supply, market.max_price/2))
+        params = dict(m.bonding_curve.curve_parameters if curve_parameters is None else curve_parameters,
+                      scenario=scenario)
+        m.update_token_dynamics(supply, params)
+        markets[scenario] = m
+    return markets
+
+
+if __name__ == '__main__':
+    from order_flow import OrderFlow
+
+    # Dashboard defaults, see app1.py
+    sigmoid.max_slope = market.max_supply * 1e3
+    markets = scenario_markets(['s1', 's3', 's4'])
+    flows = {name: OrderFlow(seed=i, arrival_rate=2) for i, name in enumerate(markets)}
+    mm = MultiMarket(markets, flows, [ArbitrageAgent(10000.0, cost=0.5)]).run(1000)
+    print(mm.capital_flight())
+    print(f'arbitrage profit {mm.arbitrageurs[0].profit:.2f}')
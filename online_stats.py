@@ -0,0 +1,278 @@
+"""Streaming statistics of simulation runs.
+
+Each statistic is an accumulator updated in O(1) time and memory per
+step, so a run, or every run of a sweep, can be summarised without
+keeping its history:
+
+    pnl                wealth of an agent, capital plus its tokens at the
+                       sell price, less its wealth at the first step
+    drawdown           fall of the wealth from its running peak, current
+                       and largest, absolute and relative to the peak
+    twap               time-weighted average buy and sell price, each
+                       price held until the next step
+    collateral ratio   collateral balance over the circulating tokens at
+                       the sell price, current, lowest and time-weighted
+    volatility         of the log returns of the buy price between steps:
+                       realised (root of the summed squares) and the
+                       standard deviation per step (Welford)
+    volume             buys and sells: count, tokens, amount and fees
+
+Steps are fed with update(), or a chunk of cadCAD results at a time
+with update_frame() (see app1.audit_frame).  Statistics are kept per
+Monte Carlo run; with snapshot_every, the values of each run are also
+recorded every snapshot_every time units.
+
+Fixed-point amounts (see fixed_point.py) are converted to currency when
+a scale is given.
+"""
+
+import math
+from typing import Dict
+
+import pandas as pd
+
+import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class AgentStats:
+    """Profit and drawdown of one agent."""
+
+    def __init__(self) -> None:
+        self.initial = None
+        self.wealth = 0.0
+        self.peak = 0.0
+        self.max_drawdown = 0.0
+        self.max_drawdown_ratio = 0.0
+
+
+    def update(self, capital:float, tokens:float, price:float) -> None:
+        wealth = capital + tokens * price
+        if self.initial is None:
+            self.initial = self.peak = wealth
+        self.wealth = wealth
+        if wealth > self.peak:
+            self.peak = wealth
+        drawdown = self.peak - wealth
+        if drawdown > self.max_drawdown:
+            self.max_drawdown = drawdown
+        if self.peak > 0 and drawdown / self.peak > self.max_drawdown_ratio:
+            self.max_drawdown_ratio = drawdown / self.peak
+
+
+    def values(self) -> Dict:
+        return {'wealth': self.wealth,
+                'pnl': self.wealth - (self.initial or 0.0),
+                'drawdown': self.peak - self.wealth,
+                'max_drawdown': self.max_drawdown,
+                'max_drawdown_ratio': self.max_drawdown_ratio}
+
+
+class RunStats:
+    """Market and agent statistics of one run."""
+
+    def __init__(self) -> None:
+        self.steps = 0
+        self.start = None
+        self.time = None
+        # prices and ratio held since the last step
+        self.buy_price = None
+        self.sell_price = None
+        self.ratio = None
+        self.buy_area = 0.0
+        self.sell_area = 0.0
+        self.ratio_area = 0.0
+        self.ratio_time = 0.0
+        self.min_ratio = None
+        # log returns of the buy price
+        self.returns = 0
+        self.return_mean = 0.0
+        self.return_m2 = 0.0
+        self.return_squares = 0.0
+        self.volume = {'buys': 0, 'sells': 0, 'buy_tokens': 0, 'sell_tokens': 0,
+                       'buy_amount': 0.0, 'sell_amount': 0.0, 'fees': 0.0}
+        self.agents = {}
+
+
+    def update(self, time:float, market_state:Dict, agent_states:Dict[object, Dict], txns:Dict[object, Dict]) -> None:
+        buy_price = market_state['buy_price']
+        sell_price = market_state['sell_price']
+        if self.time is None:
+            self.start = time
+        else:
+            dt = time - self.time
+            self.buy_area += self.buy_price * dt
+            self.sell_area += self.sell_price * dt
+            if self.ratio is not None:
+                self.ratio_area += self.ratio * dt
+                self.ratio_time += dt
+            if self.buy_price > 0 and buy_price > 0:
+                r = math.log(buy_price / self.buy_price)
+                self.returns += 1
+                delta = r - self.return_mean
+                self.return_mean += delta / self.returns
+                self.return_m2 += delta * (r - self.return_mean)
+                self.return_squares += r * r
+        self.time = time
+        self.steps += 1
+        self.buy_price = buy_price
+        self.sell_price = sell_price
+
+        market_value = market_state['tokens_circulation'] * sell_price
+        self.ratio = market_state['collateral_balance'] / market_value if market_value > 0 else None
+        if self.ratio is not None and (self.min_ratio is None or self.ratio < self.min_ratio):
+            self.min_ratio = self.ratio
+
+        volume = self.volume
+        for txn in txns.values():
+            action = txn['action']
+            if action == 'Buy':
+                volume['buys'] += 1
+                volume['buy_tokens'] += txn['tokens']
+                volume['buy_amount'] += txn['amount']
+            elif action == 'Sell':
+                volume['sells'] += 1
+                volume['sell_tokens'] += txn['tokens']
+                volume['sell_amount'] += txn['amount']
+            else:
+                continue
+            volume['fees'] += txn['fee']
+
+        for agent, state in agent_states.items():
+            if agent not in self.agents:
+                self.agents[agent] = AgentStats()
+            self.agents[agent].update(state['capital'], state['tokens'], sell_price)
+
+
+    def values(self) -> Dict:
+        elapsed = self.time - self.start if self.time is not None else 0
+        values = {
+            'steps': self.steps,
+            'time': self.time,
+            'twap_buy_price': self.buy_area / elapsed if elapsed else self.buy_price,
+            'twap_sell_price': self.sell_area / elapsed if elapsed else self.sell_price,
+            'collateral_ratio': self.ratio,
+            'min_collateral_ratio': self.min_ratio,
+            'twa_collateral_ratio': self.ratio_area / self.ratio_time if self.ratio_time else self.ratio,
+            'realised_volatility': math.sqrt(self.return_squares),
+            'return_std': math.sqrt(self.return_m2 / (self.returns - 1)) if self.returns > 1 else 0.0,
+        }
+        values.update(self.volume)
+        for agent, stats in self.agents.items():
+            values.update({f'{name}_{agent}': v for name, v in stats.values().items()})
+        return values
+
+
+class OnlineStats:
+    """Streaming statistics of the runs of a simulation.
+
+    Parameters
+    ----------
+    snapshot_every: float
+        Time between snapshots of the values of each run, None for final
+        values only.
+    scale: int
+        Fixed-point scale of the amounts, None when they are currency.
+    """
+
+    # state fields holding amounts, converted with the scale
+    market_amounts = ('collateral_balance', 'fund_balance', 'buy_price', 'sell_price')
+    txn_amounts = ('amount', 'fee')
+
+    def __init__(self, snapshot_every:float=None, scale:int=None) -> None:
+        self.snapshot_every = snapshot_every
+        self.scale = scale
+        self.runs = {}
+        self.snapshots = []
+        self.next_snapshot = {}
+
+
+    def _currency(self, state:Dict, fields) -> Dict:
+        return dict(state, **{f: state[f] / self.scale for f in fields if f in state})
+
+
+    def update(self, time:float, market_state:Dict, agent_states:Dict[object, Dict],
+               txns:Dict[object, Dict]=None, run:int=1) -> None:
+        """Add a step of a run.
+
+        Parameters
+        ----------
+        time: float
+            Time of the step, a timestep or an event time.
+        market_state: dict
+            With the fields of the cadCAD market_state.
+        agent_states: dict
+            capital and tokens of each agent updated at the step.  Agents
+            not given keep the wealth of their last update.
+        txns: dict
+            action, tokens, amount and fee of the trades of the step.
+        """
+        txns = txns or {}
+        if self.scale:
+            market_state = self._currency(market_state, self.market_amounts)
+            agent_states = {a: self._currency(s, ('capital',)) for a, s in agent_states.items()}
+            txns = {a: self._currency(t, self.txn_amounts) for a, t in txns.items()}
+        stats = self.runs.get(run)
+        if stats is None:
+            stats = self.runs[run] = RunStats()
+            self.next_snapshot[run] = time
+        stats.update(time, market_state, agent_states, txns)
+        if self.snapshot_every and time >= self.next_snapshot[run]:
+            self.snapshots.append(dict(stats.values(), run=run))
+            # skip snapshot times without steps
+            self.next_snapshot[run] += self.snapshot_every * (
+                (time - self.next_snapshot[run]) // self.snapshot_every + 1)
+
+
+    def update_frame(self, frame:pd.DataFrame, time_column:str='timestep') -> None:
+        """Add the steps of a chunk of cadCAD results, with the agent as
+        agent 0."""
+        if not len(frame):
+            return
+        runs = frame['run'] if 'run' in frame else [1] * len(frame)
+        for t, run, market_state, agent_state, txn in zip(
+                frame[time_column].tolist(), list(runs), frame['market_state'],
+                frame['agent_state'], frame['agent_txn']):
+            self.update(t, market_state, {0: agent_state}, {0: txn}, run)
+
+
+    def values(self, run:int=None) -> Dict:
+        """Final values of a run, or the mean over the runs when run is None."""
+        if run is not None:
+            return self.runs[run].values()
+        frame = pd.DataFrame([s.values() for s in self.runs.values()])
+        return frame.mean(numeric_only=True).to_dict() if len(frame) else {}
+
+
+    def snapshots_frame(self) -> pd.DataFrame:
+        return pd.DataFrame(self.snapshots)
+
+
+    def report(self) -> Dict:
+        return {'runs': {run: stats.values() for run, stats in self.runs.items()},
+                'snapshots': list(self.snapshots)}
+
+
+    def summary(self) -> str:
+        values = self.values()
+        if not values:
+            return 'Statistics: no steps'
+        runs = f' (mean of {len(self.runs)} runs)' if len(self.runs) > 1 else ''
+
+        def number(name):
+            v = values.get(name)
+            return 'n/a' if v is None or (isinstance(v, float) and math.isnan(v)) else f'{v:,.4g}'
+        lines = [f'Statistics{runs}: TWAP buy {number("twap_buy_price")} sell {number("twap_sell_price")}, '
+                 f'collateral ratio {number("collateral_ratio")} (min {number("min_collateral_ratio")}), '
+                 f'realised volatility {number("realised_volatility")}',
+                 f'  volume: {number("buys")} buys of {number("buy_tokens")} tokens for {number("buy_amount")}, '
+                 f'{number("sells")} sells of {number("sell_tokens")} tokens for {number("sell_amount")}, '
+                 f'fees {number("fees")}']
+        agents = sorted({k[len('pnl_'):] for k in values if k.startswith('pnl_')})
+        for agent in agents:
+            lines.append(f'  agent {agent}: PnL {number("pnl_" + agent)}, '
+                         f'max drawdown {number("max_drawdown_" + agent)} '
+                         f'({number("max_drawdown_ratio_" + agent)})')
+        return '\n'.join(lines)
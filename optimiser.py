@@ -0,0 +1,276 @@
+"""Inverse design of sigmoid curve parameters.
+
+Searches the curve parameters of a scenario, within the dashboard slider
+bounds, for a curve that raises a target fund balance at a given supply
+while keeping the tax rate inside a band and the collateral ratio above a
+minimum.  Candidates are snapped to the slider steps and evaluated with
+sigmoid.evaluate_curves, the pass that builds the curve tables, in
+chunks split across a thread pool.
+
+The fund, tax range and collateral ratio of every evaluated point are
+cached at module level per scenario, supply and fund supply, for the
+last cached_spaces of them.  Scores are computed from them for each
+search, so repeated and refined searches, including those of separate
+optimisers like the dashboard's for every button press, only pay for new
+points whatever their targets.
+"""
+
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Tuple
+
+import numpy as np
+import pandas as pd
+
+import logging
+
+import sigmoid
+import market
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Curve parameters searched per scenario.  The sell curve follows the buy
+# curve except in the No Constraints scenario, as in the dashboard.
+scenario_parameters = {
+    's0': ['buy_price', 'buy_supply', 'buy_slope'],
+    's1': ['buy_price', 'buy_supply', 'buy_slope', 'vertical_displacement'],
+    's2': ['buy_price', 'buy_supply', 'buy_slope', 'vertical_displacement'],
+    's3': ['buy_price', 'buy_supply', 'buy_slope', 'tax'],
+    's4': ['buy_price', 'buy_supply', 'buy_slope', 'horizontal_displacement'],
+    's5': ['buy_price', 'buy_supply', 'buy_slope', 'vertical_displacement',
+           'sell_price', 'sell_supply', 'sell_slope', 'horizontal_displacement'],
+}
+
+linked = {'sell_price': 'buy_price', 'sell_supply': 'buy_supply', 'sell_slope': 'buy_slope'}
+
+# Weight of constraint violations relative to the fund balance error
+penalty = 10.0
+
+# Candidates per task of the thread pool
+chunk_size = 64
+
+# Search spaces whose evaluated points are kept
+cached_spaces = 16
+# (scenario, supply, fund_supply) -> {point: (fund, tax min, tax max, ratio)},
+# least recently used first
+_spaces = OrderedDict()
+_spaces_lock = threading.Lock()
+
+
+def _space(key:Tuple) -> Dict:
+    """Evaluated points of a search space, the cache of its optimisers."""
+    with _spaces_lock:
+        points = _spaces.pop(key, None)
+        if points is None:
+            points = {}
+        _spaces[key] = points
+        while len(_spaces) > cached_spaces:
+            _spaces.popitem(last=False)
+        return points
+
+
+def clear_cache() -> None:
+    with _spaces_lock:
+        _spaces.clear()
+
+
+def bounds(supply:float) -> Dict[str, Tuple[float, float, float]]:
+    """(min, max, step) of each curve parameter, from the slider settings.
+
+    Read at call time since app1 adjusts the sigmoid slider ranges.
+    """
+    return {
+        'buy_price': (market.price_step, market.max_price, market.price_step),
+        'buy_supply': (market.min_supply, supply, market.supply_step),
+        'buy_slope': (sigmoid.min_slope, sigmoid.max_slope, sigmoid.slope_step),
+        'vertical_displacement': (sigmoid.k_min, sigmoid.k_max, sigmoid.k_step),
+        # t = 1 has an infinite buy price
+        'tax': (sigmoid.t_min, sigmoid.t_max - sigmoid.t_step, sigmoid.t_step),
+        'sell_price': (market.price_step, market.max_price, market.price_step),
+        'sell_supply': (market.min_supply, supply, market.supply_step),
+        'sell_slope': (sigmoid.min_slope, sigmoid.max_slope, sigmoid.slope_step),
+        'horizontal_displacement': (0, supply, market.supply_step),
+    }
+
+
+class CurveOptimiser:
+    """Search curve parameters for design targets.
+
+    Parameters
+    ----------
+    scenario: str
+        Key into sigmoid.scenarios.
+    supply: float
+        Maximum token supply of the curve.
+    target_fund: float
+        Fund balance (buy minus sell collateral) to raise at fund_supply.
+    fund_supply: float
+        Supply at which the target applies, defaults to supply.
+    tax_band: tuple
+        (min, max) tax rate allowed over the whole supply range.
+    min_collateral_ratio: float
+        Minimum sell / buy collateral at fund_supply.
+    workers: int
+        Threads evaluating candidate chunks.
+    limits: dict
+        (min, max) of curve parameters, such as the current slider
+        ranges, in place of those of bounds().
+    """
+
+    def __init__(self, scenario:str, supply:float, target_fund:float,
+                 fund_supply:float=None, tax_band:Tuple[float, float]=None,
+                 min_collateral_ratio:float=None, workers:int=4,
+                 limits:Dict[str, Tuple[float, float]]=None) -> None:
+        self.scenario = scenario
+        self.supply = supply
+        self.target_fund = target_fund
+        self.fund_supply = supply if fund_supply is None else fund_supply
+        self.tax_band = tax_band
+        self.min_collateral_ratio = min_collateral_ratio
+        self.workers = workers
+        self.names = scenario_parameters[scenario]
+        self.bounds = bounds(supply)
+        for name, (lo, hi) in (limits or {}).items():
+            if name == 'tax':
+                # t = 1 has an infinite buy price
+                hi = min(hi, sigmoid.t_max - sigmoid.t_step)
+            self.bounds[name] = (lo, hi, self.bounds[name][2])
+        # the supply grid, and the fund supply last
+        self.x = np.append(np.arange(0., supply + 1), self.fund_supply)
+        # evaluated points: parameter tuple -> (fund, tax min, tax max, ratio)
+        self.cache = _space((scenario, float(supply), float(self.fund_supply)))
+
+
+    def curve_parameters(self, values) -> Dict:
+        """Full Sigmoid.curve_parameters for a point of the search space."""
+        p = {
+            'scenario': self.scenario,
+            'supply': self.supply,
+            'buy_price': market.max_price / 2,
+            'buy_supply': self.supply / 2,
+            'buy_slope': sigmoid.max_slope / 10,
+            'vertical_displacement': sigmoid.k_max / 2,
+            'tax': sigmoid.t_max / 5,
+            'horizontal_displacement': self.supply / 5,
+        }
+        p.update(zip(self.names, values))
+        for sell, buy in linked.items():
+            if sell not in self.names:
+                p[sell] = p[buy]
+        return p
+
+
+    def _snap(self, points:np.ndarray) -> np.ndarray:
+        lo, hi, step = np.array([self.bounds[n] for n in self.names], dtype=float).T
+        points = np.clip(lo + np.round((points - lo) / step) * step, lo, hi)
+        if 'horizontal_displacement' in self.names:
+            # the sell curve's inflection point stays within the supply, as
+            # on the h2 slider
+            h = self.names.index('horizontal_displacement')
+            b = points[:, self.names.index('buy_supply')] if 'buy_supply' in self.names else self.supply / 2
+            points[:, h] = np.maximum(np.minimum(points[:, h], self.supply - b), 0)
+        return points
+
+
+    def _evaluate(self, points:np.ndarray) -> np.ndarray:
+        """(fund, tax min, tax max, ratio) of a chunk of points, from their
+        curve table columns."""
+        out = np.empty((len(sigmoid.curve_columns), len(self.x)))
+        buy_price, sell_price, buy_col, sell_col = (
+            sigmoid.curve_columns.index(c) for c in ('buy_price', 'sell_price', 'buy_col', 'sell_col'))
+        rows = np.empty((len(points), 4))
+        for i, point in enumerate(points):
+            values = sigmoid.evaluate_curves(self.x, self.curve_parameters(point.tolist()), out=out)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                tax_rate = 1 - values[sell_price, :-1] / values[buy_price, :-1]
+                fund = values[buy_col, -1] - values[sell_col, -1]
+                ratio = values[sell_col, -1] / values[buy_col, -1]
+            tax_rate = tax_rate[np.isfinite(tax_rate)]
+            rows[i] = (fund,
+                       tax_rate.min() if len(tax_rate) else np.inf,
+                       tax_rate.max() if len(tax_rate) else -np.inf,
+                       ratio)
+        return rows
+
+
+    def score(self, metrics:np.ndarray) -> np.ndarray:
+        """Scores of rows of (fund, tax min, tax max, ratio)."""
+        fund, tax_min, tax_max, ratio = np.asarray(metrics, dtype=float).reshape(-1, 4).T
+        with np.errstate(invalid='ignore'):
+            score = np.abs(fund - self.target_fund) / max(abs(self.target_fund), 1.0)
+            if self.tax_band is not None:
+                lo, hi = self.tax_band
+                score += penalty * (np.maximum(lo - tax_min, 0) + np.maximum(tax_max - hi, 0))
+            if self.min_collateral_ratio is not None:
+                score += penalty * np.maximum(self.min_collateral_ratio - ratio, 0)
+        return np.where(np.isfinite(score), score, np.inf)
+
+
+    def evaluate(self, points:np.ndarray) -> np.ndarray:
+        """Scores of the points, evaluating only the ones not yet cached."""
+        keys = [tuple(p) for p in points]
+        new = np.array(list({k: None for k in keys if k not in self.cache}))
+        if len(new):
+            chunks = [new[i:i + chunk_size] for i in range(0, len(new), chunk_size)]
+            if self.workers and len(chunks) > 1:
+                with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                    results = list(executor.map(self._evaluate, chunks))
+            else:
+                results = [self._evaluate(c) for c in chunks]
+            for key, row in zip(map(tuple, new), np.concatenate(results)):
+                self.cache[key] = row
+        return self.score([self.cache[k] for k in keys])
+
+
+    def search(self, iterations:int=10, batch:int=256, shrink:float=0.5,
+               tolerance:float=1e-3, seed:int=0) -> Dict:
+        """Random search with a box that shrinks around the best point.
+
+        Returns
+        -------
+        result: dict
+            'curve_parameters' of the best point, its 'score' (0 when the
+            target is met exactly and no constraint is violated), 'fund',
+            'tax_min', 'tax_max', 'collateral_ratio' and 'evaluations'.
+        """
+        rng = np.random.default_rng(seed)
+        lo, hi, _ = np.array([self.bounds[n] for n in self.names], dtype=float).T
+        width = hi - lo
+        best = None
+        best_score = np.inf
+        for i in range(iterations):
+            if best is None:
+                points = lo + rng.random((batch, len(lo))) * width
+            else:
+                points = best + (rng.random((batch, len(lo))) - 0.5) * width
+                points = np.vstack([best, points])
+            points = self._snap(points)
+            scores = self.evaluate(points)
+            j = int(np.argmin(scores))
+            if scores[j] < best_score:
+                best, best_score = points[j], scores[j]
+            logger.debug(f'search iteration {i} best score {best_score}')
+            if best_score <= tolerance:
+                break
+            width = width * shrink
+
+        fund, tax_min, tax_max, ratio = self.cache[tuple(best)]
+        return {'curve_parameters': self.curve_parameters([float(v) for v in best]),
+                'score': float(best_score),
+                'fund': float(fund),
+                'tax_min': float(tax_min),
+                'tax_max': float(tax_max),
+                'collateral_ratio': float(ratio),
+                'evaluations': len(self.cache)}
+
+
+    def history(self) -> pd.DataFrame:
+        """All evaluated points of the search space with their metrics,
+        scored for this optimiser's targets."""
+        points = dict(self.cache)
+        df = pd.DataFrame([list(k) + list(v) for k, v in points.items()],
+                          columns=self.names + ['fund', 'tax_min', 'tax_max', 'collateral_ratio'])
+        df.insert(len(self.names), 'score', self.score(list(points.values())) if points else [])
+        return df
@@ -0,0 +1,209 @@
+"""Stochastic order flow for TokenUser's 'Flow' policy.
+
+Each step, orders arrive as a Poisson process, order sizes in tokens are
+lognormal (rounded up to whole tokens) and each order is a buy with the
+probability of the current demand regime.  Regimes switch as a Markov
+chain with geometric durations.  The agent trades the net order of the
+step.
+
+Draws are generated in blocks of block_steps steps from a seeded
+numpy.random.Generator, so each step costs a couple of array lookups.
+Every Monte Carlo run has an independent stream spawned from the seed,
+so runs are reproducible and uncorrelated whatever order they execute in.
+"""
+
+from typing import Dict, Tuple
+
+import numpy as np
+
+import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Buy probability of each demand regime
+default_regimes = {
+    'balanced': 0.5,
+    'bull': 0.7,
+    'bear': 0.3,
+}
+
+# Steps generated per block
+block_steps = 1 << 16
+
+
+class OrderStream:
+    """Net orders of one Monte Carlo run, generated a block at a time.
+
+    The order of a timestep only depends on the seed, the run and the
+    timestep: blocks are always generated in sequence from the first one.
+    """
+
+    def __init__(self, flow:'OrderFlow', seed:np.random.SeedSequence) -> None:
+        self.flow = flow
+        self.seed = seed
+        # next timestep of next()
+        self.t = 0
+        self._restart()
+
+
+    def _restart(self) -> None:
+        self.rng = np.random.default_rng(self.seed)
+        # last generated regime, and generated regime steps not yet used
+        self.regime = 0
+        self.pending = np.zeros(0, dtype=np.int64)
+        self.started = False
+        self.block_index = -1
+        self.net = np.zeros(0, dtype=np.int64)
+        self.regimes = np.zeros(0, dtype=np.int64)
+
+
+    def _block(self, index:int) -> None:
+        """Generate the block of the given index."""
+        if index < self.block_index:
+            self._restart()
+        while self.block_index < index:
+            self._generate()
+            self.block_index += 1
+
+
+    def _regimes(self, n:int) -> np.ndarray:
+        """Regime index of the next n steps."""
+        flow = self.flow
+        k = len(flow.buy_probability)
+        parts = [self.pending]
+        covered = len(self.pending)
+        while covered < n:
+            # enough geometric durations to cover the rest of the block
+            m = int((n - covered) / flow.regime_steps) + 8
+            durations = self.rng.geometric(1 / flow.regime_steps, m)
+            if k > 1:
+                # each switch moves to one of the other regimes, the run
+                # starts in the first regime
+                shifts = self.rng.integers(1, k, m)
+                if self.started is False:
+                    shifts[0] = 0
+                states = (self.regime + np.cumsum(shifts)) % k
+            else:
+                states = np.zeros(m, dtype=np.int64)
+            parts.append(np.repeat(states, durations))
+            covered += int(durations.sum())
+            self.regime = int(states[-1])
+            self.started = True
+        regimes = np.concatenate(parts)
+        # steps past the block continue in the next one
+        self.pending = regimes[n:]
+        return regimes[:n]
+
+
+    def _generate(self) -> None:
+        flow = self.flow
+        n = flow.block_steps
+        regimes = self._regimes(n)
+        counts = self.rng.poisson(flow.arrival_rate, n)
+        total = int(counts.sum())
+        sizes = np.ceil(self.rng.lognormal(flow.size_mu, flow.size_sigma, total)).astype(np.int64)
+        step = np.repeat(np.arange(n), counts)
+        buys = self.rng.random(total) < flow.buy_probability[regimes[step]]
+        signed = np.where(buys, sizes, -sizes)
+        self.net = np.bincount(step, weights=signed, minlength=n).astype(np.int64)
+        self.regimes = regimes
+
+
+    def order(self, timestep:int) -> Tuple[str, int, int]:
+        """(action, tokens, regime) at timestep.  action is '' when buys
+        and sells cancel out."""
+        index, i = divmod(timestep, self.flow.block_steps)
+        if index != self.block_index:
+            self._block(index)
+        net = int(self.net[i])
+        regime = int(self.regimes[i])
+        if net > 0:
+            return 'Buy', net, regime
+        elif net < 0:
+            return 'Sell', -net, regime
+        return '', 0, regime
+
+
+    def next(self) -> Tuple[str, int, int]:
+        """The order of the timestep after the last one from next()."""
+        order = self.order(self.t)
+        self.t += 1
+        return order
+
+
+class OrderFlow:
+    """Stochastic order flow parameters and the per-run streams.
+
+    Parameters
+    ----------
+    seed: int
+        Seed of all runs' streams.
+    arrival_rate: float
+        Mean orders per step.
+    size_mean: float
+        Mean order size in tokens before rounding up.
+    size_sigma: float
+        Standard deviation of the log of the order size.
+    regimes: dict
+        Buy probability of each demand regime, see default_regimes.
+    regime_steps: float
+        Mean steps spent in a regime.
+    block_steps: int
+        Steps generated per block.
+    """
+
+    def __init__(self, seed:int=0, arrival_rate:float=1.0, size_mean:float=2.0,
+                 size_sigma:float=0.75, regimes:Dict[str, float]=None,
+                 regime_steps:float=200, block_steps:int=block_steps) -> None:
+        if regimes is None:
+            regimes = default_regimes
+        self.seed = seed
+        self.arrival_rate = arrival_rate
+        self.size_mean = size_mean
+        self.size_sigma = size_sigma
+        # lognormal mu giving the requested mean
+        self.size_mu = np.log(size_mean) - size_sigma**2 / 2
+        self.regime_names = list(regimes.keys())
+        self.buy_probability = np.array(list(regimes.values()), dtype=np.float64)
+        self.regime_steps = regime_steps
+        self.block_steps = block_steps
+        self.streams = {}
+
+
+    def __repr__(self) -> str:
+        return (f'OrderFlow(seed={self.seed}, arrival_rate={self.arrival_rate}, '
+                f'size_mean={self.size_mean}, size_sigma={self.size_sigma}, '
+                f'regimes={dict(zip(self.regime_names, self.buy_probability.tolist()))}, '
+                f'regime_steps={self.regime_steps}, block_steps={self.block_steps})')
+
+
+    def stream(self, run:int=1) -> OrderStream:
+        """The stream of Monte Carlo run run, independent of the others."""
+        if run not in self.streams:
+            self.streams[run] = OrderStream(self, np.random.SeedSequence(self.seed, spawn_key=(run,)))
+        return self.streams[run]
+
+
+    def reset(self) -> None:
+        """Restart all runs from the seed."""
+        self.streams = {}
+
+
+    def block(self, run:int=1, start:int=0, steps:int=None) -> Tuple[np.ndarray, np.ndarray]:
+        """Net signed order (buys positive) and regime of timesteps
+        start..start + steps of a run, for vectorised consumers."""
+        stream = self.stream(run)
+        if steps is None:
+            steps = self.block_steps
+        net = np.empty(steps, dtype=np.int64)
+        regimes = np.empty(steps, dtype=np.int64)
+        i = 0
+        while i < steps:
+            index, j = divmod(start + i, self.block_steps)
+            stream._block(index)
+            take = min(steps - i, self.block_steps - j)
+            net[i:i + take] = stream.net[j:j + take]
+            regimes[i:i + take] = stream.regimes[j:j + take]
+            i += take
+        return net, regimes
@@ -0,0 +1,131 @@
+"""Price impact and slippage of trades of every size at every supply.
+
+For a trade of n tokens at supply s:
+
+    buy   pays buy_price[s:s+n], the price moves to buy_price[s+n]
+    sell  receives sell_price[s-n:s] for the tokens leaving circulation,
+          the price moves to sell_price[s-n]
+
+    impact     price after the trade / price before - 1
+    slippage   how much worse the average price is than the price
+               before the trade: average / price - 1 for buys,
+               1 - average / price for sells
+
+Buys follow Market.buy_tokens.  Sells follow the curve rather than
+Market.sell_tokens, which pays the prices above the circulation (see
+audit.py).
+
+Both sides of the whole (supply x trade size) surface come from prefix
+sums of the curve table in one vectorised pass.  Trade sizes are log
+spaced and values are float32; trades larger than the curve can fill are
+NaN.
+"""
+
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+
+import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+metrics = ['buy_impact', 'buy_slippage', 'sell_impact', 'sell_slippage']
+
+# Trade sizes of a surface
+size_points = 48
+
+
+def trade_sizes(max_size:int, points:int=size_points) -> np.ndarray:
+    """Log-spaced whole trade sizes from 1 to max_size."""
+    max_size = max(int(max_size), 1)
+    return np.unique(np.geomspace(1, max_size, points).round().astype(np.int64))
+
+
+class ImpactSurface:
+    """Price impact and slippage at each supply (rows) and trade size
+    (columns).
+
+    Parameters
+    ----------
+    supply: np.ndarray
+        Supply levels of the rows.
+    sizes: np.ndarray
+        Trade sizes of the columns.
+    values: dict
+        (len(supply), len(sizes)) float32 array of each of metrics.
+    """
+
+    def __init__(self, supply:np.ndarray, sizes:np.ndarray, values:Dict[str, np.ndarray]) -> None:
+        self.supply = supply
+        self.sizes = sizes
+        self.values = values
+
+
+    def __getitem__(self, metric:str) -> np.ndarray:
+        return self.values[metric]
+
+
+    def nbytes(self) -> int:
+        return sum(v.nbytes for v in self.values.values()) + self.supply.nbytes + self.sizes.nbytes
+
+
+    def to_frame(self) -> pd.DataFrame:
+        """One row per supply and trade size."""
+        df = pd.DataFrame({m: v.ravel() for m, v in self.values.items()})
+        df.insert(0, 'size', np.tile(self.sizes, len(self.supply)))
+        df.insert(0, 'supply', np.repeat(self.supply, len(self.sizes)))
+        return df
+
+
+def surface(table:pd.DataFrame, sizes:np.ndarray=None, rows:int=None) -> ImpactSurface:
+    """The impact surface of a curve table.
+
+    Parameters
+    ----------
+    table: pd.DataFrame
+        Curve table with buy_price and sell_price, one row per supply.
+    sizes: np.ndarray
+        Trade sizes, trade_sizes() of the table's supply by default.
+    rows: int
+        Supply levels evenly spaced over the table, every supply by default.
+    """
+    buy = table['buy_price'].to_numpy(dtype=np.float64)
+    sell = table['sell_price'].to_numpy(dtype=np.float64)
+    last = len(buy) - 1
+    if sizes is None:
+        sizes = trade_sizes(last)
+    sizes = np.asarray(sizes, dtype=np.int64)
+    if rows is None or rows > last:
+        supply = np.arange(last + 1)
+    else:
+        supply = np.unique(np.linspace(0, last, rows).round().astype(np.int64))
+    zero = np.zeros(1)
+    buy_sum = np.concatenate([zero, np.cumsum(buy)])
+    sell_sum = np.concatenate([zero, np.cumsum(sell)])
+
+    s = supply[:, None]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # buys of tokens s..s+n-1, NaN past the end of the table
+        end = s + sizes
+        filled = end <= last
+        end = np.minimum(end, last)
+        price = buy[s]
+        average = (buy_sum[end] - buy_sum[s]) / sizes
+        buy_impact = np.where(filled, buy[end] / price - 1, np.nan)
+        buy_slippage = np.where(filled, average / price - 1, np.nan)
+
+        # sells of tokens s-n..s-1
+        start = s - sizes
+        filled = start >= 0
+        start = np.maximum(start, 0)
+        price = sell[s]
+        average = (sell_sum[s] - sell_sum[start]) / sizes
+        sell_impact = np.where(filled, sell[start] / price - 1, np.nan)
+        sell_slippage = np.where(filled, 1 - average / price, np.nan)
+
+    # undefined where the price before the trade is zero
+    values = {m: np.where(np.isfinite(v), v, np.nan).astype(np.float32)
+              for m, v in zip(metrics, [buy_impact, buy_slippage, sell_impact, sell_slippage])}
+    return ImpactSurface(supply, sizes, values)
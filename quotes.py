@@ -0,0 +1,218 @@
+"""Trade quotes over the curve tables.
+
+Prices hypothetical trades without running a simulation:
+
+    buy     cost and fee of buying tokens at supply
+    sell    proceeds of selling tokens at supply
+    budget  tokens bought with amount at supply, and what they cost
+
+Quotes use the Market arithmetic (a buy of n tokens at supply s pays
+buy_price[s:s+n], trades stop at the end of the table) through prefix
+sums of the curve table, so a quote costs a few array lookups and a
+batch of quotes is priced with vectorised lookups.  Prefix sums are
+cached per curve.
+
+init_quotes() serves them on the Flask server:
+
+    POST /quote  {"curve": {...}, "quotes": [{"type": "buy", "supply": 100, "tokens": 10}, ...]}
+    GET  /quote?type=budget&supply=100&amount=500
+
+"curve" is optional curve parameters as in Sigmoid.curve_parameters,
+the market's current table is used without it.  Its values must be
+scalars and its supply a whole number of tokens up to max_supply, so
+clients cannot have arbitrarily large tables built.
+"""
+
+import numbers
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+import logging
+
+import metrics
+import market as market_
+from market import Market
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+types = ('buy', 'sell', 'budget')
+
+# Curves whose prefix sums are kept
+cache_size = 32
+
+# Largest supply of quoted curves, the dashboard's
+max_supply = int(market_.max_supply)
+
+quote_seconds = metrics.Histogram('quote_batch_seconds', 'Quote batch latency.')
+quote_count = metrics.Counter('quotes_total', 'Quotes priced.')
+
+
+class QuoteError(ValueError):
+    pass
+
+
+class QuoteEngine:
+    """Quotes over a Market's curve tables.
+
+    Parameters
+    ----------
+    market: Market
+        Its current table is used for quotes without curve parameters.
+        Other curves are built with its bonding curve and curve store.
+    """
+
+    def __init__(self, market:Market) -> None:
+        self.market = market
+        self.cache = OrderedDict()
+        # the server quotes from several threads
+        self.lock = threading.Lock()
+
+
+    def _prefix_sums(self, table:pd.DataFrame) -> Dict[str, np.ndarray]:
+        zero = np.zeros(1)
+        return {c: np.concatenate([zero, np.cumsum(table[c].to_numpy(dtype=np.float64))])
+                for c in ('buy_price', 'sell_price', 'tax_amount')}
+
+
+    def check_curve(self, curve_parameters) -> int:
+        """Raise QuoteError unless curve_parameters is a dict of scalars
+        with a whole supply from 1 to max_supply, which is returned."""
+        if not isinstance(curve_parameters, dict):
+            raise QuoteError('Curve parameters must be an object')
+        for k, v in curve_parameters.items():
+            if not (v is None or isinstance(v, (str, numbers.Number))):
+                raise QuoteError(f'Curve parameter {k} must be a number or a string')
+        supply = curve_parameters.get('supply')
+        if (isinstance(supply, bool) or not isinstance(supply, numbers.Real)
+                or not float(supply).is_integer()):
+            raise QuoteError('Curve supply must be a whole number of tokens')
+        if not 1 <= supply <= max_supply:
+            raise QuoteError(f'Curve supply must be between 1 and {max_supply}')
+        return int(supply)
+
+
+    def sums(self, curve_parameters:Dict=None) -> Dict[str, np.ndarray]:
+        """Prefix sums of the curve table with a leading zero:
+        the sum of column[s:e] is sums[column][e] - sums[column][s]."""
+        if curve_parameters is None:
+            table = self.market.token_dynamics
+            if table is None:
+                raise QuoteError('Bonding curve is not initialized')
+            key = ('market', id(table))
+        else:
+            supply = self.check_curve(curve_parameters)
+            curve_parameters = dict(curve_parameters, supply=supply)
+            key = tuple(sorted(curve_parameters.items()))
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key]
+
+        if curve_parameters is not None:
+            try:
+                supply = np.arange(0., supply + 1)
+                if self.market.curve_store is not None:
+                    table = self.market.curve_store.token_dynamics(self.market.bonding_curve, supply, curve_parameters)
+                else:
+                    table = self.market.bonding_curve.token_dynamics(supply, curve_parameters, text=False)
+            except (KeyError, TypeError) as e:
+                raise QuoteError(f'Invalid curve parameters: {e}')
+            if table is None:
+                raise QuoteError('Curve parameters have no scenario')
+        sums = self._prefix_sums(table)
+        with self.lock:
+            if curve_parameters is None:
+                # drop tables the market no longer uses
+                for k in [k for k in self.cache if k[0] == 'market']:
+                    del self.cache[k]
+            self.cache[key] = sums
+            while len(self.cache) > cache_size:
+                self.cache.popitem(last=False)
+        return sums
+
+
+    def quote(self, requests:List[Dict], curve_parameters:Dict=None) -> List[Dict]:
+        """Price a batch of quote requests.
+
+        Each request has a 'type' in types and a 'supply', plus 'tokens'
+        for buy and sell or 'amount' for budget.  Results repeat the
+        request with the 'tokens' filled, the 'amount' paid or received
+        and the 'fee' going to the fund.
+        """
+        sums = self.sums(curve_parameters)
+        last = len(sums['buy_price']) - 2
+        n = len(requests)
+        kind = np.empty(n, dtype=np.int8)
+        supply = np.empty(n, dtype=np.float64)
+        value = np.empty(n, dtype=np.float64)
+        for i, r in enumerate(requests):
+            if not isinstance(r, dict) or r.get('type') not in types:
+                raise QuoteError(f'Invalid quote {i} {r}: type must be one of {types}')
+            try:
+                kind[i] = types.index(r['type'])
+                supply[i] = r['supply']
+                value[i] = r['amount'] if kind[i] == 2 else r['tokens']
+            except (KeyError, TypeError, ValueError) as e:
+                raise QuoteError(f'Invalid quote {i} {r}: {e!r}')
+        # NaN fails every comparison, so checks are written to pass only valid values
+        if n and not (supply.min() >= 0 and supply.max() <= last):
+            raise QuoteError(f'Supply must be between 0 and {last}')
+        if n and not (value.min() >= 0 and np.isfinite(value).all()):
+            raise QuoteError('Tokens and amounts must be finite and not negative')
+        trade = kind != 2
+        if not (np.array_equal(supply, np.floor(supply)) and
+                np.array_equal(value[trade], np.floor(value[trade]))):
+            raise QuoteError('Supply and tokens must be whole numbers')
+
+        start = supply.astype(np.int64)
+        end = np.empty(n, dtype=np.int64)
+        # clipped before the cast, larger counts than the table overflow int64
+        end[trade] = start[trade] + np.minimum(value[trade], last - start[trade]).astype(np.int64)
+        budget = ~trade
+        if budget.any():
+            # most tokens whose cost fits the amount
+            buy = sums['buy_price']
+            target = buy[start[budget]] + value[budget]
+            end[budget] = np.maximum(np.searchsorted(buy, target, side='right') - 1, start[budget])
+            end[budget] = np.minimum(end[budget], last)
+        amount = np.where(kind == 1,
+                          sums['sell_price'][end] - sums['sell_price'][start],
+                          sums['buy_price'][end] - sums['buy_price'][start])
+        fee = sums['tax_amount'][end] - sums['tax_amount'][start]
+        tokens = end - start
+        quote_count.inc(n)
+        return [dict(r, tokens=int(t), amount=float(a), fee=float(f))
+                for r, t, a, f in zip(requests, tokens.tolist(), amount.tolist(), fee.tolist())]
+
+
+def init_quotes(server, engine:QuoteEngine, path:str='/quote') -> None:
+    """Serve quotes from engine on the Flask server."""
+    from flask import jsonify, request
+
+    @server.route(path, methods=['GET', 'POST'])
+    def _quote():
+        start = time.perf_counter()
+        try:
+            if request.method == 'POST':
+                body = request.get_json(force=True, silent=True)
+                if not isinstance(body, dict) or not isinstance(body.get('quotes'), list):
+                    raise QuoteError('Expected a JSON object with a quotes list')
+                requests, curve = body['quotes'], body.get('curve')
+            else:
+                r = request.args.to_dict()
+                for k, convert in (('supply', int), ('tokens', int), ('amount', float)):
+                    if k in r:
+                        r[k] = convert(r[k])
+                requests, curve = [r], None
+            quotes = engine.quote(requests, curve)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        elapsed = time.perf_counter() - start
+        quote_seconds.observe(elapsed)
+        return jsonify({'quotes': quotes, 'latency_ms': elapsed * 1e3})
@@ -0,0 +1,283 @@
+"""Sparse and aggregated recording of simulation history.
+
+cadCAD keeps every state variable at every timestep.  A Recorder instead
+keeps, for each state variable, only what its recording policy selects:
+
+    All()          every step
+    Every(k)       every k-th step and the final state
+    OnChange()     steps where the value differs from the last recorded one
+    Window(size)   min / max / mean / last of each window of size steps
+    Final()        the final state only
+
+Results are fed to the Recorder in chunks (see app1.run_simulation), so
+the full history never has to be held at once.  Final() uses constant
+memory whatever the length of the run.
+"""
+
+import copy
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# cadCAD result columns that are not state variables
+index_columns = ['simulation', 'subset', 'run', 'substep', 'timestep']
+
+
+class Policy:
+    """Selects the records kept for one state variable of one run."""
+
+    def __init__(self) -> None:
+        self.timesteps = []
+        self.values = []
+
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}()'
+
+
+    def update(self, timesteps:np.ndarray, values:List) -> None:
+        """Offer the next chunk of steps, in timestep order."""
+        raise NotImplementedError
+
+
+    def records(self) -> List[Tuple[int, object]]:
+        """(timestep, value) of the kept records, including pending ones."""
+        return list(zip(self.timesteps, self.values))
+
+
+class All(Policy):
+
+    def update(self, timesteps:np.ndarray, values:List) -> None:
+        self.timesteps.extend(timesteps.tolist())
+        self.values.extend(values)
+
+
+class Every(Policy):
+    """Every k-th step, plus the final step."""
+
+    def __init__(self, k:int) -> None:
+        super().__init__()
+        if k < 1:
+            raise ValueError(f'Every needs k >= 1, got {k}')
+        self.k = k
+        self.last = None
+
+
+    def __repr__(self) -> str:
+        return f'Every({self.k})'
+
+
+    def update(self, timesteps:np.ndarray, values:List) -> None:
+        for i in np.flatnonzero(timesteps % self.k == 0):
+            self.timesteps.append(int(timesteps[i]))
+            self.values.append(values[i])
+        if len(timesteps):
+            self.last = (int(timesteps[-1]), values[-1])
+
+
+    def records(self) -> List[Tuple[int, object]]:
+        records = super().records()
+        if self.last is not None and (not records or records[-1][0] != self.last[0]):
+            records.append(self.last)
+        return records
+
+
+class OnChange(Policy):
+    """The first step and every step whose value differs from the previous one."""
+
+    def update(self, timesteps:np.ndarray, values:List) -> None:
+        for t, v in zip(timesteps.tolist(), values):
+            if not self.values or v != self.values[-1]:
+                self.timesteps.append(t)
+                self.values.append(v)
+
+
+class Final(Policy):
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.last = None
+
+
+    def update(self, timesteps:np.ndarray, values:List) -> None:
+        if len(timesteps):
+            self.last = (int(timesteps[-1]), values[-1])
+
+
+    def records(self) -> List[Tuple[int, object]]:
+        return [] if self.last is None else [self.last]
+
+
+class Window(Policy):
+    """Aggregates of each window of size timesteps.
+
+    Window w covers timesteps [w * size, (w + 1) * size) and is recorded
+    at its last step.  Numeric fields of dict values (and scalar values,
+    as field 'value') get one entry f'{field}_{stat}' per stat; other
+    fields keep their last value.
+    """
+
+    aggregates = ('min', 'max', 'mean', 'last')
+
+    def __init__(self, size:int, stats:Tuple[str, ...]=aggregates) -> None:
+        super().__init__()
+        if size < 1:
+            raise ValueError(f'Window needs size >= 1, got {size}')
+        unknown = set(stats) - set(self.aggregates)
+        if unknown:
+            raise ValueError(f'Unknown window stats {sorted(unknown)}')
+        self.size = size
+        self.stats = tuple(stats)
+        # (window, last timestep, count, sums, mins, maxs, lasts) of the open window
+        self.open = None
+
+
+    def __repr__(self) -> str:
+        return f'Window({self.size}, {self.stats})'
+
+
+    def update(self, timesteps:np.ndarray, values:List) -> None:
+        if not len(timesteps):
+            return
+        scalar = not isinstance(values[0], dict)
+        df = pd.DataFrame({'value': values} if scalar else values)
+        numeric = [c for c in df.columns if pd.api.types.is_numeric_dtype(df[c])]
+        df['_window'] = timesteps // self.size
+        df['_timestep'] = timesteps
+        groups = df.groupby('_window', sort=True)
+        # timesteps are increasing, so the tails are in window order
+        tails = groups.tail(1).set_index('_window')
+        agg = {
+            'timestep': tails['_timestep'],
+            'count': groups.size(),
+            'sum': groups[numeric].sum(),
+            'min': groups[numeric].min(),
+            'max': groups[numeric].max(),
+            'last': tails[[c for c in df.columns if not c.startswith('_')]],
+        }
+        for i, w in enumerate(agg['count'].index):
+            window = (int(w), int(agg['timestep'].iloc[i]), int(agg['count'].iloc[i]),
+                      agg['sum'].iloc[i].to_dict(), agg['min'].iloc[i].to_dict(),
+                      agg['max'].iloc[i].to_dict(), agg['last'].iloc[i].to_dict())
+            if self.open is not None and self.open[0] == window[0]:
+                window = self._merge(self.open, window)
+            elif self.open is not None:
+                self._close(self.open)
+            self.open = window
+
+
+    @staticmethod
+    def _merge(a, b):
+        return (a[0], b[1], a[2] + b[2],
+                {k: a[3][k] + b[3][k] for k in a[3]},
+                {k: min(a[4][k], b[4][k]) for k in a[4]},
+                {k: max(a[5][k], b[5][k]) for k in a[5]},
+                b[6])
+
+
+    def _value(self, window) -> Dict:
+        _, _, count, sums, mins, maxs, lasts = window
+        stats = {'min': mins, 'max': maxs, 'mean': {k: v / count for k, v in sums.items()}}
+        value = {}
+        for field, last in lasts.items():
+            for stat in self.stats:
+                if stat == 'last':
+                    value[f'{field}_last'] = last
+                elif field in sums:
+                    value[f'{field}_{stat}'] = stats[stat][field]
+        return value
+
+
+    def _close(self, window) -> None:
+        self.timesteps.append(window[1])
+        self.values.append(self._value(window))
+
+
+    def records(self) -> List[Tuple[int, object]]:
+        records = super().records()
+        if self.open is not None:
+            records.append((self.open[1], self._value(self.open)))
+        return records
+
+
+class Recorder:
+    """History of the state variables under per-variable recording policies.
+
+    Parameters
+    ----------
+    policies: dict
+        Recording policy of each state variable, e.g.
+        {'market_state': Window(100), 'agent_txn': OnChange()}.
+    default: Policy
+        Policy of the variables not in policies, all steps if None.
+    """
+
+    def __init__(self, policies:Dict[str, Policy]=None, default:Policy=None) -> None:
+        self.policies = dict(policies or {})
+        self.default = All() if default is None else default
+        # run -> state variable -> policy instance
+        self.runs = {}
+
+
+    def __repr__(self) -> str:
+        return f'Recorder({self.policies}, default={self.default})'
+
+
+    def _policy(self, run:int, variable:str) -> Policy:
+        variables = self.runs.setdefault(run, {})
+        if variable not in variables:
+            variables[variable] = copy.deepcopy(self.policies.get(variable, self.default))
+        return variables[variable]
+
+
+    def record(self, timestep:int, state:Dict, run:int=1) -> None:
+        """Record the state variables of one step."""
+        timesteps = np.array([timestep])
+        for variable, value in state.items():
+            self._policy(run, variable).update(timesteps, [value])
+
+
+    def record_frame(self, df:pd.DataFrame) -> None:
+        """Record a chunk of results in the cadCAD layout.
+
+        Only the last substep of each timestep is recorded.
+        """
+        variables = [c for c in df.columns if c not in index_columns]
+        if 'substep' in df.columns:
+            df = df.drop_duplicates(['run', 'timestep'], keep='last')
+        for run, group in df.groupby('run', sort=False):
+            timesteps = group['timestep'].to_numpy()
+            for variable in variables:
+                self._policy(run, variable).update(timesteps, group[variable].to_list())
+
+
+    def frames(self) -> Dict[str, pd.DataFrame]:
+        """Records of each state variable, with run and timestep columns."""
+        frames = {}
+        variables = list(dict.fromkeys(v for policies in self.runs.values() for v in policies))
+        for variable in variables:
+            rows = [(run, t, v)
+                    for run, policies in self.runs.items() if variable in policies
+                    for t, v in policies[variable].records()]
+            frames[variable] = pd.DataFrame(rows, columns=['run', 'timestep', variable])
+        return frames
+
+
+    def frame(self) -> pd.DataFrame:
+        """All records, one row per recorded (run, timestep).
+
+        A variable is None at the timesteps its policy did not keep.
+        """
+        df = None
+        for f in self.frames().values():
+            df = f if df is None else df.merge(f, on=['run', 'timestep'], how='outer')
+        if df is None:
+            return pd.DataFrame(columns=['run', 'timestep'])
+        df = df.sort_values(['run', 'timestep'], ignore_index=True)
+        return df.astype(object).where(df.notna(), None)
@@ -0,0 +1,313 @@
+"""Replay of recorded trade logs through a Market.
+
+A trade log is a CSV or Parquet file with one trade per row: an action
+column ('buy' / 'sell' in any case, or a signed number with buys
+positive) and a tokens column.  Logs are read in chunks of chunk_rows
+rows, only the columns used are parsed, and trades are settled in
+batches with the Market arithmetic:
+
+    buy of n tokens at circulation c   pays buy_price[c:c+n], tax_amount
+                                       of it to the fund, the rest to
+                                       the collateral
+    sell of n tokens at circulation c  is paid sell_price[c:c+n] from the
+                                       collateral
+
+Amounts come from prefix sums of the curve table.  While no trade reaches
+an end of the table, the circulation before each trade of a batch is a
+cumulative sum; from a trade that does reach one, the rest of the batch
+is settled one trade at a time.  Buys stop at the end of the table like
+Market.buy_tokens.  Sells stop there too and are also limited to the
+circulation, which Market.sell_tokens does not do: a Market sell of more
+than the circulation takes it below zero, and the trades after it then
+index the curve table from its end.  The replay matches the Market while
+no sell exceeds the circulation; clipped tokens are counted in clipped.
+
+Results stream out per window of window_rows trades: trade counts,
+volumes, fees and the balances at the end of the window.  When the log
+has the actual balances (see actual_columns), they are reported with the
+difference from the modelled ones.
+"""
+
+from typing import Dict, Iterable, Iterator
+
+import numpy as np
+import pandas as pd
+
+import logging
+
+from market import Market
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Log column of each trade field
+log_columns = {
+    'action': 'action',
+    'tokens': 'tokens',
+}
+
+# Balances that can be compared with the log, and their default log columns
+actual_columns = {
+    'tokens_circulation': 'tokens_circulation',
+    'collateral_balance': 'collateral_balance',
+    'fund_balance': 'fund_balance',
+}
+
+# Rows read at a time
+chunk_rows = 1 << 20
+# Trades per result window
+window_rows = 100_000
+# Trades settled per vectorised batch at most
+batch_rows = 1 << 16
+# Largest token count of a trade, larger ones are capped so that the
+# circulation summed over a batch stays within int64
+max_tokens = 1 << 46
+
+balances = ['tokens_circulation', 'collateral_balance', 'fund_balance']
+
+
+def read_log(path:str, columns:Iterable[str], chunk_rows:int=chunk_rows,
+             categories:Iterable[str]=()) -> Iterator[pd.DataFrame]:
+    """Chunks of the given columns of a CSV or Parquet log, parsing the
+    categories columns of CSV logs as categoricals."""
+    columns = list(columns)
+    if path.endswith(('.parquet', '.pq')):
+        if pq is None:
+            raise ImportError('Reading Parquet logs needs pyarrow')
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_rows, columns=columns):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, usecols=columns, chunksize=chunk_rows,
+                               dtype={c: 'category' for c in categories})
+
+
+def signed_tokens(action:pd.Series, tokens:pd.Series) -> np.ndarray:
+    """Trades as signed token counts, buys positive, 0 for unknown actions
+    and for missing or non-finite actions and tokens."""
+    tokens = np.abs(tokens.to_numpy(dtype=np.float64, na_value=np.nan))
+    # NaN and inf would cast to INT64_MIN
+    tokens = np.where(np.isfinite(tokens), np.minimum(tokens, max_tokens), 0).astype(np.int64)
+    if pd.api.types.is_numeric_dtype(action.dtype):
+        signs = np.sign(action.to_numpy(dtype=np.float64, na_value=np.nan))
+        return np.where(np.isfinite(signs), signs, 0).astype(np.int64) * tokens
+    # few distinct actions, so parse each once
+    codes, names = pd.factorize(action)
+    signs = np.array([int(np.sign(name)) if isinstance(name, (int, float, np.number))
+                      else {'buy': 1, 'sell': -1}.get(str(name).strip().lower(), 0)
+                      for name in names] + [0], dtype=np.int64)
+    return signs[codes] * tokens
+
+
+class Replay:
+    """Settles trades on a Market in log order.
+
+    Parameters
+    ----------
+    market: Market
+        Market with its token dynamics initialised, replayed from its
+        current state.  It is left in the state after the last trade.
+    window_rows: int
+        Trades per result window.
+    columns: dict
+        Log column of each field of log_columns.
+    actual: dict
+        Log column of the balances to compare, of the fields of
+        actual_columns.  None for no comparison.
+    """
+
+    def __init__(self, market:Market, window_rows:int=window_rows, columns:Dict[str, str]=None,
+                 actual:Dict[str, str]=None) -> None:
+        if market.token_dynamics is None:
+            raise RuntimeError("Bonding curve is not initialized.  Cannot execute transaction.")
+        self.market = market
+        self.window_rows = window_rows
+        self.columns = dict(log_columns, **(columns or {}))
+        self.actual = actual or {}
+        table = market.token_units if market.scale else market.token_dynamics
+        dtype = np.int64 if market.scale else np.float64
+        zero = np.zeros(1, dtype=dtype)
+        self.buy_sum = np.concatenate([zero, np.cumsum(np.asarray(table['buy_price'], dtype=dtype))])
+        self.sell_sum = np.concatenate([zero, np.cumsum(np.asarray(table['sell_price'], dtype=dtype))])
+        self.tax_sum = np.concatenate([zero, np.cumsum(np.asarray(table['tax_amount'], dtype=dtype))])
+        self.last = len(market.token_dynamics) - 1
+        self.rows = 0
+        self.clipped = 0
+        self.skipped = 0
+        # aggregates of the window in progress
+        self.partial = None
+
+
+    def log_columns(self):
+        """Log columns read."""
+        return list(self.columns.values()) + list(self.actual.values())
+
+
+    def settle(self, signed:np.ndarray) -> Dict[str, np.ndarray]:
+        """Settle signed trades in order.
+
+        Returns the tokens filled (signed), amount and fee of each trade and
+        the balances after it.
+        """
+        n = len(signed)
+        m = self.market
+        filled = np.empty(n, dtype=np.int64)
+        start = np.empty(n, dtype=np.int64)
+        c = m.tokens_circulation
+        i = 0
+        block = min(batch_rows, 4096)
+        while i < n:
+            trade = signed[i:i + block]
+            # circulation before each trade if none is clipped
+            before = c + np.concatenate([[0], np.cumsum(trade[:-1])])
+            size = np.abs(trade)
+            bad = np.flatnonzero((before + size > self.last) | ((trade < 0) & (size > before)))
+            k = len(trade) if len(bad) == 0 else int(bad[0])
+            filled[i:i + k] = trade[:k]
+            start[i:i + k] = before[:k]
+            if k:
+                c = int(before[k - 1] + trade[k - 1])
+            i += k
+            if k == len(trade):
+                block = min(batch_rows, 2 * block)
+                continue
+            # trades reaching an end of the table come in runs, so the rest
+            # of the batch is settled one at a time
+            j = i + len(trade) - k
+            last = self.last
+            fills = []
+            for t in signed[i:j].tolist():
+                if t > 0:
+                    f = min(c + t, last) - c
+                else:
+                    f = -min(min(c - t, last) - c, c)
+                self.clipped += abs(t) - abs(f)
+                fills.append(f)
+                c += f
+            fills = np.array(fills, dtype=np.int64)
+            filled[i:j] = fills
+            start[i:j] = c - np.cumsum(fills[::-1])[::-1]
+            i = j
+            block = max(256, 2 * k)
+
+        size = np.abs(filled)
+        end = start + size
+        buys = filled > 0
+        amount = np.where(buys, self.buy_sum[end] - self.buy_sum[start],
+                          self.sell_sum[end] - self.sell_sum[start])
+        fee = np.where(buys, self.tax_sum[end] - self.tax_sum[start], 0)
+        collateral = np.cumsum(np.concatenate([[m.collateral_balance], np.where(buys, amount - fee, -amount)]))[1:]
+        fund = np.cumsum(np.concatenate([[m.fund_balance], fee]))[1:]
+        circulation = start + filled
+        if n:
+            m.tokens_circulation = int(circulation[-1])
+            m.collateral_balance = collateral[-1].item()
+            m.fund_balance = fund[-1].item()
+            if filled[-1] > 0:
+                m.tokens_bought = int(size[-1])
+            elif filled[-1] < 0:
+                m.tokens_sold = int(size[-1])
+        return {'filled': filled, 'amount': amount, 'fee': fee, 'tokens_circulation': circulation,
+                'collateral_balance': collateral, 'fund_balance': fund}
+
+
+    def _windows(self, chunk:pd.DataFrame, trades:Dict[str, np.ndarray]) -> pd.DataFrame:
+        """Aggregates of the windows of a chunk, the first and last possibly
+        partial."""
+        n = len(chunk)
+        window = (self.rows + np.arange(n)) // self.window_rows
+        first = np.flatnonzero(np.concatenate([[True], window[1:] != window[:-1]]))
+        last = np.append(first[1:], n) - 1
+        filled = trades['filled']
+        buys, sells = filled > 0, filled < 0
+        add = lambda a: np.add.reduceat(a, first) if n else a[:0]
+        df = pd.DataFrame({
+            'window': window[first],
+            'first_row': self.rows + first,
+            'last_row': self.rows + last,
+            'trades': last - first + 1,
+            'buys': add(buys.astype(np.int64)),
+            'sells': add(sells.astype(np.int64)),
+            'tokens_bought': add(np.where(buys, filled, 0)),
+            'tokens_sold': add(np.where(sells, -filled, 0)),
+            'buy_volume': add(np.where(buys, trades['amount'], 0)),
+            'sell_volume': add(np.where(sells, trades['amount'], 0)),
+            'fees': add(trades['fee']),
+        })
+        for b in balances:
+            df[b] = trades[b][last]
+        for b, column in self.actual.items():
+            df[f'actual_{b}'] = chunk[column].to_numpy()[last]
+            df[f'error_{b}'] = df[b] - df[f'actual_{b}']
+        return df
+
+
+    def replay(self, chunks:Iterable[pd.DataFrame]) -> Iterator[pd.DataFrame]:
+        """Settle the trades of log chunks and yield the completed windows
+        of each, the last window when the log ends."""
+        for chunk in chunks:
+            if not len(chunk):
+                continue
+            signed = signed_tokens(chunk[self.columns['action']], chunk[self.columns['tokens']])
+            self.skipped += int(np.count_nonzero(signed == 0))
+            df = self._windows(chunk, self.settle(signed))
+            self.rows += len(chunk)
+            if self.partial is not None:
+                if len(df) and df['window'].iat[0] == self.partial['window'].iat[0]:
+                    # the window in progress continues in this chunk
+                    totals = ['trades', 'buys', 'sells', 'tokens_bought', 'tokens_sold',
+                              'buy_volume', 'sell_volume', 'fees']
+                    df.loc[0, totals] += self.partial[totals].iloc[0]
+                    df.loc[0, 'first_row'] = self.partial['first_row'].iat[0]
+                else:
+                    df = pd.concat([self.partial, df], ignore_index=True)
+            # the last window continues in the next chunk unless it is full
+            full = (df['last_row'] + 1) % self.window_rows == 0
+            self.partial = None if full.iat[-1] else df.iloc[-1:].reset_index(drop=True)
+            done = df[full]
+            if len(done):
+                yield done.reset_index(drop=True)
+        if self.partial is not None:
+            yield self.partial
+            self.partial = None
+        logger.info(f'Replayed {self.rows} trades, {self.skipped} without action or tokens, '
+                    f'{self.clipped} tokens clipped')
+
+
+def replay_log(market:Market, path:str, window_rows:int=window_rows, columns:Dict[str, str]=None,
+               actual:Dict[str, str]=None, chunk_rows:int=chunk_rows) -> Iterator[pd.DataFrame]:
+    """Replay a CSV or Parquet log through market, yielding result windows."""
+    replay = Replay(market, window_rows, columns, actual)
+    return replay.replay(read_log(path, replay.log_columns(), chunk_rows, [replay.columns['action']]))
+
+
+if __name__ == '__main__':
+    import argparse
+    import sigmoid
+    import market as market_
+
+    parser = argparse.ArgumentParser(description='Replay a trade log through the Market.')
+    parser.add_argument('log', help='CSV or Parquet trade log')
+    parser.add_argument('--out', help='CSV file of the result windows, printed when missing')
+    parser.add_argument('--scenario', default='s0')
+    parser.add_argument('--supply', type=int, default=int(market_.initial_supply))
+    parser.add_argument('--window', type=int, default=window_rows)
+    parser.add_argument('--compare', action='store_true', help='compare with the balance columns of the log')
+    args = parser.parse_args()
+
+    # Dashboard defaults, see app1.py
+    sigmoid.max_slope = market_.max_supply * 1e3
+    m = Market(sigmoid.Sigmoid(market_.min_supply, args.supply, market_.max_price/2))
+    m.update_token_dynamics(args.supply, dict(m.bonding_curve.curve_parameters, supply=args.supply,
+                                              scenario=args.scenario))
+    header = True
+    for windows in replay_log(m, args.log, args.window, actual=actual_columns if args.compare else None):
+        if args.out:
+            windows.to_csv(args.out, mode='w' if header else 'a', header=header, index=False)
+        else:
+            print(windows.to_string(header=header, index=False))
+        header = False
@@ -0,0 +1,188 @@
+"""Curve parameter schedules applied during a simulation.
+
+A Schedule changes the curve parameters of a Market from given
+timesteps on, e.g. a decaying tax or a raised supply cap:
+
+    Schedule([(500, {'tax': 0.1}), (800, {'supply': 3000})])
+    Schedule.linear('tax', 0.2, 0.05, first=100, last=1000, every=100)
+
+Keys are those of Sigmoid.curve_parameters.  The trade of timestep t
+uses the curve of the changes at or before t.
+
+A change updates the market's table rather than rebuilding it:
+
+    supply        rows are added or dropped at the end, the others stay
+    other         only the columns of the curves whose terms change are
+                  recomputed (see sigmoid.changed_curves), with the tax
+                  and fund columns derived from them; a parameter the
+                  scenario does not use costs nothing
+
+The table is a copy of the market's own, made at the first change, so
+curve store tables are never written to.  Updated tables have the
+numeric columns only, without the hover texts.  In fixed point (see
+fixed_point.py) only the price columns of the changed curves and the
+added rows are converted to units; the other units are reused.
+"""
+
+from typing import Dict, Iterable, Tuple
+
+import numpy as np
+import pandas as pd
+
+import logging
+
+import fixed_point
+import sigmoid
+from market import Market
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+parameters = ['scenario', 'supply', 'buy_price', 'buy_supply', 'buy_slope',
+              'vertical_displacement', 'tax', 'sell_price', 'sell_supply',
+              'sell_slope', 'horizontal_displacement']
+
+
+class Schedule:
+    """Changes of curve parameters by timestep.
+
+    Parameters
+    ----------
+    changes: iterable
+        (timestep, {parameter: value}) pairs, in any order.
+    """
+
+    def __init__(self, changes:Iterable[Tuple[int, Dict]]) -> None:
+        self.changes = sorted(((int(t), dict(c)) for t, c in changes), key=lambda change: change[0])
+        for t, c in self.changes:
+            unknown = set(c) - set(parameters)
+            if unknown:
+                raise ValueError(f'Unknown curve parameters {sorted(unknown)} at timestep {t}')
+        self.market = None
+        # table and curve parameters of the last change, None before the first
+        self.frame = None
+        self.parameters = None
+        self.updates = 0
+
+
+    @classmethod
+    def linear(cls, parameter:str, start:float, end:float, first:int, last:int, every:int) -> 'Schedule':
+        """parameter moving from start at timestep first to end at last,
+        changed every every steps."""
+        steps = list(range(first, last, every)) + [last]
+        return cls((t, {parameter: start + (end - start) * (t - first) / max(last - first, 1)})
+                   for t in steps)
+
+
+    def __len__(self) -> int:
+        return len(self.changes)
+
+
+    def __repr__(self) -> str:
+        return f'Schedule({self.changes})'
+
+
+    def start(self, market:Market) -> None:
+        """Start applying the schedule to market from its current curve.
+
+        A market left on a curve of this schedule is restored first, so
+        a schedule can be started again for every run.
+        """
+        # the parameters are replaced by every change, with or without a
+        # new table, so they tell whether the market is still on it
+        if self.market is not None and self.parameters is not None and \
+                self.market.curve_parameters is self.parameters:
+            self.reset()
+        self.market = market
+        self.initial = (market.token_dynamics, market.token_units, market.supply, market.curve_parameters)
+        self.applied = 0
+        self.frame = None
+        self.parameters = None
+
+
+    def reset(self) -> None:
+        """Put the market back on the curve it had at start()."""
+        m = self.market
+        m.token_dynamics, m.token_units, m.supply, m.curve_parameters = self.initial
+        self.applied = 0
+        self.frame = None
+        self.parameters = None
+
+
+    def apply(self, timestep:int) -> bool:
+        """Apply the changes of timesteps up to timestep not applied yet.
+        Returns whether the table changed."""
+        updated = False
+        while self.applied < len(self.changes) and self.changes[self.applied][0] <= timestep:
+            updated = self._update(self.changes[self.applied][1]) or updated
+            self.applied += 1
+        return updated
+
+
+    def _update(self, change:Dict) -> bool:
+        m = self.market
+        old = m.curve_parameters
+        new = dict(old, **change)
+        supply = int(new['supply'])
+        if supply < m.tokens_circulation:
+            logger.warning(f'Supply {supply} below the circulation, kept at {m.tokens_circulation}')
+            supply = m.tokens_circulation
+            new['supply'] = supply
+        n = len(m.token_dynamics)
+        curves = sigmoid.changed_curves(old, new)
+        self.parameters = new
+        if not curves and supply + 1 == n:
+            m.curve_parameters = new
+            return False
+
+        if self.frame is None:
+            values = np.array(m.token_dynamics[sigmoid.curve_columns].to_numpy(dtype=np.float64).T, order='C')
+        else:
+            values = self.values
+        if curves:
+            rows = min(n, supply + 1)
+            sigmoid.evaluate_curves(values[0, :rows], new, out=values[:, :rows], curves=curves)
+        if supply + 1 != n:
+            resized = np.empty((len(sigmoid.curve_columns), supply + 1))
+            resized[:, :min(n, supply + 1)] = values[:, :supply + 1]
+            if supply + 1 > n:
+                sigmoid.evaluate_curves(np.arange(n, supply + 1, dtype=np.float64), new, out=resized[:, n:])
+            values = resized
+
+        self.values = values
+        # the transposed rows are the frame's single block, no copy
+        self.frame = pd.DataFrame(values.T, columns=sigmoid.curve_columns, copy=False)
+        m.token_dynamics = self.frame
+        m.supply = supply
+        m.curve_parameters = new
+        if m.scale:
+            m.token_units = self._units(values, curves, n, supply + 1)
+        self.updates += 1
+        logger.debug(f'Schedule updated {curves} columns, {supply + 1} rows')
+        return True
+
+
+    def _units(self, values:np.ndarray, curves:Tuple[str, ...], n:int, rows:int) -> Dict[str, np.ndarray]:
+        """The market's token_units for the updated table values, from its
+        n rows to rows, as fixed_point.table_units() makes them.  The
+        market's arrays are sliced or copied, never written to."""
+        m = self.market
+        old = m.token_units
+        kept = min(n, rows)
+        units = {}
+        for column, curve in (('buy_price', 'buy'), ('sell_price', 'sell')):
+            prices = values[sigmoid.curve_columns.index(column)]
+            if curve in curves:
+                units[column] = fixed_point.to_units(prices, m.scale)
+            elif rows <= n:
+                units[column] = old[column][:rows]
+            else:
+                units[column] = np.concatenate([old[column][:kept], fixed_point.to_units(prices[n:], m.scale)])
+        if curves:
+            units['tax_amount'] = units['buy_price'] - units['sell_price']
+        elif rows <= n:
+            units['tax_amount'] = old['tax_amount'][:rows]
+        else:
+            units['tax_amount'] = np.concatenate([old['tax_amount'][:kept],
+                                                  units['buy_price'][n:] - units['sell_price'][n:]])
+        return units
@@ -0,0 +1,202 @@
+"""Sensitivity of simulation outcomes to the curve parameters.
+
+Final fund balance, collateral balance and agent capital are
+differentiated with respect to the sigmoid parameters a, b, c, k, t and h
+using central differences.  All perturbed parameter sets of all scenarios
+are evaluated in one batch, optionally in a process pool, and every run
+uses the fast-forward simulation (see fast_forward.py) over cached curve
+tables.  The baseline run of each scenario is shared by the elasticities
+of all its parameters.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+import logging
+
+import sigmoid
+import market
+from market import Market
+from token_user import TokenUser
+from fast_forward import FastForward
+from curve_store import CurveStore
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Curve parameters moved by each sensitivity parameter.  The sell curve
+# shares a, b and c with the buy curve, as the dashboard sliders do.
+parameters = {
+    'a': ('buy_price', 'sell_price'),
+    'b': ('buy_supply', 'sell_supply'),
+    'c': ('buy_slope', 'sell_slope'),
+    'k': ('vertical_displacement',),
+    't': ('tax',),
+    'h': ('horizontal_displacement',),
+}
+
+# Parameters each scenario's curves depend on
+scenario_parameters = {
+    's0': ['a', 'b', 'c'],
+    's1': ['a', 'b', 'c', 'k'],
+    's2': ['a', 'b', 'c', 'k'],
+    's3': ['a', 'b', 'c', 't'],
+    's4': ['a', 'b', 'c', 'h'],
+    's5': ['a', 'b', 'c', 'k', 'h'],
+}
+
+outcomes = ['fund_balance', 'collateral_balance', 'capital']
+
+# Relative central difference step
+rel_step = 1e-3
+
+# Per-process market used to run the simulations
+_market = None
+
+
+def _key(curve_parameters:Dict) -> Tuple:
+    return tuple(sorted(curve_parameters.items()))
+
+
+@lru_cache(maxsize=128)
+def curve_table(key:Tuple, curve_store_path:str=None) -> pd.DataFrame:
+    """Curve table for a parameter set, without hover text columns.
+
+    With curve_store_path the table is shared through a CurveStore.
+    """
+    curve_parameters = dict(key)
+    s = np.arange(0., curve_parameters['supply'] + 1)
+    curve = _get_market().bonding_curve
+    if curve_store_path is not None:
+        return CurveStore(curve_store_path).token_dynamics(curve, s, curve_parameters)
+    return curve.token_dynamics(s, curve_parameters, text=False)
+
+
+def _get_market() -> Market:
+    global _market
+    if _market is None:
+        _market = Market(sigmoid.Sigmoid(market.min_supply,
+                                         market.initial_supply,
+                                         market.max_price/2))
+    return _market
+
+
+def evaluate(key:Tuple, steps:int, capital:float, tokens:float=0,
+             curve_store_path:str=None) -> List[float]:
+    """Final outcomes of a simulation with the given curve parameters."""
+    m = _get_market()
+    m.token_dynamics = curve_table(key, curve_store_path)
+    m.supply = dict(key)['supply']
+    m.reset()
+    user = TokenUser(tokens, capital)
+    ff = FastForward(m, user).run(steps)
+    t = ff.steps
+    return [ff.fund[t], ff.col[t], ff.cap[t]]
+
+
+def _evaluate(args):
+    return evaluate(*args)
+
+
+def perturb(curve_parameters:Dict, parameter:str, step:float) -> Dict:
+    """Copy of curve_parameters with a sensitivity parameter moved by step."""
+    perturbed = dict(curve_parameters)
+    for name in parameters[parameter]:
+        perturbed[name] = curve_parameters[name] + step
+    return perturbed
+
+
+def _step(curve_parameters:Dict, parameter:str) -> float:
+    x = curve_parameters[parameters[parameter][0]]
+    return rel_step * max(abs(x), 1.0)
+
+
+def scenario_sensitivities(curve_parameters:Dict, steps:int=None,
+                           capital:float=TokenUser.capital,
+                           scenarios:List[str]=None,
+                           workers:int=None,
+                           curve_store_path:str=None) -> Dict[str, Dict[str, pd.DataFrame]]:
+    """Jacobian and elasticity tables of the outcomes for each scenario.
+
+    Parameters
+    ----------
+    curve_parameters: dict
+        Baseline curve parameters, as in Sigmoid.curve_parameters.  The
+        scenario entry is replaced by each scenario in turn.
+    steps: int
+        Simulation length, defaults to the supply.
+    capital: float
+        Initial agent capital.
+    scenarios: list
+        Scenario keys, defaults to all of sigmoid.scenarios.
+    workers: int
+        Size of the process pool.  Runs in this process when None.
+    curve_store_path: str
+        Share curve tables between processes through a CurveStore.
+
+    Returns
+    -------
+    results: dict
+        For each scenario a dict with the 'baseline' outcomes (Series),
+        the 'jacobian' d outcome / d parameter and the 'elasticity'
+        (d outcome / outcome) / (d parameter / parameter), both DataFrames
+        indexed by outcome with one column per parameter.
+    """
+    if steps is None:
+        steps = int(curve_parameters['supply'])
+    if scenarios is None:
+        scenarios = list(sigmoid.scenarios.keys())
+
+    # Build the whole batch: baseline plus +/- step for each parameter
+    batch = []
+    for scenario in scenarios:
+        base = dict(curve_parameters, scenario=scenario)
+        batch.append(base)
+        for p in scenario_parameters[scenario]:
+            h = _step(base, p)
+            batch.append(perturb(base, p, h))
+            batch.append(perturb(base, p, -h))
+
+    args = [(_key(params), steps, capital, 0, curve_store_path) for params in batch]
+    if workers is None:
+        values = list(map(_evaluate, args))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            values = list(executor.map(_evaluate, args, chunksize=max(1, len(args) // (4 * workers))))
+    logger.info(f'scenario_sensitivities evaluated {len(values)} parameter sets')
+
+    results = {}
+    i = 0
+    for scenario in scenarios:
+        base = dict(curve_parameters, scenario=scenario)
+        y = np.array(values[i])
+        i += 1
+        jacobian = {}
+        elasticity = {}
+        for p in scenario_parameters[scenario]:
+            h = _step(base, p)
+            dy = (np.array(values[i]) - np.array(values[i + 1])) / (2 * h)
+            i += 2
+            x = base[parameters[p][0]]
+            jacobian[p] = dy
+            with np.errstate(divide='ignore', invalid='ignore'):
+                elasticity[p] = np.where(y != 0, dy * x / y, np.nan)
+        results[scenario] = {
+            'baseline': pd.Series(y, index=outcomes),
+            'jacobian': pd.DataFrame(jacobian, index=outcomes),
+            'elasticity': pd.DataFrame(elasticity, index=outcomes),
+        }
+    return results
+
+
+if __name__ == '__main__':
+    # Dashboard defaults, see app1.py
+    sigmoid.max_slope = market.max_supply * 1e3
+    curve = sigmoid.Sigmoid(market.min_supply, market.initial_supply, market.max_price/2)
+    for scenario, result in scenario_sensitivities(curve.curve_parameters).items():
+        print(f'\n{scenario}: {sigmoid.scenarios[scenario].description}')
+        print(result['elasticity'].round(4))
@@ -1,4 +1,6 @@
-from typing import Dict, List
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Tuple
 
 # import math
 import numpy as np
@@ -67,6 +69,12 @@ class SigmoidScenario(Scenario):
         raise NotImplementedError
     def sell_collateral(self, x, a, b, c, **kwargs):
         raise NotImplementedError
+    # (A, B, C, k) of the curve A * ((x - B) / sqrt(C + (x - B)**2) + 1) + k,
+    # see evaluate_curves
+    def buy_terms(self, a, b, c, **kwargs):
+        raise NotImplementedError
+    def sell_terms(self, a, b, c, **kwargs):
+        raise NotImplementedError
 
     
 # No tax/fee scenario
@@ -87,6 +95,11 @@ class SigmoidNoFeeScenario(Scenario):
     def sell_collateral(self, x, a, b, c, **kwargs):
         return np.zeros_like(x)    
         # return self.buy_collateral(x, a, b, c, **kwargs)    
+    sell_curve = False
+    def buy_terms(self, a, b, c, **kwargs):
+        return a, b, c, 0
+    def sell_terms(self, a, b, c, **kwargs):
+        return a, b, c, 0
 
 # Constant tax/fee scenario
 # Defined as s1 with method suffix _const
@@ -104,6 +117,10 @@ class SigmoidConstantFeeScenario(Scenario):
         return a * (np.sqrt(b**2 - 2 * b * x + c + x**2) + x) + (k - a*np.sqrt(b**2 + c)) + k*x
     def sell_collateral(self, x, a, b, c, **kwargs):
         return a * (np.sqrt(b**2 - 2 * b * x + c + x**2) + x) - (a*np.sqrt(b**2 + c))    
+    def buy_terms(self, a, b, c, **kwargs):
+        return a, b, c, kwargs['k']
+    def sell_terms(self, a, b, c, **kwargs):
+        return a, b, c, 0
 
 # Decreasing tax/fee scenario
 # Defined as s2 with method suffix _dec
@@ -121,6 +138,11 @@ class SigmoidDecreasingFeeScenario(Scenario):
         return (a - k/2)*(np.sqrt(b**2 - 2 * b * x + c + x**2) + x) + (k - (a - k/2)*np.sqrt(b**2 + c)) + k*x
     def sell_collateral(self, x, a, b, c, **kwargs):
         return a*(np.sqrt(b**2 - 2 * b * x + c + x**2) + x) - a*np.sqrt(b**2 + c)
+    def buy_terms(self, a, b, c, **kwargs):
+        k = kwargs['k']
+        return a - k/2, b, c, k
+    def sell_terms(self, a, b, c, **kwargs):
+        return a, b, c, 0
 
 # Increasing tax/fee scenario
 # Defined as s3 with method suffix _inc
@@ -138,6 +160,10 @@ class SigmoidIncreasingFeeScenario(Scenario):
         return (a/(1 - t)) * (np.sqrt((b - x)**2 + c) + x) - (a/(1 - t)) * np.sqrt(b**2 + c)
     def sell_collateral(self, x, a, b, c, **kwargs):
         return a * (np.sqrt(b**2 - 2*b*x + c + x**2) + x) - a*np.sqrt(b**2 + c)
+    def buy_terms(self, a, b, c, **kwargs):
+        return a/(1 - kwargs['t']), b, c, 0
+    def sell_terms(self, a, b, c, **kwargs):
+        return a, b, c, 0
 
 # Gaussian (Bell)-shaped tax/fee scenario
 # Defined as s4 with method suffix _bell
@@ -155,6 +181,10 @@ class SigmoidGaussianFeeScenario(Scenario):
     def sell_collateral(self, x, a, b, c, **kwargs):
         h = kwargs['h']
         return a * (np.sqrt((b + h - x)**2 + c) + x) - (a*np.sqrt((b + h)**2 + c))
+    def buy_terms(self, a, b, c, **kwargs):
+        return a, b, c, 0
+    def sell_terms(self, a, b, c, **kwargs):
+        return a, b + kwargs['h'], c, 0
 
 # No constraints tax/fee scenario
 # Defined as s5 with method suffix _no
@@ -171,6 +201,10 @@ class SigmoidNoConstraintsFeeScenario(Scenario):
     def sell_collateral(self, x, a, b, c, **kwargs):
         h = kwargs['h']
         return a * (np.sqrt((b + h - x)**2 + c) + x) - (a*np.sqrt((b + h)**2 + c))
+    def buy_terms(self, a, b, c, **kwargs):
+        return a, b, c, kwargs['k']
+    def sell_terms(self, a, b, c, **kwargs):
+        return a, b + kwargs['h'], c, 0
         
 # Define a dict of possible scenarios
 scenarios = {
@@ -182,6 +216,153 @@ scenarios = {
     's5': SigmoidNoConstraintsFeeScenario('No Constraints')
 }
 
+# Curve table columns computed by evaluate_curves, in order
+curve_columns = ['supply', 'buy_price', 'sell_price', 'buy_col', 'sell_col',
+                 'tax_rate', 'tax_amount', 'fund_rate', 'fund_amount']
+
+# Rows per chunk of Sigmoid.token_dynamics_chunks
+chunk_rows = 1 << 20
+
+# Columns with running totals in Sigmoid.token_dynamics_chunks, as
+# f'{column}_sum'.  buy_price_sum[n] is the cost of buying tokens 0..n.
+prefix_columns = ['buy_price', 'sell_price', 'tax_amount']
+
+# Elements per pass of evaluate_curves.  Its working set of about ten
+# chunk-sized float64 arrays (640 KB) stays in the L2 cache.
+chunk_size = 8192
+
+
+def _intermediates(x, B, C, u, r):
+    """u = x - B and r = sqrt(C + (x - B)**2), in place."""
+    np.subtract(x, B, out=u)
+    np.multiply(u, u, out=r)
+    r += C
+    np.sqrt(r, out=r)
+
+
+def _sigmoid_curve(x, A, B, C, k, u, r, price, col):
+    """Price and collateral of one sigmoid curve into price and col.
+
+    Collateral uses r from (x - B)**2 rather than the expanded
+    b**2 - 2*b*x + c + x**2, which cancels at large x.
+    """
+    np.divide(u, r, out=price)
+    price += 1
+    price *= A
+    np.add(r, x, out=col)
+    col -= np.sqrt(B**2 + C)
+    col *= A
+    if k:
+        price += k
+        col += k
+        col += k * x
+
+
+def curve_terms(curve_parameters:Dict) -> Tuple[Tuple, Tuple, bool]:
+    """(A, B, C, k) of the buy and sell curves of the parameters, and
+    whether the scenario has a sell curve."""
+    scenario = scenarios[curve_parameters['scenario']]
+    kwargs = {
+        'k': curve_parameters['vertical_displacement'],
+        'h': curve_parameters['horizontal_displacement'],
+        't': curve_parameters['tax']
+    }
+    buy = scenario.buy_terms(curve_parameters['buy_price'],
+                             curve_parameters['buy_supply'],
+                             curve_parameters['buy_slope'], **kwargs)
+    sell = scenario.sell_terms(curve_parameters['sell_price'],
+                               curve_parameters['sell_supply'],
+                               curve_parameters['sell_slope'], **kwargs)
+    return buy, sell, getattr(scenario, 'sell_curve', True)
+
+
+def changed_curves(old:Dict, new:Dict) -> Tuple[str, ...]:
+    """The curves, 'buy' and 'sell', whose columns differ between two sets
+    of curve parameters."""
+    old_buy, old_sell, old_sell_curve = curve_terms(old)
+    buy, sell, sell_curve = curve_terms(new)
+    curves = ()
+    if buy != old_buy:
+        curves += ('buy',)
+    if sell != old_sell or sell_curve != old_sell_curve:
+        curves += ('sell',)
+    return curves
+
+
+def evaluate_curves(supply, curve_parameters:Dict, out:np.ndarray=None,
+                    curves:Tuple[str, ...]=('buy', 'sell')) -> np.ndarray:
+    """All curve table columns in one chunked pass.
+
+    Buy and sell prices and collateral come from the scenario's buy_terms
+    and sell_terms, sharing x - B and the square root when both curves
+    have the same B and C.  Tax and fund columns are derived from them in
+    the same pass.
+
+    Parameters
+    ----------
+    supply: array
+        Token supply values.
+    curve_parameters: dict
+        As Sigmoid.curve_parameters.
+    out: np.ndarray
+        Optional (len(curve_columns), len(supply)) float64 buffer.
+    curves: tuple
+        Curves whose price and collateral are computed.  The columns of
+        the others are kept from out, e.g. when only some parameters
+        changed (see changed_curves).
+
+    Returns
+    -------
+    values: np.ndarray
+        One row per entry of curve_columns.
+    """
+    x = np.asarray(supply, dtype=np.float64)
+    n = len(x)
+    if out is None:
+        out = np.empty((len(curve_columns), n))
+    buy, sell, sell_curve = curve_terms(curve_parameters)
+    shared = buy[1:3] == sell[1:3] and 'buy' in curves
+
+    m = min(chunk_size, n)
+    u = np.empty(m)
+    r = np.empty(m)
+    u2 = np.empty(m)
+    r2 = np.empty(m)
+    supply_, buy_price, sell_price, buy_col, sell_col, tax_rate, tax_amount, fund_rate, fund_amount = out
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for i in range(0, n, chunk_size):
+            j = min(i + chunk_size, n)
+            xs = x[i:j]
+            cu, cr, cu2, cr2 = u[:j - i], r[:j - i], u2[:j - i], r2[:j - i]
+            supply_[i:j] = xs
+            bp, sp, bc, sc = buy_price[i:j], sell_price[i:j], buy_col[i:j], sell_col[i:j]
+            if 'buy' in curves:
+                _intermediates(xs, buy[1], buy[2], cu, cr)
+                _sigmoid_curve(xs, *buy, cu, cr, bp, bc)
+            if 'sell' in curves:
+                if shared:
+                    cu2, cr2 = cu, cr
+                else:
+                    _intermediates(xs, sell[1], sell[2], cu2, cr2)
+                _sigmoid_curve(xs, *sell, cu2, cr2, sp, sc)
+                if not sell_curve:
+                    sc[:] = 0
+
+            # Tax Rate relates the amount going to the funding pool and
+            # the actual buy price at a specific supply
+            tr, ta, fr, fa = tax_rate[i:j], tax_amount[i:j], fund_rate[i:j], fund_amount[i:j]
+            np.divide(sp, bp, out=tr)
+            np.subtract(1, tr, out=tr)
+            np.around(tr, 4, out=tr)
+            np.subtract(bp, sp, out=ta)
+            np.around(ta, 4, out=ta)
+            np.divide(sc, bc, out=fr)
+            np.subtract(1, fr, out=fr)
+            np.around(fr, 4, out=fr)
+            np.subtract(bc, sc, out=fa)
+            np.around(fa, 4, out=fa)
+    return out
+
 
 def get_buy_slider_range(scenario_value, a1_max, a1_min, a1_value):
     if scenario_value in scenarios.keys():
@@ -281,18 +462,13 @@ class Sigmoid(BondingCurve):
         }
 
 
-    def token_dynamics(self, supply:List, curve_parameters:Dict=None) -> pd.DataFrame:
+    def token_dynamics(self, supply:List, curve_parameters:Dict=None, text:bool=True) -> pd.DataFrame:
         if curve_parameters is None:
             curve_parameters = self.curve_parameters
         
         logger.info(f'curve_parameters {curve_parameters}')
 
         scenario_value = curve_parameters['scenario']
-        kwargs = {
-            'k': curve_parameters['vertical_displacement'] ,
-            'h': curve_parameters['horizontal_displacement'],
-            't': curve_parameters['tax']
-        }
 
         if scenario_value is None:
             return None
@@ -306,37 +482,13 @@ class Sigmoid(BondingCurve):
         # the total capital needed to mint or burn a specified amount of tokens.
         #
 
-        d = {'supply': supply,
-             'buy_price': scenario.buy_price(supply, 
-                                             curve_parameters['buy_price'], 
-                                             curve_parameters['buy_supply'], 
-                                             curve_parameters['buy_slope'], 
-                                             **kwargs),
-             'sell_price': scenario.sell_price(supply, 
-                                               curve_parameters['sell_price'], 
-                                               curve_parameters['sell_supply'], 
-                                               curve_parameters['sell_slope'], 
-                                               **kwargs),
-             'buy_col': scenario.buy_collateral(supply, 
-                                                curve_parameters['buy_price'], 
-                                                curve_parameters['buy_supply'], 
-                                                curve_parameters['buy_slope'], 
-                                                **kwargs),
-             'sell_col': scenario.sell_collateral(supply, 
-                                                  curve_parameters['sell_price'], 
-                                                  curve_parameters['sell_supply'], 
-                                                  curve_parameters['sell_slope'], 
-                                                  **kwargs)}
-
-        df = pd.DataFrame(data=d)
-
-        # compute tax and fund metrics
-        # Tax Rate relates the amount going to the funding pool and 
-        # the actual buy price at a specific supply
-        df['tax_rate'] = np.around(1 - df['sell_price']/df['buy_price'], decimals=4)
-        df['tax_amount'] = np.around(df['buy_price'] - df['sell_price'], decimals=4)
-        df['fund_rate'] = np.around(1 - df['sell_col']/df['buy_col'], decimals=4)
-        df['fund_amount'] = np.around(df['buy_col'] - df['sell_col'], decimals=4)
+        # Prices, collateral, tax and fund metrics in one pass
+        values = evaluate_curves(supply, curve_parameters)
+        # The transposed rows become the frame's single block without a copy
+        df = pd.DataFrame(values.T, columns=curve_columns, copy=False)
+
+        if not text:
+            return df
 
         # Formatted text for hover labels
         df['buy_col_text'] = df['buy_col'].apply(utils.format_number)
@@ -344,4 +496,75 @@ class Sigmoid(BondingCurve):
         df['fund_rate_text'] = np.around(df['fund_rate'], decimals=2).map('{:.2f}'.format)
         df['fund_amount_text'] = df['fund_amount'].apply(utils.format_number)
 
-        return df
\ No newline at end of file
+        return df
+
+
+    def token_dynamics_chunks(self, supply:int, curve_parameters:Dict=None,
+                              rows:int=None, workers:int=None) -> Iterator[pd.DataFrame]:
+        """The curve table for supply 0..supply in chunks of rows rows.
+
+        At most one chunk is held without workers and 2 * workers + 1
+        with them (the chunks in flight and the one being consumed), so
+        the table can be larger than memory.  Chunks have the numeric columns of
+        token_dynamics, indexed by row, plus running prefix sums of
+        prefix_columns carried across chunks.
+
+        Parameters
+        ----------
+        supply: int
+            Last supply of the table, as in Market.update_token_dynamics.
+        curve_parameters: dict
+            Defaults to self.curve_parameters.
+        rows: int
+            Rows per chunk, defaults to chunk_rows.
+        workers: int
+            Threads computing chunks ahead of the consumer.  numpy releases
+            the GIL, so chunks are computed in parallel.  None computes
+            each chunk when it is requested.
+        """
+        if curve_parameters is None:
+            curve_parameters = self.curve_parameters
+        if curve_parameters['scenario'] is None:
+            return
+        if rows is None:
+            rows = chunk_rows
+        n = int(supply) + 1
+        starts = range(0, n, rows)
+
+        def chunk(i):
+            j = min(i + rows, n)
+            values = evaluate_curves(np.arange(i, j, dtype=np.float64), curve_parameters)
+            return pd.DataFrame(values.T, columns=curve_columns, index=pd.RangeIndex(i, j), copy=False)
+
+        if workers is None:
+            chunks = map(chunk, starts)
+        else:
+            chunks = self._parallel_chunks(chunk, starts, workers)
+
+        totals = {c: 0.0 for c in prefix_columns}
+        for df in chunks:
+            for c in prefix_columns:
+                # Adding the carried total to the first element keeps the
+                # sums identical to a cumsum over the whole table
+                values = df[c].to_numpy(copy=True)
+                values[0] += totals[c]
+                np.cumsum(values, out=values)
+                totals[c] = values[-1]
+                df[f'{c}_sum'] = values
+            yield df
+
+
+    @staticmethod
+    def _parallel_chunks(chunk, starts, workers:int) -> Iterator[pd.DataFrame]:
+        """chunk(start) for each start, in order, computed by a thread pool.
+
+        At most 2 * workers chunks are in flight.
+        """
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            for i in starts:
+                pending.append(executor.submit(chunk, i))
+                if len(pending) >= 2 * workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
\ No newline at end of file
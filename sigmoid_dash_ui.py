@@ -1,23 +1,61 @@
 import dash
 from dash import html, dcc
-from dash.dependencies import Input, Output, State
+from dash.dependencies import Input, Output, State, ClientsideFunction
+from dash.exceptions import PreventUpdate
 
-import plotly.graph_objs as go
+import numpy as np
 
 import logging
 
 import utils
+import figures
+import optimiser
 #from sigmoid import Sigmoid
 import sigmoid as sigmoid
 import market
+import coalesce
+import curve_store
+import price_impact
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
 n_points = 100 # number of data points to be plotted for each graph
 
+# Curve updates are sent once the curve inputs have been still for
+# debounce_ms, checked every debounce_tick_ms (see assets/requests.js)
+debounce_ms = 150
+debounce_tick_ms = 50
+
+# Supply levels of the price impact heatmap
+impact_rows = 200
+
+# Inputs of update_graphs, in the order of its arguments
+curve_inputs = ['scenario-dropdown', 'supply-slider', 'a1-slider', 'b1-slider', 'c1-slider',
+                'k1-slider', 't1-slider', 'a2-slider', 'b2-slider', 'c2-slider', 'h2-slider']
+
+# Slider of each curve parameter the optimiser searches, whose range
+# bounds the search
+optimiser_sliders = {
+    'buy_price': 'a1-slider',
+    'buy_supply': 'b1-slider',
+    'buy_slope': 'c1-slider',
+    'vertical_displacement': 'k1-slider',
+    'tax': 't1-slider',
+    'sell_price': 'a2-slider',
+    'sell_supply': 'b2-slider',
+    'sell_slope': 'c2-slider',
+    'horizontal_displacement': 'h2-slider',
+}
+
 sigmoid_market = None
 
+# Cache of the curve figure payloads, e.g. the app's diskcache, shared by
+# its processes.  None to compute them for every curve update.
+figure_cache = None
+# Seconds a cached payload is kept after its last use
+figure_expire = 24 * 3600
+
 external_stylesheets = ['https://codepen.io/chriddyp/pen/bWLwgP.css']
 
 app = dash.Dash(
@@ -96,6 +134,7 @@ def init_app(sigmoid):
                     html.Div(id='supply-slider-output-container'),
                     dcc.Slider(
                         id='supply-slider',
+                        updatemode='drag',
                         min=market.min_supply,
                         max=market.max_supply,
                         step=market.supply_step,
@@ -121,6 +160,7 @@ def init_app(sigmoid):
                             html.Div(id='a1-slider-output-container'),
                             dcc.Slider(
                                 id='a1-slider',
+                                updatemode='drag',
                                 min=market.min_price,
                                 max=market.max_price,
                                 step=market.price_step,
@@ -128,6 +168,7 @@ def init_app(sigmoid):
                             html.Div(id='b1-slider-output-container'),
                             dcc.Slider(
                                 id='b1-slider',
+                                updatemode='drag',
                                 min=market.min_supply,
                                 max=market.max_supply/2,
                                 value=market.max_supply/4,
@@ -135,6 +176,7 @@ def init_app(sigmoid):
                             html.Div(id='c1-slider-output-container'),
                             dcc.Slider(
                                 id='c1-slider',
+                                updatemode='drag',
                                 min=sigmoid.min_slope,
                                 max=sigmoid.max_slope,
                                 step=sigmoid.slope_step,
@@ -145,6 +187,7 @@ def init_app(sigmoid):
                                     html.Div(id='k1-slider-output-container'),
                                     dcc.Slider(
                                         id='k1-slider',
+                                        updatemode='drag',
                                         min=sigmoid.k_min,
                                         max=sigmoid.k_max,
                                         step=sigmoid.k_step,
@@ -156,6 +199,7 @@ def init_app(sigmoid):
                                     html.Div(id='t1-slider-output-container'),
                                     dcc.Slider(
                                         id='t1-slider',
+                                        updatemode='drag',
                                         min=sigmoid.t_min,
                                         max=sigmoid.t_max,
                                         step=sigmoid.t_step,
@@ -170,6 +214,7 @@ def init_app(sigmoid):
                             html.Div(id='a2-slider-output-container'),
                             dcc.Slider(
                                 id='a2-slider',
+                                updatemode='drag',
                                 min=market.min_price,
                                 max=market.max_price,
                                 step=market.price_step,
@@ -177,6 +222,7 @@ def init_app(sigmoid):
                             html.Div(id='b2-slider-output-container'),
                             dcc.Slider(
                                 id='b2-slider',
+                                updatemode='drag',
                                 min=market.min_supply,
                                 max=market.max_supply/2,
                                 value=market.max_supply/4,
@@ -184,6 +230,7 @@ def init_app(sigmoid):
                             html.Div(id='c2-slider-output-container'),
                             dcc.Slider(
                                 id='c2-slider',
+                                updatemode='drag',
                                 min=sigmoid.min_slope,
                                 max=sigmoid.max_slope,
                                 step=sigmoid.slope_step,
@@ -194,13 +241,41 @@ def init_app(sigmoid):
                                     html.Div(id='h2-slider-output-container'),
                                     dcc.Slider(
                                         id='h2-slider',
+                                        updatemode='drag',
                                         min=market.min_supply,
                                         max=market.max_supply,
                                         step=market.supply_step,
                                         value=market.max_supply/10)],
                                 style={'display': 'none'})
                         ],
-                        style={'display': 'none'})
+                        style={'display': 'none'}),
+                    html.Hr(),
+                    html.H5('Design Targets'),
+                    html.Div('Fund Balance at Max Supply:'),
+                    dcc.Input(
+                        id='target-fund-input',
+                        type='number',
+                        min=0,
+                        value=market.max_supply * market.max_price / 10),
+                    html.Div(id='tax-band-slider-output-container'),
+                    dcc.RangeSlider(
+                        id='tax-band-slider',
+                        min=sigmoid.t_min,
+                        max=sigmoid.t_max,
+                        step=sigmoid.t_step,
+                        value=[sigmoid.t_min, sigmoid.t_max]),
+                    html.Div('Min Collateral Ratio:'),
+                    dcc.Input(
+                        id='min-ratio-input',
+                        type='number',
+                        min=0,
+                        max=1,
+                        step=0.01,
+                        value=0),
+                    html.Button(children='Optimise', id='optimise-button', n_clicks=0),
+                    html.Pre(id='optimise-output'),
+                    # curve parameters of the last search, applied to the sliders
+                    dcc.Store(id='optimise-result'),
                 ], className="three columns sidebar"),
                 html.Div(
                     id='graph-div',
@@ -250,6 +325,21 @@ def init_app(sigmoid):
                 )
             ], className="row flex-display"),
             html.Hr(),
+            html.Div([
+                html.H3('Price Impact'),
+                dcc.RadioItems(
+                    id='impact-metric',
+                    options=[
+                        {'label': 'Buy Slippage', 'value': 'buy_slippage'},
+                        {'label': 'Buy Price Impact', 'value': 'buy_impact'},
+                        {'label': 'Sell Slippage', 'value': 'sell_slippage'},
+                        {'label': 'Sell Price Impact', 'value': 'sell_impact'},
+                    ],
+                    value='buy_slippage',
+                    labelStyle={'display': 'inline-block', 'margin-right': '15px'}),
+                dcc.Graph(id='impact-graph'),
+            ]),
+            html.Hr(),
             html.Div([
                 html.Div([
                     html.H3('Simulation '),
@@ -354,6 +444,16 @@ def init_app(sigmoid):
                 ]),
             ]),
         ]),
+        # Static graph layouts are sent once; callbacks only send array data
+        dcc.Store(id='graph-specs', data={**figures.CURVE_GRAPHS, **figures.SIM_GRAPHS, **figures.IMPACT_GRAPHS}),
+        dcc.Store(id='curve-data'),
+        dcc.Store(id='sim-data'),
+        dcc.Store(id='impact-data'),
+        # Debounced curve updates, see update_graphs
+        dcc.Store(id='curve-pending'),
+        dcc.Store(id='curve-request'),
+        dcc.Store(id='curve-debounce-ms', data=debounce_ms),
+        dcc.Interval(id='curve-debounce', interval=debounce_tick_ms),
     ])
     return app
 
@@ -366,6 +466,73 @@ def update_supply_slider_output(supply_value):
     return f'Max Token Supply: {utils.format_number(supply_value)}'
 
     
+# display tax band slider value
+@app.callback(
+    Output('tax-band-slider-output-container', 'children'),
+    [Input('tax-band-slider', 'value')])
+def update_tax_band_output(tax_band):
+    return 'Tax Rate Band: {:.2f} - {:.2f}'.format(*tax_band)
+
+
+# search curve parameters for the design targets and set the sliders to
+# the best curve found
+@app.callback(
+    [Output('optimise-output', 'children'),
+     Output('optimise-result', 'data'),
+     Output('a1-slider', 'value'),
+     Output('c1-slider', 'value'),
+     Output('t1-slider', 'value')],
+    [Input('optimise-button', 'n_clicks')],
+    [State('scenario-dropdown', 'value'),
+     State('supply-slider', 'value'),
+     State('target-fund-input', 'value'),
+     State('tax-band-slider', 'value'),
+     State('min-ratio-input', 'value')] +
+    [State(slider, prop) for slider in optimiser_sliders.values() for prop in ('min', 'max')])
+def optimise_curve(n_clicks, scenario_value, supply_value, target_fund, tax_band, min_ratio, *ranges):
+    if not n_clicks or scenario_value is None or target_fund is None:
+        raise PreventUpdate
+    # the search stays within the slider ranges
+    limits = dict(zip(optimiser_sliders, zip(ranges[::2], ranges[1::2])))
+    # the h2 slider's max follows the b1 value, the optimiser applies the
+    # same limit to each candidate
+    limits['horizontal_displacement'] = (limits['horizontal_displacement'][0], supply_value)
+    search = optimiser.CurveOptimiser(scenario_value, supply_value, target_fund,
+                                      tax_band=tax_band,
+                                      min_collateral_ratio=min_ratio or None,
+                                      limits=limits)
+    result = search.search()
+    p = result['curve_parameters']
+    names = optimiser.scenario_parameters[scenario_value]
+    lines = ['Fund Balance: {}'.format(utils.format_number(result['fund'])),
+             'Tax Rate: {:.2f} - {:.2f}'.format(result['tax_min'], result['tax_max']),
+             'Collateral Ratio: {:.2f}'.format(result['collateral_ratio']),
+             '']
+    lines += ['{}: {:g}'.format(name, p[name]) for name in names]
+    if result['score'] > 1e-2:
+        lines.insert(0, 'Targets not met, closest curve:')
+    # the other sliders are set from optimise-result by their callbacks
+    return ['\n'.join(lines), p] + [p[name] if name in names else dash.no_update
+                                    for name in ['buy_price', 'buy_slope', 'tax']]
+
+
+def optimised_value(optimised, scenario_value, name, buy=None, buy_value=None):
+    """Value of parameter name of the optimised curve when it applies to
+    scenario_value, searched and, for a sell parameter, its buy parameter
+    is still on its slider.  None otherwise."""
+    if not optimised or optimised['scenario'] != scenario_value:
+        return None
+    if name not in optimiser.scenario_parameters[scenario_value] and name not in optimiser.linked:
+        return None
+    if buy is not None and optimised[buy] != buy_value:
+        return None
+    return optimised[name]
+
+
+def optimise_triggered():
+    return any(t['prop_id'] == 'optimise-result.data' for t in dash.callback_context.triggered)
+
+
 # update a2-slider ranges based on a1-value
 @app.callback(
     [Output('a2-slider', 'max'),
@@ -374,18 +541,25 @@ def update_supply_slider_output(supply_value):
     [Input('scenario-dropdown', 'value'),
      Input('a1-slider', 'max'),
      Input('a1-slider', 'min'),
-     Input('a1-slider', 'value')])
-def adjust_a_slider(scenario_value, a1_max, a1_min, a1_value):
-    return sigmoid.get_buy_slider_range(scenario_value, a1_max, a1_min, a1_value)
+     Input('a1-slider', 'value'),
+     Input('optimise-result', 'data')])
+def adjust_a_slider(scenario_value, a1_max, a1_min, a1_value, optimised):
+    a2 = sigmoid.get_buy_slider_range(scenario_value, a1_max, a1_min, a1_value)
+    value = optimised_value(optimised, scenario_value, 'sell_price', 'buy_price', a1_value)
+    return a2 if value is None else a2[:-1] + [value]
 
 
 # update b1-slider (inflection point) ranges based on selected supply
 @app.callback(
     [Output('b1-slider', 'max'),
      Output('b1-slider', 'value')],
-    [Input('supply-slider', 'value')])
-def adjust_b1_slider(supply_value):
-    return sigmoid.get_buy_inflection_point_range(supply_value)
+    [Input('supply-slider', 'value'),
+     Input('optimise-result', 'data')])
+def adjust_b1_slider(supply_value, optimised):
+    b1 = sigmoid.get_buy_inflection_point_range(supply_value)
+    if optimise_triggered() and optimised['supply'] == supply_value:
+        b1[-1] = optimised['buy_supply']
+    return b1
 
 
 # update sell inflection point ranges based on b1-value
@@ -397,9 +571,12 @@ def adjust_b1_slider(supply_value):
     [Input('scenario-dropdown', 'value'),
      Input('b1-slider', 'max'),
      Input('b1-slider', 'min'),
-     Input('b1-slider', 'value')])
-def adjust_b2_slider(scenario_value, b1_max, b1_min, b1_value):
-    return sigmoid.get_sell_inflection_point_range(scenario_value, b1_max, b1_min, b1_value)
+     Input('b1-slider', 'value'),
+     Input('optimise-result', 'data')])
+def adjust_b2_slider(scenario_value, b1_max, b1_min, b1_value, optimised):
+    b2 = sigmoid.get_sell_inflection_point_range(scenario_value, b1_max, b1_min, b1_value)
+    value = optimised_value(optimised, scenario_value, 'sell_supply', 'buy_supply', b1_value)
+    return b2 if value is None else b2[:-1] + [value]
 
 
 # update sell slope slider ranges based on buy slope value
@@ -411,18 +588,25 @@ def adjust_b2_slider(scenario_value, b1_max, b1_min, b1_value):
     [Input('scenario-dropdown', 'value'),
      Input('c1-slider', 'max'),
      Input('c1-slider', 'min'),
-     Input('c1-slider', 'value')])
-def adjust_c2_slider(scenario_value, c1_max, c1_min, c1_value):
-    return sigmoid.get_sell_slope_ranges(scenario_value, c1_max, c1_min, c1_value)
+     Input('c1-slider', 'value'),
+     Input('optimise-result', 'data')])
+def adjust_c2_slider(scenario_value, c1_max, c1_min, c1_value, optimised):
+    c2 = sigmoid.get_sell_slope_ranges(scenario_value, c1_max, c1_min, c1_value)
+    value = optimised_value(optimised, scenario_value, 'sell_slope', 'buy_slope', c1_value)
+    return c2 if value is None else c2[:-1] + [value]
 
 
 # update vertical displacement (buy - sell at t(0)) slider range
 @app.callback(
     [Output('k1-slider', 'value')],
     [Input('scenario-dropdown', 'value'),
-     Input('k1-slider', 'max')],
+     Input('k1-slider', 'max'),
+     Input('optimise-result', 'data')],
     [State('k1-slider', 'value')])
-def adjust_k1_slider(scenario_value, k1_max, k1_value):
+def adjust_k1_slider(scenario_value, k1_max, optimised, k1_value):
+    value = optimised_value(optimised, scenario_value, 'vertical_displacement')
+    if optimise_triggered() and value is not None:
+        return [value]
     return sigmoid.get_vertical_displacement_range(scenario_value, k1_max)
 
 
@@ -432,10 +616,13 @@ def adjust_k1_slider(scenario_value, k1_max, k1_value):
      Output('h2-slider', 'value')],
     [Input('scenario-dropdown', 'value'),
      Input('b1-slider', 'max'),
-     Input('b1-slider', 'value')],
+     Input('b1-slider', 'value'),
+     Input('optimise-result', 'data')],
     [State('h2-slider', 'value')])
-def adjust_h2_slider(scenario_value, b1_max, b1_value, h2_value):
-    return sigmoid.get_horizontal_displacement_range(scenario_value, b1_max, b1_value, h2_value)
+def adjust_h2_slider(scenario_value, b1_max, b1_value, optimised, h2_value):
+    h2_max, h2_value = sigmoid.get_horizontal_displacement_range(scenario_value, b1_max, b1_value, h2_value)
+    value = optimised_value(optimised, scenario_value, 'horizontal_displacement', 'buy_supply', b1_value)
+    return [h2_max, h2_value if value is None else min(value, h2_max)]
 
 # adjust available curve parameter sections & sliders
 @app.callback(
@@ -571,27 +758,109 @@ def update_slider_outputs(a1_value, b1_value, c1_value, k1_value, t1_value,
                           a2_value, b2_value, c2_value, h2_value)
 
 
+# render graph figures in the browser from the compact array payloads
+for graph_id in figures.CURVE_GRAPHS:
+    app.clientside_callback(
+        ClientsideFunction(namespace='figures', function_name='render'),
+        Output(graph_id, 'figure'),
+        [Input('curve-data', 'data')],
+        [State(graph_id, 'id'),
+         State('graph-specs', 'data')])
+
+for graph_id in figures.SIM_GRAPHS:
+    app.clientside_callback(
+        ClientsideFunction(namespace='figures', function_name='render'),
+        Output(graph_id, 'figure'),
+        [Input('sim-data', 'data')],
+        [State(graph_id, 'id'),
+         State('graph-specs', 'data')])
+
+app.clientside_callback(
+    ClientsideFunction(namespace='figures', function_name='render'),
+    Output('impact-graph', 'figure'),
+    [Input('impact-data', 'data')],
+    [State('impact-graph', 'id'),
+     State('graph-specs', 'data')])
+
+
+# price impact heatmap of the curve table, after each curve update
+@app.callback(
+    Output('impact-data', 'data'),
+    [Input('curve-data', 'data'),
+     Input('impact-metric', 'value')])
+def update_impact(curve_data, metric):
+    if curve_data is None or sigmoid_market is None:
+        raise PreventUpdate
+    return impact_data(curve_data, metric)
+
+
+def impact_data(curve_data, metric):
+    """figures.surface_data of metric over the price impact surface of
+    the curve of curve_data.  The payload of every metric is kept in
+    figure_cache next to the curve figures, so a cached curve does not
+    build its table for the heatmap either."""
+    key = curve_data.get('table_key') if figure_cache is not None else None
+    if key is not None:
+        key = f'curve-impact-{impact_rows}-{key}'
+        data = figure_cache.get(key)
+        if data is not None:
+            figure_cache.touch(key, expire=figure_expire)
+            return dict(data, columns={metric: data['columns'][metric]})
+    if sigmoid_market.token_dynamics is None:
+        raise PreventUpdate
+    surface = price_impact.surface(sigmoid_market.token_dynamics, rows=impact_rows)
+    data = figures.surface_data(surface.sizes, surface.supply, {m: surface[m] for m in price_impact.metrics})
+    if key is not None:
+        figure_cache.set(key, data, expire=figure_expire)
+    return dict(data, columns={metric: data['columns'][metric]})
+
+
+# hold every change of the curve inputs in the browser
+app.clientside_callback(
+    ClientsideFunction(namespace='requests', function_name='hold'),
+    Output('curve-pending', 'data'),
+    [Input(i, 'value') for i in curve_inputs])
+
+
+# send the held inputs once they have been still for debounce_ms
+app.clientside_callback(
+    ClientsideFunction(namespace='requests', function_name='flush'),
+    Output('curve-request', 'data'),
+    [Input('curve-debounce', 'n_intervals')],
+    [State('curve-pending', 'data'),
+     State('curve-request', 'data'),
+     State('curve-debounce-ms', 'data')])
+
+
+curve_requests = coalesce.Coalescer('curve-data')
+
+
 @app.callback(
     [Output('price-graph-container', 'style'),
-     Output('price-graph', 'figure'),
      Output('col-graph-container', 'style'),
-     Output('col-graph', 'figure'),
      Output('tax-graph-container', 'style'),
-     Output('tax-graph', 'figure'),
      Output('fund-graph-container', 'style'),
-     Output('fund-graph', 'figure')],
-    [Input('scenario-dropdown', 'value'),
-     Input('supply-slider', 'value'),
-     Input('a1-slider', 'value'),
-     Input('b1-slider', 'value'),
-     Input('c1-slider', 'value'),
-     Input('k1-slider', 'value'),
-     Input('t1-slider', 'value'),
-     Input('a2-slider', 'value'),
-     Input('b2-slider', 'value'),
-     Input('c2-slider', 'value'),
-     Input('h2-slider', 'value')])
-def update_graphs(scenario_value, supply_value, a1_value, b1_value, c1_value, 
+     Output('curve-data', 'data')],
+    [Input('curve-request', 'data')])
+def update_graphs(request):
+    """Recompute the curves for the latest curve inputs of the client.
+
+    request holds the values of curve_inputs.  Requests superseded by a
+    newer one of the same client are dropped rather than recomputed.
+    """
+    if not request:
+        raise PreventUpdate
+    (scenario_value, supply_value, a1_value, b1_value, c1_value,
+     k1_value, t1_value, a2_value, b2_value, c2_value, h2_value) = request['values']
+    try:
+        with curve_requests.latest(request.get('client'), request.get('seq', 0)):
+            return curve_graphs(scenario_value, supply_value, a1_value, b1_value, c1_value,
+                                k1_value, t1_value, a2_value, b2_value, c2_value, h2_value)
+    except coalesce.Stale:
+        raise PreventUpdate
+
+
+def curve_graphs(scenario_value, supply_value, a1_value, b1_value, c1_value,
     k1_value, t1_value, a2_value, b2_value, c2_value, h2_value):
     
     curve_parameters = {
@@ -611,188 +880,67 @@ def update_graphs(scenario_value, supply_value, a1_value, b1_value, c1_value,
     if scenario_value is None or sigmoid_market is None:
         return [
             {'display': 'none'},
-            {},
             {'display': 'none'},
-            {},
             {'display': 'none'},
-            {},
             {'display': 'none'},
-            {}
+            None
+        ]
+    elif scenario_value == 's0':
+        # Buy curve only, no tax or fund graphs
+        return [
+            {'display': 'block'},
+            {'display': 'block'},
+            {'display': 'none'},
+            {'display': 'none'},
+            curve_figure_data(supply_value, curve_parameters, ['buy_price', 'buy_col'])
         ]
     else:
-        # df = sigmoid.get_scenario_data(scenario_value, supply_value, a1_value, b1_value, c1_value, 
-        #     k1_value, t1_value, a2_value, b2_value, c2_value, h2_value, n_points)
-        df = sigmoid_market.update_token_dynamics(supply_value, curve_parameters)
-        if scenario_value == 's0':
-            return [
-                {'display': 'block'},
-                {'data': [
-                    go.Scatter(
-                        x=df['supply'],
-                        y=df['buy_price'],
-                        mode='lines')],
-                'layout': go.Layout(
-                    title='Price Graph',
-                    xaxis={'title': 'Supply'},
-                    yaxis={
-                        'title': 'Price',
-                        'rangemode': 'nonnegative',
-                        'hoverformat': '.2f'
-                    })
-                },
-                {'display': 'block'},
-                {'data': [
-                    go.Scatter(
-                        x=df['supply'],
-                        y=df['buy_col'],
-                        text=df['buy_col_text'],
-                        mode='lines',
-                        hoverinfo='text')
-                ],
-                'layout': go.Layout(
-                    title='Collateral Graph',
-                    xaxis={'title': 'Supply'},
-                    yaxis={
-                        'title': 'Collateral',
-                        'rangemode': 'nonnegative'})
-                },
-                {'display': 'none'},
-                {},
-                {'display': 'none'},
-                {}
-                ]
-        else:
-            price_trace1 = go.Scatter(
-                x=df['supply'],
-                y=df['buy_price'],
-                mode='lines',
-                name='Buy')
-
-            price_trace2 = go.Scatter(
-                x=df['supply'],
-                y=df['sell_price'],
-                mode='lines',
-                name='Sell')
-
-            col_trace1 = go.Scatter(
-                x=df['supply'],
-                y=df['buy_col'],
-                mode='lines',
-                name='Buy',
-                text=df['buy_col_text'],
-                hoverinfo='text')
-
-            col_trace2 = go.Scatter(
-                x=df['supply'],
-                y=df['sell_col'],
-                mode='lines',
-                name='Sell',
-                text=df['sell_col_text'],
-                hoverinfo='text')
-
-            tax_rate_trace = go.Scatter(
-                x=df['supply'],
-                y=df['tax_rate'],
-                mode='lines',
-                line = {'color': '#2ca02c'},
-                name='Tax Rate')
-
-            tax_amount_trace = go.Scatter(
-                x=df['supply'],
-                y=df['tax_amount'],
-                yaxis='y2',
-                mode='lines',
-                line = {'color': '#d62728'},
-                name='Tax Amount')
-
-            fund_rate_trace = go.Scatter(
-                x=df['supply'],
-                y=df['fund_rate'],
-                mode='lines',
-                line = {'color': '#2ca02c'},
-                name='Fund Rate',
-                text=df['fund_rate_text'],
-                hoverinfo='text')
-
-            fund_amount_trace = go.Scatter(
-                x=df['supply'],
-                y=df['fund_amount'],
-                yaxis='y2',
-                mode='lines',
-                line = {'color': '#d62728'},
-                name='Fund Amount',
-                text=df['fund_amount_text'],
-                hoverinfo='text')
-
-            return [
-                {'display': 'block'},
-                {'data': [price_trace1, price_trace2],
-                'layout': go.Layout(
-                    title='Price Graph',
-                    xaxis={'title': 'Supply'},
-                    yaxis={
-                        'title': 'Price',
-                        'rangemode': 'nonnegative',
-                        'hoverformat': '.2f'},
-                    legend={'xanchor': 'left', 'yanchor': 'top'})
-                    # legend={'orientation': 'h'})
-                },
-                {'display': 'block'},
-                {'data': [col_trace1, col_trace2],
-                'layout': go.Layout(
-                    title='Collateral Graph',
-                    xaxis={'title': 'Supply'},
-                    yaxis={
-                        'title': 'Collateral',
-                        'rangemode': 'nonnegative'},
-                    legend={'xanchor': 'left', 'yanchor': 'top'})
-                    # legend={'orientation': 'h'})
-                },
-                {'display': 'block'},
-                {'data': [tax_rate_trace, tax_amount_trace],
-                'layout': go.Layout(
-                    title='Tax Graph',
-                    xaxis={'title': 'Supply'},
-                    yaxis={
-                        'title': 'Rate',
-                        'range': [0.0, 1.0],
-                        'rangemode': 'nonnegative',
-                        'hoverformat': '.2f',
-                        'titlefont': {'color': '#2ca02c'},
-                        'tickfont': {'color': '#2ca02c'}},
-                    yaxis2={
-                        'title': 'Amount',
-                        'rangemode': 'nonnegative',
-                        'hoverformat': '.2f',
-                        'overlaying': 'y',
-                        'side': 'right',
-                        'showline': True,
-                        'titlefont': {'color': '#d62728'},
-                        'tickfont': {'color': '#d62728'}},
-                    # legend={'xanchor': 'left', 'yanchor': 'top'}
-                    legend={'x': 0.25, 'yanchor': 'top'}
-                    )},
-                {'display': 'block'},
-                {'data': [fund_rate_trace, fund_amount_trace],
-                'layout': go.Layout(
-                    title='Fund Graph',
-                    xaxis={'title': 'Supply'},
-                    yaxis={
-                        'title': 'Rate',
-                        'range': [0.0, 1.0],
-                        'rangemode': 'nonnegative',
-                        'titlefont': {'color': '#2ca02c'},
-                        'tickfont': {'color': '#2ca02c'}},
-                    yaxis2={
-                        'title': 'Amount',
-                        'rangemode': 'nonnegative',
-                        'overlaying': 'y',
-                        'side': 'right',
-                        'showline': True,
-                        'titlefont': {'color': '#d62728'},
-                        'tickfont': {'color': '#d62728'}
-                        },
-                    # legend={'xanchor': 'left', 'yanchor': 'top'}
-                    legend={'x': 0.25, 'yanchor': 'top'}
-                    )}
-            ]
\ No newline at end of file
+        return [
+            {'display': 'block'},
+            {'display': 'block'},
+            {'display': 'block'},
+            {'display': 'block'},
+            curve_figure_data(supply_value, curve_parameters,
+                              ['buy_price', 'sell_price',
+                               'buy_col', 'sell_col',
+                               'tax_rate', 'tax_amount',
+                               'fund_rate', 'fund_amount'])
+        ]
+
+
+def curve_figure_data(supply_value, curve_parameters, columns):
+    """figures.figure_data of the market's curve table, through
+    figure_cache when set.  On a cache hit the table is not built until
+    the market uses it (see Market.defer_token_dynamics).  The payload
+    carries the table_key of the curve, the key of its impact_data."""
+    key = None
+    if figure_cache is not None:
+        table_key = curve_store.table_key(np.arange(0., supply_value + 1), curve_parameters)
+        key = 'curve-figures-' + table_key
+        data = figure_cache.get(key)
+        if data is not None:
+            figure_cache.touch(key, expire=figure_expire)
+            sigmoid_market.defer_token_dynamics(supply_value, curve_parameters)
+            return data
+    df = sigmoid_market.update_token_dynamics(supply_value, curve_parameters)
+    data = figures.figure_data(df, 'supply', columns)
+    if key is not None:
+        data['table_key'] = table_key
+        figure_cache.set(key, data, expire=figure_expire)
+    return data
+
+
+def default_curve_inputs(scenario_value, supply_value):
+    """Values of curve_inputs when the page is loaded and scenario_value
+    and supply_value are selected, as the slider callbacks set them."""
+    a1_value = market.max_price/2
+    c1_value = sigmoid.max_slope/10
+    t1_value = sigmoid.t_max/5
+    b1_max, b1_value = sigmoid.get_buy_inflection_point_range(supply_value)
+    _, _, a2_value = sigmoid.get_buy_slider_range(scenario_value, market.max_price, market.min_price, a1_value)
+    _, _, b2_value = sigmoid.get_sell_inflection_point_range(scenario_value, b1_max, market.min_supply, b1_value)
+    _, _, c2_value = sigmoid.get_sell_slope_ranges(scenario_value, sigmoid.max_slope, sigmoid.min_slope, c1_value)
+    k1_value, = sigmoid.get_vertical_displacement_range(scenario_value, sigmoid.k_max)
+    _, h2_value = sigmoid.get_horizontal_displacement_range(scenario_value, b1_max, b1_value, market.max_supply/10)
+    return [scenario_value, supply_value, a1_value, b1_value, c1_value,
+            k1_value, t1_value, a2_value, b2_value, c2_value, h2_value]
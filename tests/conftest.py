@@ -0,0 +1,50 @@
+"""Shared set up of the tests.
+
+The modules of the app are flat modules at the root of the repository,
+and importing app1 must not start the cache warm-up.
+"""
+
+import os
+import sys
+
+import pytest
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if root not in sys.path:
+    sys.path.insert(0, root)
+os.environ['WARM_UP'] = '0'
+
+import market as market_
+import sigmoid
+from market import Market
+
+# Dashboard defaults, see app1.py
+sigmoid.max_slope = market_.max_supply * 1e3
+
+
+def _make_market(scenario:str='s0', supply:int=1000, scale:int=None, curve_store=None, **parameters) -> Market:
+    m = Market(sigmoid.Sigmoid(market_.min_supply, supply, market_.max_price / 2), scale=scale,
+               curve_store=curve_store)
+    m.update_token_dynamics(supply, dict(m.bonding_curve.curve_parameters, supply=supply,
+                                         scenario=scenario, **parameters))
+    return m
+
+
+@pytest.fixture
+def make_market():
+    """make_market(scenario, supply, scale, curve_store, **parameters): a
+    Market on the default curve of scenario, with parameters changed."""
+    return _make_market
+
+
+@pytest.fixture
+def app():
+    """app1 with its simulation settings and agent put back after the test."""
+    import app1
+    saved = (app1.simulation_parameters['T'], app1.simulation_parameters['N'], app1.token_user.policy,
+             app1.token_user.initial_capital, app1.token_user.order_flow, app1.fast_forward,
+             app1.curve_schedule, app1.agent_order_flow)
+    yield app1
+    (app1.simulation_parameters['T'], app1.simulation_parameters['N'], app1.token_user.policy,
+     app1.token_user.initial_capital, app1.token_user.order_flow, app1.fast_forward,
+     app1.curve_schedule, app1.agent_order_flow) = saved
@@ -0,0 +1,48 @@
+"""Interrupted and resumed runs against the same runs left to finish."""
+
+import os
+
+import pandas as pd
+import pytest
+
+import checkpoint
+
+state_columns = ['market_state', 'agent_state', 'agent_txn']
+
+
+class Interrupted(Exception):
+    pass
+
+
+def test_resumed_run_matches_uninterrupted_run(app, monkeypatch, tmp_path):
+    app.simulation_parameters['T'] = range(350)
+    app.simulation_parameters['N'] = 1
+    app.token_user.policy = 'Buy'
+    app.token_user.initial_capital = 3000.0
+    app.curve_schedule = None
+    monkeypatch.setattr(app, 'checkpoint_every', 100)
+    monkeypatch.setattr(app, 'checkpoint_path', str(tmp_path))
+    whole = app.run_simulation(fast_forward=False)
+    report = app.run_statistics.report()
+    assert os.listdir(tmp_path) == []
+
+    save = checkpoint.Checkpointer.save
+
+    def save_then_stop(self, step, *args, **kwargs):
+        save(self, step, *args, **kwargs)
+        if step == 200:
+            raise Interrupted()
+
+    monkeypatch.setattr(checkpoint.Checkpointer, 'save', save_then_stop)
+    with pytest.raises(Interrupted):
+        app.run_simulation(fast_forward=False)
+    monkeypatch.setattr(checkpoint.Checkpointer, 'save', save)
+    resumed = app.run_simulation(fast_forward=False)
+
+    assert resumed['timestep'].tolist() == whole['timestep'].tolist()
+    for column in state_columns:
+        pd.testing.assert_frame_equal(pd.DataFrame(resumed[column].tolist()),
+                                      pd.DataFrame(whole[column].tolist()))
+    assert app.token_user.capital == pytest.approx(whole['agent_state'].iloc[-1]['capital'])
+    assert app.run_statistics.report() == report
+    assert os.listdir(tmp_path) == []
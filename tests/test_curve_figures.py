@@ -0,0 +1,29 @@
+"""Curve figure and impact payloads of the dashboard, through the figure
+cache."""
+
+import diskcache
+import pytest
+
+
+@pytest.fixture
+def ui(app, tmp_path, monkeypatch):
+    import sigmoid_dash_ui
+    monkeypatch.setattr(sigmoid_dash_ui, 'figure_cache', diskcache.Cache(str(tmp_path)))
+    return sigmoid_dash_ui
+
+
+def test_cached_curve_is_not_built_for_figures_or_impact(ui, app):
+    inputs = ui.default_curve_inputs('s3', 1000)
+    first = ui.curve_graphs(*inputs)[-1]
+    impact = ui.impact_data(first, 'buy_slippage')
+
+    m = app.sigmoid_market
+    m.update_token_dynamics(500, dict(m.curve_parameters, supply=500))
+    again = ui.curve_graphs(*inputs)[-1]
+    assert again == first
+    assert m.pending_curve is not None
+    assert ui.impact_data(again, 'buy_slippage') == impact
+    assert list(ui.impact_data(again, 'sell_impact')['columns']) == ['sell_impact']
+    # still deferred, built on first use
+    assert m.pending_curve is not None
+    assert len(m.token_dynamics) == 1001 and m.pending_curve is None
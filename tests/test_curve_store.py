@@ -0,0 +1,86 @@
+"""Memory-mapped curve tables shared through a directory."""
+
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import curve_store
+import sigmoid
+
+
+@pytest.fixture
+def curve(make_market):
+    m = make_market('s3', 2000)
+    return m.bonding_curve, np.arange(0., 2001), dict(m.curve_parameters)
+
+
+def test_stored_table_is_the_computed_one(tmp_path, curve):
+    bonding_curve, supply, p = curve
+    store = curve_store.CurveStore(str(tmp_path))
+    first = store.token_dynamics(bonding_curve, supply, p)
+    # another process, mapping the same file
+    again = curve_store.CurveStore(str(tmp_path)).token_dynamics(bonding_curve, supply, p)
+    expected = bonding_curve.token_dynamics(supply, p, text=False)
+    pd.testing.assert_frame_equal(first, expected)
+    pd.testing.assert_frame_equal(again, expected)
+    assert (store.hits, store.misses) == (0, 1)
+    assert list(first.columns) == sigmoid.curve_columns
+    assert not first['buy_price'].to_numpy().flags.writeable
+
+
+def test_chunked_tables_match(tmp_path, curve, monkeypatch):
+    bonding_curve, supply, p = curve
+    monkeypatch.setattr(curve_store, 'chunk_threshold', 100)
+    monkeypatch.setattr(sigmoid, 'chunk_rows', 300)
+    chunked = curve_store.CurveStore(str(tmp_path)).token_dynamics(bonding_curve, supply, p)
+    pd.testing.assert_frame_equal(chunked, bonding_curve.token_dynamics(supply, p, text=False))
+
+
+def test_least_recently_used_tables_are_evicted(tmp_path, curve):
+    bonding_curve, supply, p = curve
+    store = curve_store.CurveStore(str(tmp_path), max_bytes=None)
+    keys = []
+    for i, tax in enumerate([0.1, 0.2, 0.3]):
+        q = dict(p, tax=tax)
+        store.token_dynamics(bonding_curve, supply, q)
+        keys.append(store.key(supply, q))
+        os.utime(store._file(keys[-1]), (1000 + i, 1000 + i))
+    size = os.path.getsize(store._file(keys[0]))
+    # a read makes the oldest table the most recently used
+    store.get(keys[0])
+    store.max_bytes = 2 * size
+    assert store.evict() == 1
+    assert sorted(store.keys()) == sorted([keys[0], keys[2]])
+
+
+def test_put_returns_the_table_evicted_at_once(tmp_path, curve, monkeypatch):
+    bonding_curve, supply, p = curve
+    store = curve_store.CurveStore(str(tmp_path), max_bytes=1)
+    # a table over max_bytes is kept by its writer
+    store.token_dynamics(bonding_curve, supply, p)
+    assert store.keys() == [store.key(supply, p)]
+    # another process evicts the next table as soon as it is in the store
+    replace = os.replace
+
+    def replace_and_evict(src, dst):
+        replace(src, dst)
+        os.unlink(dst)
+    monkeypatch.setattr(os, 'replace', replace_and_evict)
+    q = dict(p, tax=0.3)
+    df = store.token_dynamics(bonding_curve, supply, q)
+    assert df is not None
+    pd.testing.assert_frame_equal(df, bonding_curve.token_dynamics(supply, q, text=False))
+
+
+def test_read_only_store_is_read(tmp_path, curve, monkeypatch):
+    bonding_curve, supply, p = curve
+    store = curve_store.CurveStore(str(tmp_path))
+    store.token_dynamics(bonding_curve, supply, p)
+
+    def read_only(*args, **kwargs):
+        raise PermissionError('Read-only file system')
+    monkeypatch.setattr(os, 'utime', read_only)
+    df = store.get(store.key(supply, p))
+    assert df is not None and len(df) == len(supply)
@@ -0,0 +1,69 @@
+"""evaluate_curves against the price and collateral formulas of each
+scenario, as the curve table was built before it (see sigmoid.py)."""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import market as market_
+import sigmoid
+
+
+def formula_table(supply:np.ndarray, p) -> pd.DataFrame:
+    scenario = sigmoid.scenarios[p['scenario']]
+    kwargs = {'k': p['vertical_displacement'], 'h': p['horizontal_displacement'], 't': p['tax']}
+    buy = (p['buy_price'], p['buy_supply'], p['buy_slope'])
+    sell = (p['sell_price'], p['sell_supply'], p['sell_slope'])
+    df = pd.DataFrame({'supply': supply,
+                       'buy_price': scenario.buy_price(supply, *buy, **kwargs),
+                       'sell_price': scenario.sell_price(supply, *sell, **kwargs),
+                       'buy_col': scenario.buy_collateral(supply, *buy, **kwargs),
+                       'sell_col': scenario.sell_collateral(supply, *sell, **kwargs)})
+    df['tax_rate'] = np.around(1 - df['sell_price'] / df['buy_price'], decimals=4)
+    df['tax_amount'] = np.around(df['buy_price'] - df['sell_price'], decimals=4)
+    df['fund_rate'] = np.around(1 - df['sell_col'] / df['buy_col'], decimals=4)
+    df['fund_amount'] = np.around(df['buy_col'] - df['sell_col'], decimals=4)
+    return df
+
+
+def parameters(scenario:str, rng:np.random.Generator, supply:int):
+    return {'scenario': scenario,
+            'supply': supply,
+            'buy_price': rng.uniform(1, market_.max_price),
+            'buy_supply': rng.uniform(0, supply),
+            'buy_slope': rng.uniform(1, sigmoid.max_slope),
+            'vertical_displacement': rng.uniform(sigmoid.k_min, sigmoid.k_max),
+            'tax': rng.uniform(sigmoid.t_min, sigmoid.t_max - sigmoid.t_step),
+            'sell_price': rng.uniform(1, market_.max_price),
+            'sell_supply': rng.uniform(0, supply),
+            'sell_slope': rng.uniform(1, sigmoid.max_slope),
+            'horizontal_displacement': rng.uniform(0, supply / 2)}
+
+
+@pytest.mark.parametrize('scenario', sorted(sigmoid.scenarios))
+@pytest.mark.parametrize('seed', range(3))
+def test_evaluate_curves_matches_scenario_formulas(scenario, seed):
+    supply = 3 * sigmoid.chunk_size + 17
+    x = np.arange(0., supply + 1)
+    p = parameters(scenario, np.random.default_rng(seed), supply)
+    expected = formula_table(x, p)
+    values = pd.DataFrame(sigmoid.evaluate_curves(x, p).T, columns=sigmoid.curve_columns)
+
+    for column in ['supply', 'buy_price', 'sell_price', 'buy_col', 'sell_col']:
+        np.testing.assert_allclose(values[column], expected[column], rtol=1e-9, atol=1e-9, err_msg=column)
+    # rounded to 4 decimals, a last digit may differ when the unrounded
+    # values differ in their last bits
+    for column in ['tax_rate', 'tax_amount', 'fund_rate', 'fund_amount']:
+        np.testing.assert_allclose(values[column], expected[column], rtol=1e-9, atol=1.01e-4, err_msg=column)
+
+
+@pytest.mark.parametrize('scenario', sorted(sigmoid.scenarios))
+def test_partial_evaluation_keeps_other_curve(scenario):
+    supply = 2000
+    x = np.arange(0., supply + 1)
+    rng = np.random.default_rng(7)
+    old = parameters(scenario, rng, supply)
+    new = dict(old, tax=old['tax'] / 2, buy_price=old['buy_price'] * 1.1, sell_slope=old['sell_slope'] / 3)
+    out = sigmoid.evaluate_curves(x, old)
+    sigmoid.evaluate_curves(x, new, out=out, curves=sigmoid.changed_curves(old, new))
+    np.testing.assert_allclose(out, sigmoid.evaluate_curves(x, new), rtol=1e-12, atol=1e-12, equal_nan=True)
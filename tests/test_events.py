@@ -0,0 +1,94 @@
+"""Discrete-event runs against the cadCAD simulation of the same trades."""
+
+import itertools
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import events
+import order_flow
+from schedule import Schedule
+from token_user import TokenUser
+
+
+def test_engine_matches_cadcad(app):
+    app.simulation_parameters['T'] = range(300)
+    app.simulation_parameters['N'] = 1
+    app.token_user.policy = 'Buy'
+    app.token_user.initial_capital = 100000.0
+    app.curve_schedule = Schedule([(100, {'buy_price': 80.0}), (200, {'supply': 1200})])
+    result = app.run_simulation(fast_forward=False)
+    result = result[result['timestep'] > 0].reset_index(drop=True)
+
+    # an action at each timestep of the run, on the same curve changes
+    user = TokenUser(0, 100000.0)
+    engine = events.Engine(app.sigmoid_market, [events.Trader(user, itertools.count(1.0))],
+                           schedule=Schedule(app.curve_schedule.changes))
+    app.sigmoid_market.reset()
+    trades = engine.run(until=300).trades_frame()
+
+    assert trades['time'].tolist() == result['timestep'].tolist()
+    txns = pd.DataFrame(result['agent_txn'].tolist())
+    for column in ['action', 'tokens', 'amount', 'fee']:
+        assert trades[column].tolist() == txns[column].tolist()
+    market = pd.DataFrame(result['market_state'].tolist())
+    for column in ['tokens_circulation', 'collateral_balance', 'fund_balance']:
+        assert trades[column].tolist() == market[column].tolist()
+    agent = pd.DataFrame(result['agent_state'].tolist())
+    assert trades['capital'].tolist() == agent['capital'].tolist()
+    assert trades['agent_tokens'].tolist() == agent['tokens'].tolist()
+
+
+def test_event_order(make_market):
+    market = make_market('s0')
+    initial = market.curve_parameters['buy_price']
+    user = TokenUser(0, 100000.0)
+    engine = events.Engine(market, [events.Trader(user, [5.0, 5.0, 7.5, 20.0])],
+                           schedule=Schedule([(5, {'buy_price': 80.0})]), observe_every=5.0)
+    engine.run(until=15.0)
+    trades = engine.trades_frame()
+    observations = engine.observations_frame()
+    # the action at 20 is after until, and is not drawn again
+    assert trades['time'].tolist() == [5.0, 5.0, 7.5]
+    assert observations['time'].tolist() == [0.0, 5.0, 10.0, 15.0]
+    # the change at 5 fires first and the observation at 5 last
+    assert trades['amount'].iloc[0] == pytest.approx(
+        market.bonding_curve.token_dynamics(np.arange(0., 1001), dict(market.curve_parameters, buy_price=80.0),
+                                            text=False)['buy_price'].iloc[0])
+    assert observations['tokens_circulation'].tolist() == [0, 2, 3, 3]
+    # change, observation, two actions, observation
+    assert observations['events'].tolist() == [1, 5, 7, 8]
+    # the run put the curve back
+    assert market.curve_parameters['buy_price'] == initial
+
+
+def test_arrivals():
+    times = np.fromiter(itertools.islice(events.poisson_arrivals(0.5, seed=1, start=10.0), 20000), float)
+    assert times[0] > 10.0 and (np.diff(times) >= 0).all()
+    assert np.mean(np.diff(times)) == pytest.approx(2.0, rel=0.05)
+
+    times = np.fromiter(itertools.islice(events.bursty_arrivals(0.01, burst=10, spacing=0.5, seed=2), 20000),
+                        float)
+    gaps = np.diff(times)
+    assert (gaps >= 0).all()
+    # most gaps are within bursts, the rest are the waits between them
+    assert np.median(gaps) < 1.0 and (gaps > 20).mean() == pytest.approx(0.1, abs=0.02)
+    assert list(events.poisson_arrivals(0.0)) == []
+
+
+def test_flow_traders_share_the_market(make_market):
+    market = make_market('s1')
+    users = [TokenUser(0, 5000.0, order_flow=order_flow.OrderFlow(seed=i, arrival_rate=3, size_mean=10))
+             for i in range(3)]
+    traders = [events.Trader(user, events.poisson_arrivals(1.0, seed=i)) for i, user in enumerate(users)]
+    trades = events.Engine(market, traders).run(until=2000).trades_frame()
+
+    assert set(trades['action']) >= {'Buy', 'Sell'}
+    # every token in circulation is held by a trader, none is overdrawn
+    held = trades.groupby('agent')['agent_tokens'].last().sum()
+    assert market.tokens_circulation == held
+    assert (trades['capital'] >= 0).all() and (trades['agent_tokens'] >= 0).all()
+    buys = trades[trades['action'] == 'Buy']
+    capital_before = trades.groupby('agent')['capital'].shift().fillna(5000.0)[buys.index]
+    assert (buys['amount'] + buys['fee'] <= capital_before + 1e-9).all()
@@ -0,0 +1,47 @@
+"""Fast-forwarded runs against the same runs stepped through cadCAD."""
+
+import pandas as pd
+import pytest
+
+import fast_forward
+
+state_columns = ['market_state', 'agent_state', 'agent_txn']
+
+
+def records(result:pd.DataFrame, column:str) -> pd.DataFrame:
+    return pd.DataFrame(result[column].tolist())
+
+
+@pytest.mark.parametrize('capital', [100000.0, 3000.0, 500.0])
+def test_fast_forward_matches_cadcad(app, capital):
+    app.simulation_parameters['T'] = range(600)
+    app.simulation_parameters['N'] = 1
+    app.token_user.policy = 'Buy'
+    app.token_user.initial_capital = capital
+    app.curve_schedule = None
+    forwarded = app.run_simulation(fast_forward=True)
+    stepped = app.run_simulation(fast_forward=False)
+
+    assert len(forwarded) == len(stepped)
+    assert forwarded['timestep'].tolist() == stepped['timestep'].tolist()
+    for column in state_columns:
+        pd.testing.assert_frame_equal(records(forwarded, column), records(stepped, column))
+    assert forwarded['token_price'].tolist() == stepped['token_price'].tolist()
+
+
+def test_chunked_fast_forward_matches_whole_run(app):
+    app.token_user.initial_capital = 3000.0
+    app.sigmoid_market.reset()
+
+    def run(chunk_steps):
+        app.token_user.reset()
+        ff = fast_forward.FastForward(app.sigmoid_market, app.token_user)
+        chunks = []
+        ff.run(1500, chunk_steps=chunk_steps,
+               on_chunk=lambda start, stop: chunks.append(ff.to_frame(start=start, stop=stop)))
+        return pd.concat(chunks, ignore_index=True) if chunks else ff.to_frame()
+
+    whole = run(None)
+    chunked = run(200)
+    for column in state_columns:
+        pd.testing.assert_frame_equal(records(chunked, column), records(whole, column))
@@ -0,0 +1,124 @@
+"""The kernel, and Market and TokenUser on top of it, against the
+arithmetic of Market and TokenUser before the kernel (see kernel.py)."""
+
+import numpy as np
+import pytest
+
+import kernel
+from token_user import TokenUser
+
+
+class Reference:
+    """Market and agent accounting as Market.buy_tokens, sell_tokens and
+    TokenUser.transaction_update computed them before the kernel."""
+
+    def __init__(self, market, capital:float) -> None:
+        self.table = market.token_dynamics
+        self.units = market.token_units
+        self.scale = market.scale
+        self.supply = market.supply
+        self.circulation = 0
+        self.collateral = 0 if self.scale else 0.0
+        self.fund = 0 if self.scale else 0.0
+        self.capital = capital
+        self.tokens = 0
+
+
+    def _sums(self, price:str, start:int, end:int):
+        if self.scale:
+            return (int(self.units[price][start:end].sum()),
+                    int(self.units['tax_amount'][start:end].sum()))
+        p = self.table[[price, 'tax_amount']][start:end].agg({price: 'sum', 'tax_amount': 'sum'})
+        return p[price], p['tax_amount']
+
+
+    def buy(self, num_tokens:int):
+        start = self.circulation
+        end = min(start + num_tokens, len(self.table) - 1)
+        num_tokens = end - start
+        amount, fee = self._sums('buy_price', start, end)
+        self.collateral += amount - fee
+        self.fund += fee
+        self.circulation = min(self.circulation + num_tokens, self.supply)
+        self._settle('Buy', num_tokens, amount, fee)
+        return num_tokens, amount, fee
+
+
+    def sell(self, num_tokens:int):
+        start = self.circulation
+        end = min(start + num_tokens, len(self.table) - 1)
+        num_tokens = end - start
+        amount, fee = self._sums('sell_price', start, end)
+        self.collateral -= amount
+        self.circulation -= num_tokens
+        self._settle('Sell', num_tokens, amount, fee)
+        return num_tokens, amount, fee
+
+
+    def _settle(self, action:str, tokens:int, amount, fee) -> None:
+        if action == 'Buy':
+            self.capital += -amount - fee
+            self.tokens += tokens
+        else:
+            self.capital += amount - fee
+            self.tokens -= tokens
+        self.capital = max(0, self.capital)
+
+
+def random_walk(steps:int, seed:int, supply:int):
+    """Signed trades whose sells never exceed the circulation; buys may
+    run into the end of the table."""
+    rng = np.random.default_rng(seed)
+    c = 0
+    trades = []
+    for _ in range(steps):
+        n = int(rng.integers(1, 40))
+        if rng.random() < 0.45 and c > 0:
+            n = -min(n, c)
+        trades.append(n)
+        c = min(c + n, supply)
+    return trades
+
+
+@pytest.mark.parametrize('scenario', ['s0', 's1', 's3', 's5'])
+@pytest.mark.parametrize('scale', [None, 10**6])
+def test_market_and_kernel_match_reference(make_market, scenario, scale):
+    supply = 500
+    m = make_market(scenario, supply, scale=scale)
+    user = TokenUser(0, 10000.0, scale=scale)
+    ref = Reference(m, user.capital)
+    curve = kernel.curve(m.token_dynamics, m.supply, m.token_units if scale else None)
+    state = kernel.MarketState(collateral_balance=m.collateral_balance, fund_balance=m.fund_balance)
+    agents = (kernel.AgentState(user.capital, user.tokens),)
+    close = (lambda a, b: a == b) if scale else (lambda a, b: a == pytest.approx(b, rel=1e-12, abs=1e-9))
+
+    for t in random_walk(2000, seed=len(scenario) + (scale or 0), supply=supply):
+        action, n = ('Buy', t) if t > 0 else ('Sell', -t)
+        expected = ref.buy(n) if t > 0 else ref.sell(n)
+        got = m.buy_tokens(n) if t > 0 else m.sell_tokens(n)
+        user.transaction_update(action, *got)
+        state, agents, (txn,) = kernel.step(state, agents, [(action, n)], curve)
+
+        assert got[0] == expected[0] == txn.tokens
+        for a, b, e in zip(got[1:], (txn.amount, txn.fee), expected[1:]):
+            assert close(a, e) and close(b, e)
+        assert m.tokens_circulation == ref.circulation == state.tokens_circulation
+        for balance, expected_balance in [(m.collateral_balance, ref.collateral), (state.collateral_balance, ref.collateral),
+                                          (m.fund_balance, ref.fund), (state.fund_balance, ref.fund),
+                                          (user.capital, ref.capital), (agents[0].capital, ref.capital)]:
+            assert close(balance, expected_balance)
+        assert user.tokens == ref.tokens == agents[0].tokens
+
+
+def test_kernel_is_pure(make_market):
+    m = make_market('s1', 300)
+    curve = kernel.curve(m.token_dynamics, m.supply)
+    state = kernel.MarketState()
+    after, txn = kernel.buy(state, curve, 10)
+    assert state == kernel.MarketState()
+    assert after.tokens_circulation == 10 and txn.tokens == 10
+    # the end of the table stops a buy
+    after, txn = kernel.buy(after, curve, 10_000)
+    assert after.tokens_circulation == m.supply and txn.tokens == m.supply - 10
+    # capital does not go negative
+    assert kernel.settle(kernel.AgentState(1.0, 0), kernel.Txn('Buy', 1, 5.0, 1.0)).capital == 0
@@ -0,0 +1,28 @@
+"""Simulation metrics shared by the worker processes."""
+
+import diskcache
+
+import metrics
+
+
+def test_scrapes_report_the_shared_totals(app, monkeypatch, tmp_path):
+    monkeypatch.setattr(app, 'metrics_cache', diskcache.Cache(str(tmp_path)))
+    for histogram in app.shared_histograms + [metrics.simulation_steps]:
+        monkeypatch.setattr(histogram, 'values', {})
+    hits, misses = app.cache.stats()
+    app.record_simulation(1000, 0.5, 2.0**30)
+    app.record_simulation(500, 0.5)
+
+    # every scrape, in any worker, reports all the simulations
+    for _ in range(2):
+        text = metrics.exposition()
+        assert 'simulation_steps_total{pid=' in text
+        assert metrics.simulation_steps.values == {(): 1500}
+        counts, total = metrics.simulation_steps_per_second.values[()]
+        assert sum(counts) == 2 and total == 3000.0
+        assert counts[metrics.simulation_steps_per_second.bucket(2000)] == 1
+        assert counts[metrics.simulation_steps_per_second.bucket(1000)] == 1
+        counts, total = metrics.simulation_peak_rss.values[()]
+        assert sum(counts) == 1 and total == 2.0**30
+    # reading the totals is not counted in the long callback cache statistics
+    assert app.cache.stats()[0] == hits
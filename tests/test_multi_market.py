@@ -0,0 +1,43 @@
+"""Markets simulated together, with arbitrage between them."""
+
+import pytest
+
+from multi_market import ArbitrageAgent, MultiMarket
+
+
+@pytest.fixture
+def markets(make_market):
+    # the same sell curve, s3 buys dearer and s4 sells cheaper than s0
+    markets = {name: make_market(name) for name in ('s0', 's3', 's4')}
+    for name, circulation in (('s0', 800), ('s3', 100), ('s4', 600)):
+        markets[name].tokens_circulation = circulation
+    return markets
+
+
+def test_arbitrage_trades_the_same_token(markets):
+    mm = MultiMarket(markets, arbitrageurs=[ArbitrageAgent(10000.0, cost=0.5)]).run(20)
+    agent = mm.arbitrageurs[0]
+    assert agent.trades > 0 and agent.profit > 0
+    # a token bought in one market is sold in another
+    h = mm.history
+    assert h['tokens_circulation'][-1].sum() == h['tokens_circulation'][0].sum()
+    # the markets lose what the agent gains, and the costs leave the system
+    change = (h['collateral_balance'][-1] + h['fund_balance'][-1]
+              - h['collateral_balance'][0] - h['fund_balance'][0]).sum()
+    assert change == pytest.approx(-agent.profit - agent.cost * agent.trades)
+
+
+def test_no_arbitrage_between_competing_tokens(markets):
+    tokens = {'s0': 'A', 's3': 'B', 's4': 'A'}
+    mm = MultiMarket(markets, arbitrageurs=[ArbitrageAgent(10000.0)], tokens=tokens).run(20)
+    trades = mm.capital_flight().filter(like='arb_to_')
+    assert trades.loc['s0', 'arb_to_s3'] == trades.loc['s3', 'arb_to_s0'] == 0
+    assert trades.loc['s3', 'arb_to_s4'] == trades.loc['s4', 'arb_to_s3'] == 0
+    # each token keeps its circulation, the other pair still trades
+    h = mm.history
+    assert h['tokens_circulation'][-1][1] == h['tokens_circulation'][0][1]
+    assert mm.trades.sum() == trades.loc['s0', 'arb_to_s4'] + trades.loc['s4', 'arb_to_s0'] > 0
+
+    separate = MultiMarket(markets, arbitrageurs=[ArbitrageAgent(10000.0)],
+                           tokens={'s0': 'A', 's3': 'B', 's4': 'C'}).run(20)
+    assert separate.trades.sum() == 0 and separate.arbitrageurs[0].profit == 0
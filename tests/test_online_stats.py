@@ -0,0 +1,151 @@
+"""Streaming statistics against the same values computed from the full
+history of a run."""
+
+import math
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import online_stats
+
+
+def history(steps:int, seed:int) -> pd.DataFrame:
+    """A run with irregular times, some empty steps and a price at zero."""
+    rng = np.random.default_rng(seed)
+    action = rng.choice(['Buy', 'Sell', ''], steps, p=[0.5, 0.3, 0.2])
+    buy_price = rng.lognormal(0, 0.05, steps).cumprod() * 10
+    buy_price[steps // 3] = 0.0
+    return pd.DataFrame({
+        'time': np.cumsum(rng.exponential(1.0, steps)),
+        'tokens_circulation': rng.integers(0, 50, steps),
+        'collateral_balance': rng.uniform(0, 500, steps),
+        'buy_price': buy_price,
+        'sell_price': buy_price * 0.9,
+        'action': action,
+        'tokens': rng.integers(1, 5, steps),
+        'amount': rng.uniform(1, 50, steps),
+        'fee': rng.uniform(0, 2, steps),
+        'capital': rng.uniform(0, 1000, steps),
+        'agent_tokens': rng.integers(0, 100, steps),
+    })
+
+
+def feed(stats:online_stats.OnlineStats, df:pd.DataFrame, run:int=1) -> None:
+    for row in df.itertuples():
+        stats.update(row.time,
+                     {'tokens_circulation': row.tokens_circulation, 'collateral_balance': row.collateral_balance,
+                      'buy_price': row.buy_price, 'sell_price': row.sell_price},
+                     {0: {'capital': row.capital, 'tokens': row.agent_tokens}},
+                     {0: {'action': row.action, 'tokens': row.tokens, 'amount': row.amount, 'fee': row.fee}},
+                     run)
+
+
+def full_history_values(df:pd.DataFrame) -> dict:
+    """The values of online_stats.RunStats, with its conventions for runs
+    too short to average: the current price and ratio without elapsed
+    time, no spread below two returns."""
+    t = df['time'].to_numpy()
+    dt = np.diff(t)
+    elapsed = t[-1] - t[0]
+    market_value = df['tokens_circulation'].to_numpy() * df['sell_price'].to_numpy()
+    ratio = np.where(market_value > 0, df['collateral_balance'] / np.where(market_value > 0, market_value, 1), np.nan)
+    held = ~np.isnan(ratio[:-1])
+    current = None if np.isnan(ratio[-1]) else ratio[-1]
+    price = df['buy_price'].to_numpy()
+    valid = (price[:-1] > 0) & (price[1:] > 0)
+    returns = np.log(price[1:][valid] / price[:-1][valid])
+    wealth = (df['capital'] + df['agent_tokens'] * df['sell_price']).to_numpy()
+    peak = np.maximum.accumulate(wealth)
+    drawdown = peak - wealth
+    buys, sells = df['action'] == 'Buy', df['action'] == 'Sell'
+    return {
+        'steps': len(df),
+        'time': t[-1],
+        'twap_buy_price': (price[:-1] * dt).sum() / elapsed if elapsed else price[-1],
+        'twap_sell_price': (df['sell_price'].to_numpy()[:-1] * dt).sum() / elapsed if elapsed
+                           else df['sell_price'].iat[-1],
+        'collateral_ratio': current,
+        'min_collateral_ratio': None if np.isnan(ratio).all() else np.nanmin(ratio),
+        'twa_collateral_ratio': (ratio[:-1][held] * dt[held]).sum() / dt[held].sum() if held.any() else current,
+        'realised_volatility': math.sqrt((returns ** 2).sum()),
+        'return_std': returns.std(ddof=1) if len(returns) > 1 else 0.0,
+        'buys': int(buys.sum()),
+        'sells': int(sells.sum()),
+        'buy_tokens': int(df.loc[buys, 'tokens'].sum()),
+        'sell_tokens': int(df.loc[sells, 'tokens'].sum()),
+        'buy_amount': df.loc[buys, 'amount'].sum(),
+        'sell_amount': df.loc[sells, 'amount'].sum(),
+        'fees': df.loc[buys | sells, 'fee'].sum(),
+        'wealth_0': wealth[-1],
+        'pnl_0': wealth[-1] - wealth[0],
+        'drawdown_0': drawdown[-1],
+        'max_drawdown_0': drawdown.max(),
+        'max_drawdown_ratio_0': (drawdown[peak > 0] / peak[peak > 0]).max(),
+    }
+
+
+def assert_values(got:dict, expected:dict) -> None:
+    assert set(got) == set(expected)
+    for name, value in expected.items():
+        if value is None:
+            assert got[name] is None, name
+        else:
+            assert got[name] == pytest.approx(value, rel=1e-9, abs=1e-12), name
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_final_values_match_full_history(seed):
+    df = history(500, seed)
+    stats = online_stats.OnlineStats()
+    feed(stats, df)
+    assert_values(stats.values(1), full_history_values(df))
+
+
+def test_snapshots_match_history_prefixes():
+    df = history(400, 3)
+    stats = online_stats.OnlineStats(snapshot_every=25.0)
+    feed(stats, df)
+    snapshots = stats.snapshots_frame()
+    assert len(snapshots)
+    for snapshot in snapshots.to_dict('records'):
+        prefix = df[df['time'] <= snapshot.pop('time')]
+        snapshot.pop('run')
+        expected = full_history_values(prefix)
+        expected.pop('time')
+        # the frame holds missing ratios as NaN
+        snapshot = {k: None if expected[k] is None and pd.isna(v) else v for k, v in snapshot.items()}
+        assert_values(snapshot, expected)
+
+
+def test_runs_are_kept_apart_and_scaled():
+    scale = 10**6
+    a, b = history(200, 4), history(300, 5)
+    stats = online_stats.OnlineStats()
+    feed(stats, a, run=1)
+    feed(stats, b, run=2)
+    scaled = online_stats.OnlineStats(scale=scale)
+    for run, df in ((1, a), (2, b)):
+        units = df.copy()
+        for column in ['collateral_balance', 'buy_price', 'sell_price', 'amount', 'fee', 'capital']:
+            units[column] = units[column] * scale
+        feed(scaled, units, run)
+    for run, df in ((1, a), (2, b)):
+        assert_values(stats.values(run), full_history_values(df))
+        assert_values(scaled.values(run), full_history_values(df))
+    assert stats.values()['steps'] == 250
+
+
+def test_run_statistics_of_a_simulation(app):
+    app.simulation_parameters['T'] = range(300)
+    app.simulation_parameters['N'] = 1
+    app.token_user.initial_capital = 2000.0
+    result = app.run_simulation()
+    market = pd.DataFrame(result['market_state'].tolist())
+    agent = pd.DataFrame(result['agent_state'].tolist())
+    txn = pd.DataFrame(result['agent_txn'].tolist())
+    df = pd.concat([result[['timestep']].rename(columns={'timestep': 'time'}),
+                    market[['tokens_circulation', 'collateral_balance', 'buy_price', 'sell_price']],
+                    txn[['action', 'tokens', 'amount', 'fee']],
+                    agent[['capital']], agent[['tokens']].rename(columns={'tokens': 'agent_tokens'})], axis=1)
+    assert_values(app.run_statistics.values(1), full_history_values(df))
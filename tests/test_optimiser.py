@@ -0,0 +1,53 @@
+"""Inverse design of curve parameters."""
+
+import numpy as np
+import pytest
+
+import optimiser
+import sigmoid
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    optimiser.clear_cache()
+    yield
+    optimiser.clear_cache()
+
+
+@pytest.mark.parametrize('scenario', sorted(sigmoid.scenarios))
+def test_metrics_are_those_of_the_curve_table(scenario):
+    search = optimiser.CurveOptimiser(scenario, 800, 5000, fund_supply=600)
+    point = search._snap(np.array([[(lo + hi) / 3 for lo, hi, _ in (search.bounds[n] for n in search.names)]]))
+    fund, tax_min, tax_max, ratio = search._evaluate(point)[0]
+    p = search.curve_parameters(point[0].tolist())
+    table = sigmoid.Sigmoid(1, 800, 50).token_dynamics(np.arange(0., 801), p, text=False)
+    tax_rate = 1 - table['sell_price'] / table['buy_price']
+    tax_rate = tax_rate[np.isfinite(tax_rate)]
+    assert fund == pytest.approx(table['buy_col'][600] - table['sell_col'][600])
+    assert (tax_min, tax_max) == pytest.approx((tax_rate.min(), tax_rate.max()))
+    assert ratio == pytest.approx(table['sell_col'][600] / table['buy_col'][600], nan_ok=True)
+
+
+def test_searches_share_evaluated_points(monkeypatch):
+    evaluated = []
+    evaluate = optimiser.CurveOptimiser._evaluate
+    monkeypatch.setattr(optimiser.CurveOptimiser, '_evaluate',
+                        lambda self, points: evaluated.append(len(points)) or evaluate(self, points))
+    first = optimiser.CurveOptimiser('s3', 1000, 5000, tax_band=(0.05, 0.5)).search()
+    n = sum(evaluated)
+    assert n == first['evaluations']
+    # a new optimiser, as for every press of the dashboard button
+    again = optimiser.CurveOptimiser('s3', 1000, 5000, tax_band=(0.05, 0.5)).search()
+    assert sum(evaluated) == n
+    assert again == first
+    # other targets score the same points
+    optimiser.CurveOptimiser('s3', 1000, 8000).search(iterations=1)
+    assert sum(evaluated) == n
+
+
+def test_search_stays_within_limits():
+    limits = {'buy_price': (10, 20), 'buy_slope': (100, 200), 'tax': (0.1, 1.0)}
+    result = optimiser.CurveOptimiser('s3', 1000, 1e9, limits=limits).search(iterations=3)
+    p = result['curve_parameters']
+    assert 10 <= p['buy_price'] <= 20 and 100 <= p['buy_slope'] <= 200
+    assert 0.1 <= p['tax'] <= sigmoid.t_max - sigmoid.t_step
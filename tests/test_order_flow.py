@@ -0,0 +1,44 @@
+"""'Flow' policy agents trading stochastic demand."""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import kernel
+import order_flow
+
+
+def test_affordable_is_the_largest_buy_within_capital(make_market):
+    market = make_market('s1')
+    market.tokens_circulation = 400
+    curve = market.curve()
+    for capital in [0.0, 1.0, 500.0, 12345.6, 1e12]:
+        n = kernel.affordable(market.state, curve, capital, 250)
+        _, txn = kernel.buy(market.state, curve, n)
+        assert txn.tokens == n and txn.amount + txn.fee <= capital
+        if n < 250:
+            _, txn = kernel.buy(market.state, curve, n + 1)
+            assert txn.tokens == n or txn.amount + txn.fee > capital
+
+
+def test_flow_agents_do_not_overdraw(app):
+    app.simulation_parameters['T'] = range(400)
+    app.simulation_parameters['N'] = 2
+    app.token_user.initial_capital = 2000.0
+    app.curve_schedule = None
+    app.agent_order_flow = order_flow.OrderFlow(seed=3, arrival_rate=4, size_mean=30)
+    result = app.run_simulation()
+    assert app.token_user.policy == 'Flow'
+    assert app.auditor.counts['tokens'] == app.auditor.counts['circulation'] == 0
+
+    result = result[result['timestep'] > 0]
+    txns = pd.DataFrame(result['agent_txn'].tolist())
+    agents = pd.DataFrame(result['agent_state'].tolist())
+    assert set(txns['action']) >= {'Buy', 'Sell'}
+    for run in (1, 2):
+        rows = (result['run'] == run).to_numpy()
+        capital = np.concatenate([[2000.0], agents['capital'][rows].to_numpy()[:-1]])
+        buys = (txns['action'][rows] == 'Buy').to_numpy()
+        cost = (txns['amount'] + txns['fee'])[rows].to_numpy()
+        assert (cost[buys] <= capital[buys]).all()
+        assert (agents['tokens'][rows] >= 0).all()
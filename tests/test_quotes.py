@@ -0,0 +1,82 @@
+"""Quotes against the trades of a Market, and the requests refused."""
+
+import flask
+import pytest
+
+import quotes
+
+
+@pytest.fixture
+def market(make_market):
+    return make_market('s1')
+
+
+@pytest.fixture
+def engine(market):
+    return quotes.QuoteEngine(market)
+
+
+@pytest.mark.parametrize('supply, tokens', [(0, 10), (400, 1), (990, 25)])
+def test_quotes_match_market_trades(market, engine, supply, tokens):
+    buy, sell, budget = engine.quote([{'type': 'buy', 'supply': supply, 'tokens': tokens},
+                                      {'type': 'sell', 'supply': supply, 'tokens': tokens},
+                                      {'type': 'budget', 'supply': supply, 'amount': 5000.0}])
+    market.tokens_circulation = supply
+    filled, amount, fee = market.buy_tokens(tokens)
+    assert (buy['tokens'], buy['amount'], buy['fee']) == pytest.approx((filled, amount, fee))
+    market.tokens_circulation = supply
+    filled, amount, fee = market.sell_tokens(tokens)
+    assert (sell['tokens'], sell['amount'], sell['fee']) == pytest.approx((filled, amount, fee))
+
+    # the budget buys the most tokens it pays for
+    market.tokens_circulation = supply
+    _, amount, _ = market.buy_tokens(budget['tokens'])
+    assert amount == pytest.approx(budget['amount']) and amount <= 5000.0
+    market.tokens_circulation = supply
+    filled, amount, _ = market.buy_tokens(budget['tokens'] + 1)
+    assert filled == budget['tokens'] or amount > 5000.0
+
+
+def test_large_counts_stop_at_the_end_of_the_table(engine):
+    last = len(engine.market.token_dynamics) - 1
+    quote, = engine.quote([{'type': 'buy', 'supply': 10, 'tokens': 1e30}])
+    assert quote['tokens'] == last - 10
+    quote, = engine.quote([{'type': 'budget', 'supply': 10, 'amount': 1e300}])
+    assert quote['tokens'] == last - 10
+
+
+@pytest.mark.parametrize('request_', [
+    {'type': 'buy', 'supply': 10, 'tokens': float('nan')},
+    {'type': 'sell', 'supply': 10, 'tokens': float('inf')},
+    {'type': 'buy', 'supply': 10, 'tokens': 2.9},
+    {'type': 'buy', 'supply': 10, 'tokens': -1},
+    {'type': 'budget', 'supply': 10, 'amount': float('nan')},
+    {'type': 'buy', 'supply': 2.5, 'tokens': 1},
+    {'type': 'buy', 'supply': float('nan'), 'tokens': 1},
+    {'type': 'buy', 'supply': 1e30, 'tokens': 1},
+    {'type': 'buy', 'supply': 10},
+    {'type': 'swap', 'supply': 10, 'tokens': 1},
+])
+def test_invalid_quotes(engine, request_):
+    with pytest.raises(quotes.QuoteError):
+        engine.quote([{'type': 'buy', 'supply': 0, 'tokens': 1}, request_])
+
+
+def test_invalid_quotes_are_bad_requests(engine):
+    server = flask.Flask(__name__)
+    quotes.init_quotes(server, engine)
+    client = server.test_client()
+    ok = client.get('/quote?type=buy&supply=10&tokens=3')
+    assert ok.status_code == 200 and ok.get_json()['quotes'][0]['tokens'] == 3
+    for body in ({'quotes': [{'type': 'buy', 'supply': 10, 'tokens': 1e30}]},):
+        assert client.post('/quote', json=body).status_code == 200
+    for body in ({'quotes': [{'type': 'buy', 'supply': 10, 'tokens': 2.9}]},
+                 {'quotes': [{'type': 'buy', 'supply': 1e30, 'tokens': 1}]},
+                 {'quotes': [{'type': 'buy', 'supply': 10, 'tokens': 1}], 'curve': {'supply': 1e30}},
+                 {'quotes': 'buy'}):
+        response = client.post('/quote', json=body)
+        assert response.status_code == 400 and 'error' in response.get_json()
+    # JSON has no NaN, but Python's encoder writes it
+    response = client.post('/quote', data='{"quotes": [{"type": "buy", "supply": 10, "tokens": NaN}]}',
+                           content_type='application/json')
+    assert response.status_code == 400
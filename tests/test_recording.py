@@ -0,0 +1,71 @@
+"""Recorded runs against the full history of the same runs."""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import recording
+
+state_columns = ['market_state', 'agent_state', 'agent_txn']
+
+
+def last_substeps(result:pd.DataFrame) -> pd.DataFrame:
+    return result.drop_duplicates(['run', 'timestep'], keep='last').reset_index(drop=True)
+
+
+@pytest.fixture
+def run(app):
+    app.simulation_parameters['T'] = range(420)
+    app.simulation_parameters['N'] = 1
+    app.token_user.policy = 'Buy'
+    app.token_user.initial_capital = 3000.0
+    app.curve_schedule = None
+    return app.run_simulation
+
+
+@pytest.mark.parametrize('fast_forward', [True, False])
+def test_every_keeps_every_kth_and_final_step(app, run, monkeypatch, fast_forward):
+    monkeypatch.setattr(app, 'recording_segment', 100)
+    full = last_substeps(run(fast_forward=fast_forward))
+    recorded = run(fast_forward=fast_forward, recorder=recording.Recorder(default=recording.Every(50)))
+
+    kept = full[(full['timestep'] % 50 == 0) | (full['timestep'] == full['timestep'].max())]
+    assert recorded['timestep'].tolist() == kept['timestep'].tolist()
+    for column in state_columns:
+        assert recorded[column].tolist() == kept[column].tolist()
+
+
+def test_policies_per_variable(run):
+    full = last_substeps(run(fast_forward=False))
+    recorded = recording.Recorder({'agent_txn': recording.OnChange(), 'agent_state': recording.Final(),
+                                   'market_state': recording.Window(64, ('min', 'max', 'last'))},
+                                  default=recording.Final())
+    # fed in uneven chunks, the windows span chunks
+    for start in range(0, len(full), 37):
+        recorded.record_frame(full.iloc[start:start + 37])
+    frames = recorded.frames()
+
+    txns = full['agent_txn'].tolist()
+    changed = [0] + [i for i in range(1, len(txns)) if txns[i] != txns[i - 1]]
+    assert frames['agent_txn']['timestep'].tolist() == full['timestep'].iloc[changed].tolist()
+    assert frames['agent_state'][['timestep', 'agent_state']].values.tolist() == \
+        [[full['timestep'].iloc[-1], full['agent_state'].iloc[-1]]]
+
+    market = pd.DataFrame(full['market_state'].tolist())
+    windows = market.groupby(full['timestep'].to_numpy() // 64)
+    windowed = pd.DataFrame(frames['market_state']['market_state'].tolist())
+    assert frames['market_state']['timestep'].tolist() == \
+        full['timestep'].groupby(full['timestep'].to_numpy() // 64).max().tolist()
+    np.testing.assert_allclose(windowed['buy_price_min'], windows['buy_price'].min())
+    np.testing.assert_allclose(windowed['buy_price_max'], windows['buy_price'].max())
+    np.testing.assert_allclose(windowed['tokens_circulation_last'], windows['tokens_circulation'].last())
+
+
+def test_dashboard_recording_policy(app, run, monkeypatch):
+    full = last_substeps(run())
+    monkeypatch.setattr(app, 'recording_policy', recording.Every(100))
+    recorded = run(recorder=app.dashboard_recorder())
+    assert recorded['timestep'].tolist() == [0, 100, 200, 300, 400, 420]
+    assert recorded['market_state'].iloc[-1] == full['market_state'].iloc[-1]
+    monkeypatch.setattr(app, 'recording_policy', None)
+    assert app.dashboard_recorder() is None
@@ -0,0 +1,83 @@
+"""Replayed trade logs against the same trades on a Market."""
+
+import numpy as np
+import pandas as pd
+
+import replay
+
+
+def trades(n:int, seed:int=0) -> pd.DataFrame:
+    """Random trades whose sells never exceed the circulation."""
+    rng = np.random.default_rng(seed)
+    actions, tokens = [], []
+    circulation = 0
+    for _ in range(n):
+        size = int(rng.integers(1, 20))
+        if rng.random() < 0.45 and circulation >= size:
+            actions.append('Sell')
+            circulation -= size
+        else:
+            actions.append('buy')
+            circulation += size
+        tokens.append(size)
+    return pd.DataFrame({'action': actions, 'tokens': tokens})
+
+
+def test_replay_matches_market(make_market):
+    log = trades(3000)
+    market = make_market('s1', supply=100000)
+    expected = []
+    for action, tokens in log.itertuples(index=False):
+        if action == 'buy':
+            market.buy_tokens(tokens)
+        else:
+            market.sell_tokens(tokens)
+        expected.append((market.tokens_circulation, market.collateral_balance, market.fund_balance))
+    expected = np.array(expected)
+
+    replayed = make_market('s1', supply=100000)
+    r = replay.Replay(replayed, window_rows=700)
+    windows = pd.concat(r.replay([log.iloc[i:i + 1000] for i in range(0, len(log), 1000)]),
+                        ignore_index=True)
+    assert r.clipped == r.skipped == 0
+    assert windows['trades'].sum() == len(log)
+    last = windows['last_row'].to_numpy()
+    np.testing.assert_array_equal(windows['tokens_circulation'], expected[last, 0])
+    # prefix sums and Market's slice sums round differently
+    np.testing.assert_allclose(windows['collateral_balance'], expected[last, 1], atol=1e-6)
+    np.testing.assert_allclose(windows['fund_balance'], expected[last, 2], atol=1e-6)
+    assert replayed.tokens_circulation == market.tokens_circulation
+
+
+def test_missing_and_invalid_values_are_skipped(make_market, tmp_path):
+    log = trades(50)
+    path = tmp_path / 'log.csv'
+    text = log.to_csv(index=False).splitlines()
+    # empty tokens, empty action, unknown action, non-finite tokens
+    text[1:1] = ['buy,', ',4', 'hold,3', 'sell,nan', 'buy,inf']
+    path.write_text('\n'.join(text) + '\n')
+
+    market = make_market('s1')
+    r = replay.Replay(market, window_rows=20)
+    windows = pd.concat(r.replay(replay.read_log(str(path), r.log_columns(), chunk_rows=16, categories=['action'])))
+    assert r.skipped == 5 and r.clipped == 0
+
+    reference = make_market('s1')
+    pd.concat(replay.Replay(reference, window_rows=20).replay([log]))
+    assert market.state == reference.state
+    assert windows['trades'].sum() == len(log) + 5
+
+
+def test_numeric_actions_and_clipping(make_market):
+    market = make_market('s1')
+    last = len(market.token_dynamics) - 1
+    log = pd.DataFrame({'action': [1.0, np.nan, -1.0, -1.0, 1.0],
+                        'tokens': [10, 5, 4, 2 * last, 1e30]})
+    r = replay.Replay(market)
+    windows = pd.concat(r.replay([log]))
+    assert r.skipped == 1
+    # the sell stops at zero circulation and the buy at the end of the table
+    assert r.clipped == (2 * last - 6) + (replay.max_tokens - last)
+    assert market.tokens_circulation == last
+    assert windows['tokens_bought'].sum() == 10 + last
+    assert windows['tokens_sold'].sum() == 4 + 6
@@ -0,0 +1,100 @@
+"""Scheduled curve changes against tables built for the changed curves."""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import curve_store
+import fixed_point
+import sigmoid
+from schedule import Schedule
+
+changes = [
+    # (timestep, change) of each kind of update of an s3 table
+    (10, {'tax': 0.05}),
+    (20, {'buy_price': 80.0}),
+    (30, {'sell_slope': 1e5, 'supply': 1500}),
+    (40, {'supply': 1200}),
+    (50, {'sell_price': 40.0, 'buy_supply': 450.0}),
+]
+
+
+def fresh_table(market) -> pd.DataFrame:
+    supply = market.curve_parameters['supply']
+    return market.bonding_curve.token_dynamics(np.arange(0., supply + 1), market.curve_parameters,
+                                               text=False)
+
+
+@pytest.mark.parametrize('scale', [None, fixed_point.default_scale])
+def test_updates_match_rebuilt_tables(make_market, scale):
+    market = make_market('s3', scale=scale)
+    market.tokens_circulation = 300
+    schedule = Schedule(changes)
+    schedule.start(market)
+    for t, change in changes:
+        assert not schedule.apply(t - 1)
+        assert schedule.apply(t)
+        assert market.curve_parameters == dict(market.curve_parameters, **change)
+        assert market.supply == market.curve_parameters['supply'] == len(market.token_dynamics) - 1
+        expected = fresh_table(market)
+        np.testing.assert_allclose(market.token_dynamics[sigmoid.curve_columns],
+                                   expected[sigmoid.curve_columns], rtol=1e-12, atol=1e-12)
+        if scale:
+            units = fixed_point.table_units(market.token_dynamics, scale)
+            for column, values in units.items():
+                np.testing.assert_array_equal(market.token_units[column], values)
+    assert schedule.updates == len(changes)
+
+
+def test_unchanged_curves_cost_nothing(make_market):
+    market = make_market('s3')
+    schedule = Schedule([(5, {'supply': 1000}), (6, {'horizontal_displacement': 150.0})])
+    schedule.start(market)
+    table = market.token_dynamics
+    # s3 has no horizontal displacement
+    assert not schedule.apply(10)
+    assert market.token_dynamics is table and schedule.updates == 0
+    assert market.curve_parameters['horizontal_displacement'] == 150.0
+
+
+def test_reset_restores_the_curve(make_market, tmp_path):
+    store = curve_store.CurveStore(str(tmp_path))
+    market = make_market('s1', scale=fixed_point.default_scale, curve_store=store)
+    initial = (market.token_dynamics, market.token_units, market.supply, market.curve_parameters)
+    stored = market.token_dynamics.to_numpy(copy=True)
+
+    schedule = Schedule.linear('tax', 0.2, 0.02, first=0, last=100, every=10)
+    for _ in range(2):
+        schedule.start(market)
+        schedule.apply(60)
+        assert market.curve_parameters['tax'] == pytest.approx(0.092)
+        # started again without a reset, it restores the market first
+    schedule.reset()
+    assert market.token_dynamics is initial[0] and market.token_units is initial[1]
+    assert (market.supply, market.curve_parameters) == initial[2:]
+    # the store's memory-mapped table is never written to
+    np.testing.assert_array_equal(market.token_dynamics.to_numpy(), stored)
+    np.testing.assert_array_equal(store.get(next(iter(store.keys()))).to_numpy(), stored)
+
+
+def test_scheduled_run_trades_on_the_changed_curve(app):
+    app.simulation_parameters['T'] = range(200)
+    app.simulation_parameters['N'] = 1
+    app.token_user.policy = 'Buy'
+    app.token_user.initial_capital = 100000.0
+    app.curve_schedule = Schedule([(100, {'buy_price': 80.0})])
+    market = app.sigmoid_market
+    table = market.token_dynamics
+    changed = market.bonding_curve.token_dynamics(np.arange(0., market.supply + 1),
+                                                  dict(market.curve_parameters, buy_price=80.0), text=False)
+    result = app.run_simulation()
+    txns = pd.DataFrame(result['agent_txn'].tolist())
+    circulation = pd.DataFrame(result['market_state'].tolist())['tokens_circulation']
+    # a buy at circulation c pays buy_price[c] of the curve of its timestep
+    bought = circulation.shift().fillna(0).astype(int).to_numpy()
+    steps = result['timestep'].to_numpy()
+    before, after = (steps > 0) & (steps < 100), steps >= 100
+    np.testing.assert_allclose(txns['amount'][before], table['buy_price'].to_numpy()[bought[before]])
+    np.testing.assert_allclose(txns['amount'][after], changed['buy_price'].to_numpy()[bought[after]])
+    # the market is left on the curve the run started with
+    assert market.token_dynamics is table
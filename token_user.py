@@ -7,40 +7,78 @@ import random
 
 import logging
 
+import fixed_point
+import kernel
+
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
 class TokenUser:
     tokens = 0
     capital = 100000
-    transaction_history = []
 
     initial_tokens = tokens
     initial_capital = capital
 
     policy = 'Buy'
     # policy = 'Alternate'
-
-    def __init__(self, tokens:float, capital:float) -> None:
+    # policy = 'Flow'
+
+    # order_flow.OrderFlow of the 'Flow' policy
+    order_flow = None
+
+    # Most recent transactions kept in transaction_history, None for all.
+    # The policies only look at the last one.
+    history_limit = None
+
+    # Fixed-point accounting: capital is held in integer units of
+    # 1/scale, matching a Market with the same scale
+    scale = None
+
+    def __init__(self, tokens:float, capital:float, scale:int=None, order_flow=None) -> None:
+        self.scale = scale
+        if order_flow is not None:
+            self.order_flow = order_flow
+            self.policy = 'Flow'
+        if scale:
+            capital = fixed_point.to_units(capital, scale)
         self.tokens = tokens
         self.initial_tokens = tokens
         self.capital = capital
         self.initial_capital = capital
+        # per agent, a class level list would be shared by all of them
+        self.transaction_history = []
+
+
+    @property
+    def state(self) -> kernel.AgentState:
+        return kernel.AgentState(self.capital, self.tokens)
 
 
     def reset(self):
         self.tokens = self.initial_tokens
         self.capital = self.initial_capital
         self.transaction_history = []
+        if self.order_flow is not None:
+            self.order_flow.reset()
 
 
-    def get_transaction(self, price: float) -> Tuple[str, float]:
+    def get_transaction(self, price: float, run: int = 1, timestep: int = None, market=None) -> Tuple[str, float]:
         """Get the transaction the agent wants to execute.
 
         Parameters
         ----------
         price: float
             The price of the token.
+        run: int
+            Monte Carlo run, selects the order flow stream of the 'Flow' policy.
+        timestep: int
+            Timestep of the 'Flow' policy order, the one after the previous
+            order if None.
+        market: Market
+            Market of the trade.  'Flow' buys are limited to the tokens the
+            capital pays for with the fee along its curve, or at the
+            current price without it.
 
         Returns
         -------
@@ -67,6 +105,24 @@ class TokenUser:
                 elif last_action == 'Sell':
                     action = 'Buy'
                 return action, number_of_tokens
+        elif self.policy == 'Flow':
+            # Net stochastic order of the step, limited to the tokens held
+            # and the tokens the capital buys
+            stream = self.order_flow.stream(run)
+            if timestep is None:
+                action, number_of_tokens, _ = stream.next()
+            else:
+                action, number_of_tokens, _ = stream.order(timestep)
+            if action == 'Buy' and market is not None:
+                number_of_tokens = kernel.affordable(market.state, market.curve(), self.capital,
+                                                     number_of_tokens)
+            elif action == 'Buy' and cost > 0:
+                number_of_tokens = min(number_of_tokens, int(self.capital // price))
+            elif action == 'Sell':
+                number_of_tokens = min(number_of_tokens, max(0, int(self.tokens)))
+            if number_of_tokens <= 0:
+                return '', 0
+            return action, number_of_tokens
 
 
     def transaction_update(self, action: str, tokens: float, amount: float, fee: float) -> Tuple[float, float]:
@@ -96,14 +152,10 @@ class TokenUser:
                 'fee': fee
             }
         )
-        
-        if action == 'Buy':
-            self.capital += -amount - fee
-            self.tokens += tokens
-        elif action == 'Sell':
-            self.capital += amount - fee
-            self.tokens -= tokens
-        self.capital = max(0, self.capital)
+        if self.history_limit and len(self.transaction_history) > self.history_limit:
+            del self.transaction_history[:-self.history_limit]
+
+        self.capital, self.tokens = kernel.settle(self.state, kernel.Txn(action, tokens, amount, fee))
         logger.debug(f'update_capital amount {amount} fee {fee} remaining capital {self.capital}')
         return self.capital, self.tokens
 